@@ -0,0 +1,240 @@
+#Admission control: per-upstream rate limits and a bounded queue of turns
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+from metrics import registry
+
+UPSTREAMS = ("stt", "vision", "chat", "tts")
+# How long an API call may wait for its upstream before the turn is shed
+UPSTREAM_WAIT = float(os.environ.get("MEDIVOX_UPSTREAM_WAIT", "10"))
+# Turns allowed to wait; beyond this patients get an immediate "busy" reply
+TURN_QUEUE_SIZE = int(os.environ.get("MEDIVOX_QUEUE_SIZE", "32"))
+# Longest a queued turn waits before it is shed
+TURN_QUEUE_TIMEOUT = float(os.environ.get("MEDIVOX_QUEUE_TIMEOUT", "60"))
+
+
+class Overloaded(Exception):
+    """Raised instead of waiting indefinitely when an upstream or the turn queue is saturated"""
+
+    def __init__(self, what, retry_after=1.0):
+        super().__init__(f"{what} is busy, retry in {retry_after:.0f}s")
+        self.what = what
+        self.retry_after = retry_after
+
+
+def is_overload_error(error):
+    """True for local shedding and for provider rate-limit (HTTP 429) errors"""
+    return isinstance(error, Overloaded) or getattr(error, "status_code", None) == 429
+
+
+class TokenBucket:
+    """Refills rate tokens per second up to burst; not thread-safe on its own"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    def reserve(self):
+        """Take a token and return 0, or return the seconds until one is available"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class UpstreamLimiter:
+    """
+    Caps concurrent calls to one upstream and, when requests_per_minute is
+    set, their rate. A call that can't start within UPSTREAM_WAIT raises
+    Overloaded so the patient gets a quick "busy" answer.
+    """
+
+    def __init__(self, name, max_concurrent, requests_per_minute=0, burst=None):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.bucket = None
+        if requests_per_minute > 0:
+            self.bucket = TokenBucket(requests_per_minute / 60.0, burst or max_concurrent)
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def _try_acquire(self):
+        # Caller holds the condition; returns 0 once admitted, else a wait hint
+        if self.in_flight >= self.max_concurrent:
+            return 0.05
+        if self.bucket is not None:
+            wait = self.bucket.reserve()
+            if wait:
+                return wait
+        self.in_flight += 1
+        return 0.0
+
+    def _release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def _shed(self, wait):
+        registry.inc("medivox_upstream_shed_total", upstream=self.name)
+        raise Overloaded(self.name, retry_after=max(wait, 1.0))
+
+    def acquire(self, timeout=UPSTREAM_WAIT):
+        start = time.monotonic()
+        deadline = start + timeout
+        with self._cond:
+            while True:
+                wait = self._try_acquire()
+                if not wait:
+                    break
+                remaining = deadline - time.monotonic()
+                if wait > remaining:
+                    self._shed(wait)
+                self._cond.wait(min(wait, remaining))
+        registry.observe("medivox_upstream_wait_seconds", time.monotonic() - start, upstream=self.name)
+
+    async def acquire_async(self, timeout=UPSTREAM_WAIT):
+        start = time.monotonic()
+        deadline = start + timeout
+        while True:
+            with self._cond:
+                wait = self._try_acquire()
+            if not wait:
+                break
+            remaining = deadline - time.monotonic()
+            if wait > remaining:
+                self._shed(wait)
+            await asyncio.sleep(min(wait, remaining))
+        registry.observe("medivox_upstream_wait_seconds", time.monotonic() - start, upstream=self.name)
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def slot_async(self):
+        await self.acquire_async()
+        try:
+            yield
+        finally:
+            self._release()
+
+
+def _limiter_from_env(name):
+    prefix = f"MEDIVOX_{name.upper()}"
+    burst = os.environ.get(f"{prefix}_BURST")
+    return UpstreamLimiter(
+        name,
+        max_concurrent=int(os.environ.get(f"{prefix}_CONCURRENCY", "8")),
+        requests_per_minute=float(os.environ.get(f"{prefix}_RPM", "0")),
+        burst=int(burst) if burst else None,
+    )
+
+
+_limiters = {name: _limiter_from_env(name) for name in UPSTREAMS}
+
+
+def limiter(name):
+    """The shared limiter of an upstream: "stt", "vision", "chat" or "tts" """
+    return _limiters[name]
+
+
+def chat_upstream(messages):
+    """Requests with an image count against the vision quota, others against chat"""
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list) and any(part.get("type") == "image_url" for part in content):
+            return "vision"
+    return "chat"
+
+
+class Ticket:
+    """A turn's place in the AdmissionQueue"""
+
+    def __init__(self):
+        self.admitted = False
+        self.enqueued_at = time.monotonic()
+
+
+class AdmissionQueue:
+    """
+    FIFO admission of consultation turns: at most max_active run, up to
+    max_waiting wait in line (and can report their position), the rest are
+    rejected immediately with Overloaded.
+    """
+
+    def __init__(self, max_active, max_waiting=TURN_QUEUE_SIZE):
+        self.max_active = max_active
+        self.max_waiting = max_waiting
+        self.active = 0
+        self._waiting = deque()
+        self._cond = threading.Condition()
+
+    def enter(self):
+        """Return a Ticket, already admitted when a slot is free"""
+        ticket = Ticket()
+        with self._cond:
+            if self.active < self.max_active and not self._waiting:
+                self.active += 1
+                ticket.admitted = True
+            elif len(self._waiting) >= self.max_waiting:
+                registry.inc("medivox_turns_shed_total", reason="queue_full")
+                raise Overloaded("the doctor", retry_after=5.0)
+            else:
+                self._waiting.append(ticket)
+        return ticket
+
+    def position(self, ticket):
+        """1-based place in line, 0 once admitted"""
+        with self._cond:
+            return 0 if ticket.admitted else self._waiting.index(ticket) + 1
+
+    def wait(self, ticket, timeout):
+        """Block up to timeout seconds; True once the ticket is admitted"""
+        with self._cond:
+            return self._cond.wait_for(lambda: ticket.admitted, timeout)
+
+    def leave(self, ticket):
+        """Release an admitted ticket or give up a place in line"""
+        with self._cond:
+            if ticket.admitted:
+                self.active -= 1
+                while self._waiting and self.active < self.max_active:
+                    nxt = self._waiting.popleft()
+                    nxt.admitted = True
+                    self.active += 1
+                    registry.observe("medivox_queue_wait_seconds", time.monotonic() - nxt.enqueued_at)
+                self._cond.notify_all()
+            elif ticket in self._waiting:
+                self._waiting.remove(ticket)
+
+    def expired(self, ticket):
+        return not ticket.admitted and time.monotonic() - ticket.enqueued_at > TURN_QUEUE_TIMEOUT
+
+    @contextmanager
+    def slot(self):
+        """Blocking admission for callers that can't report their queue position"""
+        ticket = self.enter()
+        try:
+            if not self.wait(ticket, TURN_QUEUE_TIMEOUT):
+                registry.inc("medivox_turns_shed_total", reason="queue_timeout")
+                raise Overloaded("the doctor", retry_after=5.0)
+            yield
+        finally:
+            self.leave(ticket)
+
+    def __len__(self):
+        with self._cond:
+            return len(self._waiting)
@@ -0,0 +1,120 @@
+#In-memory audio helpers: PCM conversion, resampling and compact encoding
+import math
+import os
+import wave
+from io import BytesIO
+
+import numpy as np
+
+# Whisper works on 16 kHz mono, so there is no point in uploading more
+TARGET_SAMPLE_RATE = 16000
+# "wav", "flac" or "opus"; the last two need the soundfile package
+CAPTURE_FORMAT = os.environ.get("MEDIVOX_CAPTURE_FORMAT", "wav").lower()
+
+_DTYPES = {1: np.uint8, 2: np.int16, 4: np.int32}
+# Length of the anti-aliasing filter used when scipy isn't installed
+LOWPASS_TAPS = 101
+# Passband edge as a fraction of the new Nyquist frequency, leaving room for the filter's roll-off
+LOWPASS_MARGIN = 0.9
+
+_resample_poly = None
+
+
+def pcm_to_array(pcm_bytes, sample_width=2, channels=1):
+    """Decode interleaved integer PCM into a float32 mono array in [-1, 1]"""
+    samples = np.frombuffer(pcm_bytes, dtype=_DTYPES[sample_width]).astype(np.float32)
+    if sample_width == 1:
+        # 8-bit WAV is unsigned
+        samples = (samples - 128.0) / 128.0
+    else:
+        samples /= float(2 ** (8 * sample_width - 1))
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return samples
+
+
+def _polyphase_resampler():
+    # scipy is optional and slow to import, so it is looked up on first use only
+    global _resample_poly
+    if _resample_poly is None:
+        try:
+            from scipy.signal import resample_poly
+        except ImportError:
+            resample_poly = False
+        _resample_poly = resample_poly
+    return _resample_poly
+
+
+def lowpass(samples, cutoff):
+    """Windowed-sinc FIR low-pass; cutoff is a fraction of the sample rate (below 0.5)"""
+    n = np.arange(LOWPASS_TAPS) - (LOWPASS_TAPS - 1) / 2
+    taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.blackman(LOWPASS_TAPS)
+    taps /= taps.sum()
+    # Full convolution trimmed to the input, which also works for inputs shorter than the filter
+    delay = (LOWPASS_TAPS - 1) // 2
+    return np.convolve(samples, taps)[delay:delay + len(samples)]
+
+
+def resample(samples, source_rate, target_rate=TARGET_SAMPLE_RATE):
+    """
+    Resample mono float samples. Uses scipy's polyphase resampler when it is
+    installed. Otherwise the audio is low-pass filtered below the new Nyquist
+    frequency before downsampling, so higher frequencies don't fold back as
+    noise, and then interpolated linearly.
+    """
+    if source_rate == target_rate or len(samples) == 0:
+        return samples
+    resample_poly = _polyphase_resampler()
+    if resample_poly:
+        divisor = math.gcd(int(source_rate), int(target_rate))
+        return resample_poly(samples, int(target_rate) // divisor, int(source_rate) // divisor).astype(np.float32)
+    if target_rate < source_rate:
+        samples = lowpass(samples, LOWPASS_MARGIN * 0.5 * target_rate / source_rate)
+    duration = len(samples) / source_rate
+    target_length = int(round(duration * target_rate))
+    source_times = np.arange(len(samples)) / source_rate
+    target_times = np.arange(target_length) / target_rate
+    return np.interp(target_times, source_times, samples).astype(np.float32)
+
+
+def array_to_pcm16(samples):
+    """Encode a float array as little-endian 16-bit PCM"""
+    clipped = np.clip(samples, -1.0, 1.0)
+    return (clipped * 32767).astype("<i2").tobytes()
+
+
+def encode_audio(samples, sample_rate=TARGET_SAMPLE_RATE, audio_format=CAPTURE_FORMAT):
+    """
+    Encode mono float samples for upload.
+    Returns (bytes, filename); the filename carries the format for the STT API.
+    """
+    if audio_format == "wav":
+        buffer = BytesIO()
+        with wave.open(buffer, "wb") as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(sample_rate)
+            wav_file.writeframes(array_to_pcm16(samples))
+        return buffer.getvalue(), "audio.wav"
+
+    import soundfile as sf
+    buffer = BytesIO()
+    if audio_format == "flac":
+        sf.write(buffer, samples, sample_rate, format="FLAC", subtype="PCM_16")
+        return buffer.getvalue(), "audio.flac"
+    if audio_format == "opus":
+        sf.write(buffer, samples, sample_rate, format="OGG", subtype="OPUS")
+        return buffer.getvalue(), "audio.ogg"
+    raise ValueError(f"Unsupported capture format: {audio_format}")
+
+
+def read_wav(source):
+    """Read a WAV file path or bytes into (float32 mono samples, sample rate)"""
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+    with wave.open(source, "rb") as wav_file:
+        frames = wav_file.readframes(wav_file.getnframes())
+        return (
+            pcm_to_array(frames, wav_file.getsampwidth(), wav_file.getnchannels()),
+            wav_file.getframerate(),
+        )
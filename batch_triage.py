@@ -0,0 +1,228 @@
+#Batch triage: run a backlog of image+audio cases through the pipeline without the UI
+#Usage: python batch_triage.py CASES --output triage.jsonl [--workers 8] [--tts speech_out/]
+#CASES is a directory or a manifest (.csv or .jsonl with id, image, audio and optional question).
+#Finished cases are appended to the output as they complete; rerunning skips them.
+import argparse
+import csv
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+from admission import is_overload_error
+from context_builder import ConversationContext
+from brain_of_the_doctor import build_image_content, prepare_image, routed_chat_with_model
+from prompts import initial_consultation_prompt
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+AUDIO_EXTENSIONS = {".mp3", ".wav", ".m4a", ".ogg", ".webm", ".flac"}
+# Used when a case has no recording, or nothing was said in it
+DEFAULT_QUESTION = "Is there something wrong with my skin?"
+# Attempts per stage when an upstream is saturated or rate-limited
+MAX_ATTEMPTS = int(os.environ.get("MEDIVOX_BATCH_ATTEMPTS", "6"))
+
+
+def cases_from_directory(directory):
+    """
+    One case per sub-directory (its first image and recording), plus one
+    per file stem at the top level (case1.jpg + case1.mp3). Entries without
+    any image or recording (notes, manifests, hidden files) are skipped.
+    """
+    cases = {}
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isdir(path):
+            case = {"id": name}
+            for inner in sorted(os.listdir(path)):
+                _collect(case, os.path.join(path, inner))
+            cases[name] = case
+        else:
+            stem = os.path.splitext(name)[0]
+            _collect(cases.setdefault(stem, {"id": stem}), path)
+    return [case for case in cases.values() if "image" in case or "audio" in case]
+
+
+def _collect(case, path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension in IMAGE_EXTENSIONS:
+        case.setdefault("image", path)
+    elif extension in AUDIO_EXTENSIONS:
+        case.setdefault("audio", path)
+
+
+def cases_from_manifest(manifest):
+    """Cases from a .csv or .jsonl manifest; relative paths are relative to the manifest"""
+    base = os.path.dirname(os.path.abspath(manifest))
+    with open(manifest, newline="") as f:
+        if manifest.endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    cases = []
+    for index, row in enumerate(rows):
+        case = {"id": str(row.get("id") or index)}
+        for field in ("image", "audio"):
+            if row.get(field):
+                case[field] = os.path.join(base, row[field])
+        if row.get("question"):
+            case["question"] = row["question"]
+        cases.append(case)
+    return cases
+
+
+def load_finished(output):
+    """Ids of cases already answered in output; a half-written last line is ignored"""
+    finished = set()
+    if not os.path.exists(output):
+        return finished
+    with open(output) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            if result.get("status") == "ok":
+                finished.add(result["id"])
+    return finished
+
+
+def with_backoff(stage, fn, *args):
+    """Call fn, waiting out local shedding and provider rate limits instead of failing the case"""
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return fn(*args)
+        except Exception as e:
+            if not is_overload_error(e) or attempt == MAX_ATTEMPTS - 1:
+                raise
+            delay = getattr(e, "retry_after", 2.0 ** attempt)
+            print(f"{stage} is busy, retrying in {delay:.0f}s", file=sys.stderr)
+            time.sleep(delay)
+
+
+def triage_case(case, tts_dir=None):
+    """Preprocess, transcribe, analyze and optionally voice one case; returns its result record"""
+    from tts_backends import get_tts_backend
+    from voice_of_the_patient import transcribe_audio
+
+    result = {"id": case["id"], "image": case.get("image"), "audio": case.get("audio"), "timings": {}}
+    timings = result["timings"]
+    try:
+        if not case.get("image"):
+            raise ValueError("case has no image")
+
+        start = time.perf_counter()
+        image = prepare_image(case["image"])
+        timings["image_prepare"] = time.perf_counter() - start
+
+        question = case.get("question")
+        if case.get("audio"):
+            start = time.perf_counter()
+            transcript = with_backoff("stt", transcribe_audio, case["audio"])
+            timings["stt"] = time.perf_counter() - start
+            result["transcript"] = transcript
+            question = transcript or question
+        question = question or DEFAULT_QUESTION
+
+        # Same messages as the first turn of a consultation in the app
+        messages = ConversationContext().build_messages(
+            initial_consultation_prompt, build_image_content(question, image.encoded, image.mime_type)
+        )
+        start = time.perf_counter()
+        # The router may have answered from the fallback model
+        result["assessment"], result["model"] = with_backoff("llm", routed_chat_with_model, messages)
+        timings["llm"] = time.perf_counter() - start
+
+        if tts_dir:
+            start = time.perf_counter()
+            speech = with_backoff("tts", get_tts_backend().synthesize, result["assessment"])
+            # The TTS cache may evict its copy; keep one next to the results
+            target = os.path.join(tts_dir, case["id"] + os.path.splitext(speech)[1])
+            shutil.copyfile(speech, target)
+            result["speech"] = target
+            timings["tts"] = time.perf_counter() - start
+        result["status"] = "ok"
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["finished_at"] = datetime.now().isoformat()
+    return result
+
+
+def run_batch(cases, output, workers, tts_dir=None):
+    """
+    Run cases through a pool of workers and append each result to output as
+    soon as it is done. At most two cases per worker are queued at a time, so
+    a large backlog isn't loaded into memory up front.
+    """
+    counts = {"ok": 0, "error": 0}
+    start = time.perf_counter()
+    if os.path.exists(output) and os.path.getsize(output):
+        with open(output, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            torn = f.read(1) != b"\n"
+        if torn:
+            # A crash cut the last line short; start the next result on a fresh line
+            with open(output, "a") as out:
+                out.write("\n")
+    with open(output, "a") as out, ThreadPoolExecutor(max_workers=workers, thread_name_prefix="medivox-triage") as pool:
+        def record(futures):
+            for future in futures:
+                result = future.result()
+                out.write(json.dumps(result) + "\n")
+                # One complete line per case, so a crash loses at most the cases in flight
+                out.flush()
+                counts[result["status"]] += 1
+                done = counts["ok"] + counts["error"]
+                detail = result.get("error", f"{sum(result['timings'].values()):.1f}s")
+                print(f"[{done}/{len(cases)}] {result['id']}: {result['status']} ({detail})", file=sys.stderr)
+
+        pending = set()
+        try:
+            for case in cases:
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    record(done)
+                pending.add(pool.submit(triage_case, case, tts_dir))
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                record(done)
+        except KeyboardInterrupt:
+            # Unstarted cases are dropped; the next run picks them up
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+    return counts, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Triage a backlog of image+audio cases")
+    parser.add_argument("cases", help="directory of cases, or a .csv/.jsonl manifest")
+    parser.add_argument("--output", default="triage_results.jsonl", help="JSONL file results are appended to")
+    parser.add_argument("--workers", type=int, default=8, help="cases processed at the same time")
+    parser.add_argument("--tts", metavar="DIR", help="also voice each assessment into DIR")
+    parser.add_argument("--limit", type=int, help="process at most this many pending cases")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.cases):
+        cases = cases_from_directory(args.cases)
+    else:
+        cases = cases_from_manifest(args.cases)
+    finished = load_finished(args.output)
+    pending = [case for case in cases if case["id"] not in finished]
+    if args.limit:
+        pending = pending[:args.limit]
+    print(f"{len(cases)} cases, {len(cases) - len(pending)} already done, {len(pending)} to run "
+          f"with {args.workers} workers", file=sys.stderr)
+    if args.tts:
+        os.makedirs(args.tts, exist_ok=True)
+
+    counts, elapsed = run_batch(pending, args.output, args.workers, args.tts)
+    rate = len(pending) / elapsed if elapsed else 0.0
+    print(f"Done: {counts['ok']} ok, {counts['error']} failed in {elapsed:.1f}s ({rate:.2f} cases/s). "
+          f"Results in {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
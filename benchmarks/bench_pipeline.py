@@ -0,0 +1,203 @@
+#End-to-end benchmark of the voice -> vision -> voice pipeline against local stub APIs
+#No API keys or network needed: Groq and ElevenLabs are replaced by benchmarks/stub_servers.py.
+#Usage: python benchmarks/bench_pipeline.py [--sessions 8] [--turns 3] [--mode sync|streaming|async|stages] [--json out.json]
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from stub_servers import StubConfig, start_stub_server
+
+AUDIO_FILE = os.path.join(REPO_ROOT, "patient_voice_test.mp3")
+IMAGES = [
+    os.path.join(REPO_ROOT, "acne.jpg"),
+    os.path.join(REPO_ROOT, "skin_rash.jpg"),
+    os.path.join(REPO_ROOT, "dandruff-optimized.webp"),
+]
+
+
+def configure_environment(base_url, cache_dir):
+    """Point the SDKs at the stubs; must run before the app modules are imported"""
+    os.environ["GROQ_BASE_URL"] = base_url
+    os.environ["ELEVENLABS_BASE_URL"] = base_url
+    os.environ["GROQ_API_KEY"] = "stub"
+    os.environ["ELEVEN_API_KEY"] = "stub"
+    os.environ["MEDIVOX_TTS_CACHE_DIR"] = cache_dir
+    os.environ["MEDIVOX_CONSULTATION_DB"] = os.path.join(cache_dir, "consultations.sqlite3")
+    os.environ.setdefault("MEDIVOX_STT_BACKEND", "groq")
+    os.environ.setdefault("MEDIVOX_TTS_BACKEND", "elevenlabs")
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def latency_summary(values):
+    return {
+        "count": len(values),
+        "mean_s": statistics.mean(values) if values else 0.0,
+        "p50_s": percentile(values, 0.50),
+        "p95_s": percentile(values, 0.95),
+        "p99_s": percentile(values, 0.99),
+        "max_s": max(values) if values else 0.0,
+    }
+
+
+def run_session(app, mode, session_index, turns, latencies, errors):
+    """One simulated patient: an image consultation followed by follow-up questions"""
+    request = SimpleNamespace(session_hash=f"bench-{session_index}")
+    image = IMAGES[session_index % len(IMAGES)]
+    chat_history = []
+    for _ in range(turns):
+        start = time.perf_counter()
+        if mode == "streaming":
+            outputs = None
+            for outputs in app.process_conversation_streaming(AUDIO_FILE, image, chat_history, request=request):
+                pass
+        elif mode == "async":
+            outputs = asyncio.run(app.process_conversation_async(AUDIO_FILE, image, chat_history, request=request))
+        else:
+            outputs = app.process_conversation(AUDIO_FILE, image, chat_history, request=request)
+        latencies.append(time.perf_counter() - start)
+        chat_history, status = outputs[0], outputs[2]
+        if str(status).startswith("Error"):
+            errors.append(status)
+
+
+def bench_turns(mode, sessions, turns):
+    import gradio_app
+
+    latencies, errors = [], []
+    threads = [
+        threading.Thread(target=run_session, args=(gradio_app, mode, i, turns, latencies, errors))
+        for i in range(sessions)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {
+        "mode": mode,
+        "sessions": sessions,
+        "turns_per_session": turns,
+        "elapsed_s": elapsed,
+        "throughput_turns_per_s": len(latencies) / elapsed if elapsed else 0.0,
+        "turn_latency": latency_summary(latencies),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+    }
+
+
+def bench_stages(runs):
+    """Time each pipeline stage on its own, one call at a time"""
+    from brain_of_the_doctor import build_image_messages, prepare_image, routed_chat
+    from prompts import initial_consultation_prompt
+    from tts_backends import get_tts_backend
+    from voice_of_the_patient import transcribe_audio
+
+    timings = {"stt": [], "image_prepare": [], "llm": [], "tts": []}
+    for i in range(runs):
+        start = time.perf_counter()
+        text = transcribe_audio(AUDIO_FILE)
+        timings["stt"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        image = prepare_image(IMAGES[i % len(IMAGES)])
+        timings["image_prepare"].append(time.perf_counter() - start)
+
+        messages = build_image_messages(initial_consultation_prompt + " " + text, image.encoded, image.mime_type)
+        start = time.perf_counter()
+        reply = routed_chat(messages)
+        timings["llm"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        get_tts_backend().synthesize(reply)
+        timings["tts"].append(time.perf_counter() - start)
+    return {"mode": "stages", "runs": runs, "stages": {name: latency_summary(v) for name, v in timings.items()}}
+
+
+def print_latency(label, summary):
+    print(f"{label:<16} {summary['count']:>6} {summary['mean_s']:>8.3f} {summary['p50_s']:>8.3f} "
+          f"{summary['p95_s']:>8.3f} {summary['p99_s']:>8.3f} {summary['max_s']:>8.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the full pipeline against stub APIs")
+    parser.add_argument("--sessions", type=int, default=8, help="concurrent simulated patients")
+    parser.add_argument("--turns", type=int, default=3, help="turns per patient")
+    parser.add_argument("--mode", choices=["sync", "streaming", "async", "stages"], default="sync")
+    parser.add_argument("--stt-latency", type=float, default=0.3)
+    parser.add_argument("--chat-latency", type=float, default=0.6)
+    parser.add_argument("--tts-latency", type=float, default=0.4)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--repeat-replies", action="store_true",
+                        help="replay identical replies so the TTS cache can hit")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    config = StubConfig(args.stt_latency, args.chat_latency, args.tts_latency,
+                        jitter=args.jitter, unique_replies=not args.repeat_replies)
+    server, base_url = start_stub_server(config)
+    cache_dir = tempfile.mkdtemp(prefix="medivox_bench_tts_")
+    configure_environment(base_url, cache_dir)
+
+    tracemalloc.start()
+    try:
+        if args.mode == "stages":
+            result = bench_stages(args.sessions * args.turns)
+        else:
+            result = bench_turns(args.mode, args.sessions, args.turns)
+    finally:
+        server.shutdown()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result["memory"] = {
+        "python_peak_mb": peak / 1e6,
+        "max_rss_mb": max_rss / (1e6 if sys.platform == "darwin" else 1e3),
+    }
+    result["stub_requests"] = dict(config.requests)
+
+    print(f"Stub latencies: stt {args.stt_latency}s, chat {args.chat_latency}s, tts {args.tts_latency}s "
+          f"(jitter {args.jitter})")
+    print(f"{'':<16} {'count':>6} {'mean':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    if args.mode == "stages":
+        for name, summary in result["stages"].items():
+            print_latency(name, summary)
+    else:
+        print_latency(f"turn ({args.mode})", result["turn_latency"])
+        print(f"Throughput: {result['throughput_turns_per_s']:.2f} turns/s over {result['elapsed_s']:.1f}s, "
+              f"{result['errors']} errors")
+        if result["first_error"]:
+            print(f"  first error: {result['first_error']}")
+    print(f"Memory: python peak {result['memory']['python_peak_mb']:.1f} MB, "
+          f"max RSS {result['memory']['max_rss_mb']:.1f} MB")
+    print(f"Stub requests: {result['stub_requests']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
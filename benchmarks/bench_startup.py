@@ -0,0 +1,77 @@
+#Cold-start report: how long importing the app takes and which packages dominate
+#Runs `python -X importtime -c "import <module>"` in a fresh interpreter and groups the result by package.
+#Usage: python benchmarks/bench_startup.py [--module gradio_app] [--top 15] [--runs 3]
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# SDKs and optional backends the web path should only load on first use
+LAZY_PACKAGES = ("groq", "elevenlabs", "gtts", "speech_recognition", "pydub", "PIL",
+                 "faster_whisper", "piper", "webrtcvad", "pyaudio")
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def run_importtime(module):
+    """Import module in a fresh interpreter; returns (wall seconds, [(self_us, cumulative_us, depth, name)])"""
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr else "import failed")
+    rows = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((int(self_us), int(cumulative_us), len(indent) // 2, name))
+    return wall, rows
+
+
+def by_package(rows):
+    """Self time summed per top-level package"""
+    totals = defaultdict(int)
+    for self_us, _, _, name in rows:
+        totals[name.split(".")[0]] += self_us
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report import (cold-start) time of the app")
+    parser.add_argument("--module", default="gradio_app")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters to time")
+    args = parser.parse_args()
+
+    walls = []
+    for _ in range(args.runs):
+        wall, rows = run_importtime(args.module)
+        walls.append(wall)
+
+    print(f"import {args.module}: median {statistics.median(walls):.2f}s wall over {args.runs} runs "
+          f"(min {min(walls):.2f}s), {len(rows)} modules")
+    print(f"\n{'package':<28} {'self ms':>10}")
+    for package, self_us in by_package(rows)[:args.top]:
+        print(f"{package:<28} {self_us / 1000:>10.1f}")
+
+    top_level = [row for row in rows if row[2] == 0]
+    print(f"\n{'top-level import':<40} {'cumulative ms':>14}")
+    for _, cumulative_us, _, name in sorted(top_level, key=lambda row: row[1], reverse=True)[:args.top]:
+        print(f"{name:<40} {cumulative_us / 1000:>14.1f}")
+
+    loaded = sorted({name.split(".")[0] for _, _, _, name in rows} & set(LAZY_PACKAGES))
+    print(f"\nLazy packages loaded at startup: {', '.join(loaded) if loaded else 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#Compare transcription backends on a bundled recording
+#Usage: python benchmarks/bench_stt.py [--backends groq local] [--runs 5] [--audio patient_voice_test.mp3]
+import argparse
+import os
+import statistics
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from stt_backends import create_transcription_backend
+
+
+def bench_backend(name, audio_path, runs):
+    backend = create_transcription_backend(name)
+
+    # The first call includes model loading / connection setup
+    start = time.perf_counter()
+    backend.warm_up()
+    text = backend.transcribe(audio_path)
+    cold = time.perf_counter() - start
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        backend.transcribe(audio_path)
+        timings.append(time.perf_counter() - start)
+
+    return {
+        "backend": name,
+        "cold_s": cold,
+        "mean_s": statistics.mean(timings),
+        "p50_s": statistics.median(timings),
+        "min_s": min(timings),
+        "max_s": max(timings),
+        "text": text,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark STT backends")
+    parser.add_argument("--backends", nargs="+", default=["groq", "local"])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--audio", default=os.path.join(REPO_ROOT, "patient_voice_test.mp3"))
+    args = parser.parse_args()
+
+    print(f"Audio: {args.audio} ({os.path.getsize(args.audio)} bytes), {args.runs} warm runs")
+    print(f"{'backend':<8} {'cold':>8} {'mean':>8} {'p50':>8} {'min':>8} {'max':>8}")
+    for name in args.backends:
+        try:
+            result = bench_backend(name, args.audio, args.runs)
+        except Exception as e:
+            print(f"{name:<8} failed: {e}")
+            continue
+        print(f"{name:<8} {result['cold_s']:>8.3f} {result['mean_s']:>8.3f} {result['p50_s']:>8.3f} "
+              f"{result['min_s']:>8.3f} {result['max_s']:>8.3f}")
+        print(f"         text: {result['text'][:80]!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#Multi-process load test: throughput as app workers are added behind the load balancer
+#Each step starts load_balancer.py with N workers (plus the bundled state server) against the stub APIs,
+#then drives concurrent patients through the Gradio API. Needs gradio_client (installed with gradio).
+#Usage: python benchmarks/bench_workers.py [--workers 1,2,4] [--sessions 16] [--turns 2] [--json out.json]
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_pipeline import AUDIO_FILE, IMAGES, configure_environment, latency_summary, print_latency
+from load_balancer import free_port
+from stub_servers import StubConfig, start_stub_server
+
+
+def start_cluster(workers, worker_concurrency, sessions):
+    """Start the balancer, its workers and a state server; returns (process, url)"""
+    port, state_port = free_port(), free_port()
+    base_port = free_port()
+    env = dict(os.environ)
+    env.pop("MEDIVOX_SESSION_BACKEND", None)
+    # A small per-worker capacity makes the worker count the bottleneck, as with real CPU-bound work
+    env["MEDIVOX_CONCURRENCY"] = str(worker_concurrency)
+    env["MEDIVOX_QUEUE_SIZE"] = str(sessions)
+    process = subprocess.Popen(
+        [sys.executable, "load_balancer.py", "--workers", str(workers), "--port", str(port),
+         "--base-port", str(base_port), "--state-port", str(state_port)],
+        cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL,
+    )
+    return process, f"http://127.0.0.1:{port}"
+
+
+def wait_until_ready(url, workers, timeout=180):
+    """Wait until every worker answers through the balancer"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"{url}/config", timeout=5):
+                pass
+            with urllib.request.urlopen(f"{url}/lb-status", timeout=5) as response:
+                status = json.load(response)
+            if all(worker["healthy"] for worker in status) and len(status) == workers:
+                # Touch every worker once so none is still importing when the clock starts
+                for _ in range(workers * 2):
+                    urllib.request.urlopen(f"{url}/config", timeout=30).close()
+                return status
+        except OSError:
+            pass
+        time.sleep(1)
+    raise RuntimeError(f"cluster at {url} did not become ready")
+
+
+def run_patient(url, index, turns, latencies, errors):
+    from gradio_client import Client, handle_file
+
+    # Every client gets its own Gradio session, which the balancer pins to one worker
+    client = Client(url, verbose=False)
+    image = handle_file(IMAGES[index % len(IMAGES)])
+    chat_history = []
+    for _ in range(turns):
+        start = time.perf_counter()
+        try:
+            chat_history, _, status, _ = client.predict(
+                handle_file(AUDIO_FILE), image, chat_history, api_name="/consult"
+            )
+        except Exception as e:
+            errors.append(str(e))
+            continue
+        latencies.append(time.perf_counter() - start)
+        if str(status).startswith(("Error", "🚦")):
+            errors.append(status)
+
+
+def bench_cluster(workers, sessions, turns, worker_concurrency):
+    process, url = start_cluster(workers, worker_concurrency, sessions)
+    try:
+        wait_until_ready(url, workers)
+        latencies, errors = [], []
+        threads = [
+            threading.Thread(target=run_patient, args=(url, i, turns, latencies, errors))
+            for i in range(sessions)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        with urllib.request.urlopen(f"{url}/lb-status") as response:
+            balance = json.load(response)
+    finally:
+        process.terminate()
+        process.wait()
+    return {
+        "workers": workers,
+        "elapsed_s": elapsed,
+        "throughput_turns_per_s": len(latencies) / elapsed if elapsed else 0.0,
+        "turn_latency": latency_summary(latencies),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "requests_per_worker": {worker["worker"]: worker["requests"] for worker in balance},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure throughput scaling across app workers")
+    parser.add_argument("--workers", default="1,2,4", help="comma-separated worker counts to try")
+    parser.add_argument("--sessions", type=int, default=16, help="concurrent simulated patients")
+    parser.add_argument("--turns", type=int, default=2, help="turns per patient")
+    parser.add_argument("--worker-concurrency", type=int, default=4, help="turns one worker runs at once")
+    parser.add_argument("--stt-latency", type=float, default=0.3)
+    parser.add_argument("--chat-latency", type=float, default=0.6)
+    parser.add_argument("--tts-latency", type=float, default=0.4)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    config = StubConfig(args.stt_latency, args.chat_latency, args.tts_latency)
+    server, base_url = start_stub_server(config)
+    # Workers inherit the environment, so they all talk to the stubs
+    configure_environment(base_url, tempfile.mkdtemp(prefix="medivox_bench_workers_"))
+
+    results = []
+    try:
+        for workers in [int(n) for n in args.workers.split(",")]:
+            result = bench_cluster(workers, args.sessions, args.turns, args.worker_concurrency)
+            results.append(result)
+            print(f"{workers} worker(s): {result['throughput_turns_per_s']:.2f} turns/s, "
+                  f"{result['errors']} errors, requests per worker {result['requests_per_worker']}")
+    finally:
+        server.shutdown()
+
+    baseline = results[0]["throughput_turns_per_s"] or 1.0
+    print(f"\n{'workers':<8} {'turns/s':>8} {'speedup':>8}")
+    for result in results:
+        print(f"{result['workers']:<8} {result['throughput_turns_per_s']:>8.2f} "
+              f"{result['throughput_turns_per_s'] / baseline:>7.2f}x")
+    print(f"\n{'':<16} {'count':>6} {'mean':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for result in results:
+        print_latency(f"{result['workers']} worker(s)", result["turn_latency"])
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+#Local stand-ins for the Groq and ElevenLabs HTTP APIs
+#Replays recorded responses from benchmarks/fixtures with configurable latency.
+#Usage: python benchmarks/stub_servers.py --port 8765 --chat-latency 0.6
+import argparse
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+FIXTURES = os.path.join(BENCH_DIR, "fixtures", "recorded_responses.json")
+
+
+class StubConfig:
+    """Latencies (seconds) and replayed payloads shared by all handler threads"""
+
+    def __init__(self, stt_latency=0.3, chat_latency=0.6, tts_latency=0.4,
+                 first_token_latency=0.15, jitter=0.2, unique_replies=True, fixtures=FIXTURES):
+        self.stt_latency = stt_latency
+        self.chat_latency = chat_latency
+        self.tts_latency = tts_latency
+        self.first_token_latency = first_token_latency
+        self.jitter = jitter
+        self.unique_replies = unique_replies
+        with open(fixtures) as f:
+            recorded = json.load(f)
+        self.transcriptions = itertools.cycle(recorded["transcriptions"])
+        self.chat_replies = itertools.cycle(recorded["chat_replies"])
+        with open(os.path.join(REPO_ROOT, recorded["tts_audio_file"]), "rb") as f:
+            self.tts_audio = f.read()
+        self.counter = itertools.count(1)
+        self.requests = {}
+        self._lock = threading.Lock()
+
+    def delay(self, base):
+        # Multiplicative jitter gives a realistic latency tail
+        time.sleep(max(base * (1 + random.uniform(-self.jitter, self.jitter * 3)), 0))
+
+    def count(self, endpoint):
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def next_transcription(self):
+        with self._lock:
+            return next(self.transcriptions)
+
+    def next_reply(self):
+        with self._lock:
+            reply = next(self.chat_replies)
+            # Distinct replies keep the TTS cache from hiding synthesis cost
+            if self.unique_replies:
+                reply += f" Reference {next(self.counter)}."
+            return reply
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length else b""
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_chunked(self, chunks, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write(f"{len(chunk):X}\r\n".encode("ascii") + chunk + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_GET(self):
+        if self.path.startswith("/v1/voices"):
+            self.config.count("voices")
+            self._send_json({"voices": [{"voice_id": "stub-aria", "name": "Aria", "category": "premade"}]})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        body = self._read_body()
+        if self.path.startswith("/openai/v1/audio/transcriptions"):
+            self._transcription()
+        elif self.path.startswith("/openai/v1/chat/completions"):
+            self._chat(json.loads(body or b"{}"))
+        elif self.path.startswith("/v1/text-to-speech/"):
+            self._tts()
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def _transcription(self):
+        config = self.config
+        config.count("stt")
+        config.delay(config.stt_latency)
+        self._send_json({"text": config.next_transcription()})
+
+    def _chat(self, request):
+        config = self.config
+        config.count("chat")
+        reply = config.next_reply()
+        model = request.get("model", "stub")
+        prompt_tokens = sum(len(json.dumps(m.get("content", ""))) for m in request.get("messages", [])) // 4
+        completion_tokens = len(reply) // 4
+        if request.get("stream"):
+            self._chat_stream(reply, model, prompt_tokens, completion_tokens)
+            return
+        config.delay(config.chat_latency)
+        self._send_json({
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": reply},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+    def _chat_stream(self, reply, model, prompt_tokens, completion_tokens):
+        config = self.config
+        words = reply.split(" ")
+        per_token = max(config.chat_latency - config.first_token_latency, 0) / max(len(words), 1)
+
+        def events():
+            config.delay(config.first_token_latency)
+            for i, word in enumerate(words):
+                delta = {"content": word if i == 0 else " " + word}
+                chunk = {
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+                time.sleep(per_token)
+            yield b"data: [DONE]\n\n"
+
+        self._send_chunked(events(), "text/event-stream")
+
+    def _tts(self):
+        config = self.config
+        config.count("tts")
+        audio = config.tts_audio
+        chunk_size = 4096
+
+        def chunks():
+            config.delay(config.tts_latency)
+            for i in range(0, len(audio), chunk_size):
+                yield audio[i:i + chunk_size]
+
+        self._send_chunked(chunks(), "audio/mpeg")
+
+
+def start_stub_server(config=None, host="127.0.0.1", port=0):
+    """Start the stubs on a background thread; returns (server, base_url)"""
+    config = config or StubConfig()
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"config": config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Groq/ElevenLabs stub servers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--stt-latency", type=float, default=0.3)
+    parser.add_argument("--chat-latency", type=float, default=0.6)
+    parser.add_argument("--tts-latency", type=float, default=0.4)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    args = parser.parse_args()
+
+    config = StubConfig(args.stt_latency, args.chat_latency, args.tts_latency, jitter=args.jitter)
+    server, base_url = start_stub_server(config, args.host, args.port)
+    print(f"Stub APIs listening at {base_url}")
+    print(f"  GROQ_BASE_URL={base_url} ELEVENLABS_BASE_URL={base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,5 @@
-# if you dont use pipenv uncomment the following:
-from dotenv import load_dotenv
-load_dotenv()
+# Loads .env once per process (needed if you dont use pipenv)
+import config
 
 #Step1: Setup GROQ API key
 import os
@@ -17,86 +16,181 @@ def encode_image(image_path):
     image_file=open(image_path, "rb")
     return base64.b64encode(image_file.read()).decode('utf-8')
 
+# Downscaled, EXIF-free re-encoding with the matching MIME type (preferred for uploads)
+from image_preprocessing import prepare_image
+
 #Step3: Setup Multimodal LLM 
-from groq import Groq
+import re
+import asyncio
+from context_builder import ConversationContext
+from metrics import annotate, message_bytes
+from client_provider import get_groq_client, get_async_groq_client
+from admission import chat_upstream, limiter
+from model_router import PRIMARY_MODEL, get_model_router
 
 query="Is there something wrong with my face?"
-#model = "meta-llama/llama-4-maverick-17b-128e-instruct"
-model="meta-llama/llama-4-scout-17b-16e-instruct"
-#model = "meta-llama/llama-4-scout-17b-16e-instruct"
+# Set MEDIVOX_LLM_MODEL / MEDIVOX_LLM_FALLBACK_MODEL to change models
+# (e.g. "meta-llama/llama-4-maverick-17b-128e-instruct")
+model=PRIMARY_MODEL
 #model="llama-3.2-90b-vision-preview" #Deprecated
 
-def analyze_image_with_query(query, model, encoded_image):
-    client=Groq()  
-    messages=[
+def build_image_content(query, encoded_image, mime_type="image/jpeg"):
+    """Multimodal user content: the query text followed by the image"""
+    return [
+        {
+            "type": "text", 
+            "text": query
+        },
+        {
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:{mime_type};base64,{encoded_image}",
+            },
+        },
+    ]
+
+def build_image_messages(query, encoded_image, mime_type="image/jpeg"):
+    """Build the multimodal message list for a query about an image"""
+    return [
         {
             "role": "user",
-            "content": [
-                {
-                    "type": "text", 
-                    "text": query
-                },
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{encoded_image}",
-                    },
-                },
-            ],
+            "content": build_image_content(query, encoded_image, mime_type),
         }]
-    chat_completion=client.chat.completions.create(
-        messages=messages,
-        model=model
+
+def _record_usage(messages, chat_completion):
+    # Attach request size and token usage to the current trace stage
+    usage = getattr(chat_completion, "usage", None)
+    annotate(
+        bytes_sent=message_bytes(messages),
+        bytes_received=len(chat_completion.choices[0].message.content or ""),
+        prompt_tokens=getattr(usage, "prompt_tokens", 0),
+        completion_tokens=getattr(usage, "completion_tokens", 0)
     )
 
+def complete_chat(messages, model):
+    """Run a chat completion and return the full reply text"""
+    client=get_groq_client()
+    with limiter(chat_upstream(messages)).slot():
+        chat_completion=client.chat.completions.create(
+            messages=messages,
+            model=model
+        )
+    _record_usage(messages, chat_completion)
+
     return chat_completion.choices[0].message.content
 
-def analyze_follow_up_query(query, model, conversation_context=""):
+def stream_chat_completion(messages, model):
+    """Run a chat completion and yield the reply text as it is generated"""
+    client=get_groq_client()
+    annotate(bytes_sent=message_bytes(messages))
+    # The slot is held until the whole reply has streamed
+    with limiter(chat_upstream(messages)).slot():
+        stream=client.chat.completions.create(
+            messages=messages,
+            model=model,
+            stream=True
+        )
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                annotate(bytes_received=len(chunk.choices[0].delta.content))
+                yield chunk.choices[0].delta.content
+
+def routed_chat(messages):
+    """complete_chat on the model chosen by the router, with retries, hedging and fallback"""
+    return get_model_router().run(lambda model: complete_chat(messages, model))
+
+def routed_chat_with_model(messages):
+    """routed_chat that also returns the model which answered, as (reply, model)"""
+    return get_model_router().run_with_model(lambda model: complete_chat(messages, model))
+
+def routed_chat_stream(messages):
+    """stream_chat_completion through the router; retried only before the first chunk"""
+    return get_model_router().stream(lambda model: stream_chat_completion(messages, model))
+
+def routed_chat_stream_with_model(messages):
+    """routed_chat_stream yielding (chunk, model which answered) pairs"""
+    return get_model_router().stream_with_model(lambda model: stream_chat_completion(messages, model))
+
+# Sentence ends followed by whitespace; short fragments are merged with the next one
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+def iter_sentences(text_chunks, min_chars=20):
     """
-    Handle follow-up queries without images
+    Regroup streamed text chunks into whole sentences.
+    Sentences shorter than min_chars are held back and merged with the next one
+    so that abbreviations and very short phrases don't become separate TTS calls.
     """
-    client = Groq()
-    
-    # Build the full context
-    full_query = query
-    if conversation_context:
-        full_query = conversation_context + "\n\nCurrent question: " + query
-    
-    messages = [
-        {
-            "role": "user",
-            "content": full_query
-        }
-    ]
-    
-    chat_completion = client.chat.completions.create(
-        messages=messages,
-        model=model
-    )
-    
+    buffer = ""
+    for chunk in text_chunks:
+        buffer += chunk
+        parts = SENTENCE_END.split(buffer)
+        # The last part may still be growing
+        buffer = parts.pop()
+        pending = ""
+        for part in parts:
+            pending = f"{pending} {part}".strip()
+            if len(pending) >= min_chars:
+                yield pending
+                pending = ""
+        if pending:
+            buffer = pending + " " + buffer.lstrip()
+    if buffer.strip():
+        yield buffer.strip()
+
+def analyze_image_with_query(query, model, encoded_image, mime_type="image/jpeg"):
+    return complete_chat(build_image_messages(query, encoded_image, mime_type), model)
+
+async def complete_chat_async(messages, model):
+    """Async version of complete_chat using the pooled AsyncGroq client"""
+    client=get_async_groq_client()
+    async with limiter(chat_upstream(messages)).slot_async():
+        chat_completion=await client.chat.completions.create(
+            messages=messages,
+            model=model
+        )
+    _record_usage(messages, chat_completion)
+
     return chat_completion.choices[0].message.content
 
+async def routed_chat_async(messages):
+    """Async version of routed_chat"""
+    return await get_model_router().run_async(lambda model: complete_chat_async(messages, model))
+
+async def routed_chat_with_model_async(messages):
+    """Async version of routed_chat_with_model"""
+    return await get_model_router().run_async_with_model(lambda model: complete_chat_async(messages, model))
+
+async def prepare_image_async(image_path):
+    """Preprocess and encode the image without blocking the event loop"""
+    return await asyncio.to_thread(prepare_image, image_path)
+
+async def analyze_image_with_query_async(query, model, encoded_image, mime_type="image/jpeg"):
+    return await complete_chat_async(build_image_messages(query, encoded_image, mime_type), model)
+
+def analyze_follow_up_query(query, model, conversation_context=None):
+    """
+    Handle follow-up queries without images.
+    conversation_context is a ConversationContext; a plain string is still
+    accepted and sent as a system message.
+    """
+    if isinstance(conversation_context, ConversationContext):
+        messages = conversation_context.build_messages(None, query)
+    elif conversation_context:
+        messages = [
+            {"role": "system", "content": conversation_context},
+            {"role": "user", "content": query}
+        ]
+    else:
+        messages = [{"role": "user", "content": query}]
+    
+    return complete_chat(messages, model)
+
 def get_conversational_response(query, model, chat_history=None):
     """
     Enhanced function to handle both image-based and text-based conversations
     """
-    client = Groq()
-    
-    # Build conversation context from history
-    messages = []
-    
-    if chat_history:
-        # Add conversation history as context
-        for user_msg, doctor_msg in chat_history[-5:]:  # Keep last 5 exchanges
-            messages.append({"role": "user", "content": user_msg})
-            messages.append({"role": "assistant", "content": doctor_msg})
-    
-    # Add current query
-    messages.append({"role": "user", "content": query})
-    
-    chat_completion = client.chat.completions.create(
-        messages=messages,
-        model=model
-    )
+    # Build conversation context from (user, doctor) history within the token budget
+    context = ConversationContext.from_pairs(chat_history or [])
+    messages = context.build_messages(None, query)
     
-    return chat_completion.choices[0].message.content
\ No newline at end of file
+    return complete_chat(messages, model)
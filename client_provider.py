@@ -0,0 +1,228 @@
+#Shared, long-lived API clients for Groq and ElevenLabs
+import config
+
+import asyncio
+import os
+import threading
+import weakref
+
+import httpx
+
+GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
+ELEVENLABS_API_KEY = os.environ.get("ELEVEN_API_KEY")
+# Point the SDKs at another endpoint, e.g. the stub servers in benchmarks/.
+# GROQ_BASE_URL is read by the Groq SDK itself.
+ELEVENLABS_BASE_URL = os.environ.get("ELEVENLABS_BASE_URL")
+
+# Connection pool tuning, overridable per deployment
+HTTP_POOL_SIZE = int(os.environ.get("MEDIVOX_HTTP_POOL_SIZE", "20"))
+HTTP_KEEPALIVE_CONNECTIONS = int(os.environ.get("MEDIVOX_HTTP_KEEPALIVE", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("MEDIVOX_HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("MEDIVOX_HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_TIMEOUT = float(os.environ.get("MEDIVOX_HTTP_TIMEOUT", "60"))
+
+
+class ConnectionStats:
+    """
+    Counts requests and freshly opened TCP connections for one pool.
+
+    httpcore reports connection setup through the ``trace`` request extension,
+    so every request that does not open a new connection reused a kept-alive one.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.new_connections = 0
+        self._lock = threading.Lock()
+
+    def on_request(self, request):
+        with self._lock:
+            self.requests += 1
+        request.extensions["trace"] = self._trace
+
+    async def on_request_async(self, request):
+        with self._lock:
+            self.requests += 1
+        # httpcore awaits the trace callback on async connections
+        request.extensions["trace"] = self._trace_async
+
+    def _trace(self, event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            with self._lock:
+                self.new_connections += 1
+
+    async def _trace_async(self, event_name, info):
+        self._trace(event_name, info)
+
+    def snapshot(self):
+        with self._lock:
+            reused = max(self.requests - self.new_connections, 0)
+            return {
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                "reused_connections": reused,
+                "reuse_ratio": reused / self.requests if self.requests else 0.0,
+            }
+
+
+_stats = {"groq": ConnectionStats(), "elevenlabs": ConnectionStats()}
+_clients = {}
+_http_clients = []
+# Async clients per event loop; an entry goes away when its loop is collected
+_loop_clients = weakref.WeakKeyDictionary()
+_loop_http_clients = weakref.WeakKeyDictionary()
+_closers = set()
+_lock = threading.Lock()
+
+
+def _http_limits():
+    return httpx.Limits(
+        max_connections=HTTP_POOL_SIZE,
+        max_keepalive_connections=HTTP_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def _http_timeout():
+    return httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+
+
+def _build_http_client(provider):
+    stats = _stats[provider]
+    http_client = httpx.Client(
+        limits=_http_limits(),
+        timeout=_http_timeout(),
+        event_hooks={"request": [stats.on_request]},
+    )
+    _http_clients.append(http_client)
+    return http_client
+
+
+def _build_async_http_client(provider):
+    stats = _stats[provider]
+    http_client = httpx.AsyncClient(
+        limits=_http_limits(),
+        timeout=_http_timeout(),
+        event_hooks={"request": [stats.on_request_async]},
+    )
+    _loop_http_clients.setdefault(asyncio.get_running_loop(), []).append(http_client)
+    return http_client
+
+
+def _get_or_create(name, builder):
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = builder()
+                _clients[name] = client
+    return client
+
+
+def get_groq_client():
+    """Return the process-wide Groq client backed by a keep-alive connection pool"""
+    def build():
+        from groq import Groq
+        return Groq(api_key=GROQ_API_KEY, http_client=_build_http_client("groq"))
+    return _get_or_create("groq", build)
+
+
+def _elevenlabs_base_url():
+    return {"base_url": ELEVENLABS_BASE_URL} if ELEVENLABS_BASE_URL else {}
+
+
+def get_elevenlabs_client():
+    """Return the process-wide ElevenLabs client backed by a keep-alive connection pool"""
+    def build():
+        from elevenlabs.client import ElevenLabs
+        return ElevenLabs(
+            api_key=ELEVENLABS_API_KEY,
+            timeout=HTTP_TIMEOUT,
+            **_elevenlabs_base_url(),
+            httpx_client=_build_http_client("elevenlabs"),
+        )
+    return _get_or_create("elevenlabs", build)
+
+
+def _get_or_create_for_loop(name, builder):
+    # Async clients are bound to the event loop they were created on
+    loop = asyncio.get_running_loop()
+    with _lock:
+        clients = _loop_clients.get(loop)
+        if clients is None:
+            clients = _loop_clients[loop] = {}
+            closer = loop.create_task(_close_with_loop())
+            # The loop only holds tasks weakly
+            _closers.add(closer)
+            closer.add_done_callback(_closers.discard)
+        client = clients.get(name)
+        if client is None:
+            client = clients[name] = builder()
+    return client
+
+
+async def _close_with_loop():
+    # asyncio.run cancels leftover tasks before closing the loop, which closes its clients
+    try:
+        await asyncio.get_running_loop().create_future()
+    finally:
+        await aclose_loop_clients()
+
+
+async def aclose_loop_clients():
+    """Close the async clients of the running event loop"""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        _loop_clients.pop(loop, None)
+        http_clients = _loop_http_clients.pop(loop, [])
+    for http_client in http_clients:
+        await http_client.aclose()
+
+
+def get_async_groq_client():
+    """Return the AsyncGroq client for the running event loop"""
+    def build():
+        from groq import AsyncGroq
+        return AsyncGroq(api_key=GROQ_API_KEY, http_client=_build_async_http_client("groq"))
+    return _get_or_create_for_loop("async_groq", build)
+
+
+def get_async_elevenlabs_client():
+    """Return the AsyncElevenLabs client for the running event loop"""
+    def build():
+        from elevenlabs.client import AsyncElevenLabs
+        return AsyncElevenLabs(
+            api_key=ELEVENLABS_API_KEY,
+            timeout=HTTP_TIMEOUT,
+            **_elevenlabs_base_url(),
+            httpx_client=_build_async_http_client("elevenlabs"),
+        )
+    return _get_or_create_for_loop("async_elevenlabs", build)
+
+
+def connection_stats():
+    """Per-provider request and connection reuse counters"""
+    return {provider: stats.snapshot() for provider, stats in _stats.items()}
+
+
+def close_clients(timeout=5.0):
+    """Close every pooled client, e.g. on shutdown"""
+    with _lock:
+        for http_client in _http_clients:
+            http_client.close()
+        _http_clients.clear()
+        _clients.clear()
+        loops = [loop for loop in _loop_http_clients if not loop.is_closed()]
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    for loop in loops:
+        if loop is running:
+            # Can't block on our own loop; close once the caller yields
+            loop.create_task(aclose_loop_clients())
+        elif loop.is_running():
+            asyncio.run_coroutine_threadsafe(aclose_loop_clients(), loop).result(timeout)
+        else:
+            loop.run_until_complete(aclose_loop_clients())
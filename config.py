@@ -0,0 +1,7 @@
+#Environment loading shared by every module
+#Importing this module reads .env once per process (Python caches the import);
+#variables already set in the environment take precedence.
+from dotenv import load_dotenv
+
+# if you dont use pipenv this is what picks up your .env file
+load_dotenv()
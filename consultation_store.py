@@ -0,0 +1,201 @@
+#Append-only record of every consultation turn
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+CONSULTATION_DB = os.environ.get("MEDIVOX_CONSULTATION_DB", "consultations.sqlite3")
+# Turns written per transaction, and the longest a queued turn waits for its batch
+WRITE_BATCH_SIZE = int(os.environ.get("MEDIVOX_CONSULTATION_BATCH", "64"))
+WRITE_INTERVAL = float(os.environ.get("MEDIVOX_CONSULTATION_FLUSH_INTERVAL", "0.5"))
+# Longest flush() waits for the turns queued before it, by any session, to reach the disk
+FLUSH_TIMEOUT = float(os.environ.get("MEDIVOX_CONSULTATION_FLUSH_TIMEOUT", "5"))
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS turns ("
+    "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, "
+    "consultation_start TEXT NOT NULL, ts TEXT NOT NULL, user TEXT NOT NULL, doctor TEXT NOT NULL, "
+    "image INTEGER NOT NULL DEFAULT 0)",
+    "CREATE INDEX IF NOT EXISTS turns_session ON turns (session_id, consultation_start, id)",
+    "CREATE INDEX IF NOT EXISTS turns_ts ON turns (ts)",
+    # Consultations started explicitly (New Session), so resume finds them before their first turn
+    "CREATE TABLE IF NOT EXISTS consultations ("
+    "session_id TEXT NOT NULL, consultation_start TEXT NOT NULL, PRIMARY KEY (session_id, consultation_start))",
+)
+# Columns added after the first release, created on older databases at startup
+MIGRATIONS = {
+    "image": "ALTER TABLE turns ADD COLUMN image INTEGER NOT NULL DEFAULT 0",
+}
+INSERT_TURN = "INSERT INTO turns (session_id, consultation_start, ts, user, doctor, image) VALUES (?, ?, ?, ?, ?, ?)"
+INSERT_CONSULTATION = "INSERT OR IGNORE INTO consultations (session_id, consultation_start) VALUES (?, ?)"
+
+
+class ConsultationStore:
+    """
+    SQLite (WAL) log of consultation turns, one row per exchange.
+
+    Turns are only ever inserted. append() just queues the row; a writer
+    thread inserts queued rows in batches, so turns never wait on the disk.
+    A consultation is identified by its session id and start time, which is
+    what resume and export look up through the session index. Starting a new
+    consultation adds a row instead of touching the old one.
+    """
+
+    def __init__(self, path=CONSULTATION_DB, batch_size=WRITE_BATCH_SIZE, interval=WRITE_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.interval = interval
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self.written = 0
+        with self._connection() as conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(turns)")}
+            for column, statement in MIGRATIONS.items():
+                if column not in columns:
+                    conn.execute(statement)
+        self._writer = threading.Thread(target=self._write_loop, name="medivox-consultation-writer", daemon=True)
+        self._writer.start()
+
+    def _connection(self):
+        # sqlite3 connections must stay on the thread that created them
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # WAL keeps the database consistent; a crash loses at most the last batches
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def append(self, session_id, consultation_start, turn, image=False):
+        """Queue one {'timestamp', 'user', 'doctor'} turn for writing; image marks a turn that analyzed the image"""
+        self._queue.put((INSERT_TURN, (
+            session_id, consultation_start, turn["timestamp"], turn["user"], turn["doctor"], int(image)
+        )))
+
+    def start_consultation(self, session_id, consultation_start):
+        """Queue the start of a new consultation, which then takes over from the previous one"""
+        self._queue.put((INSERT_CONSULTATION, (session_id, consultation_start)))
+
+    def _write_loop(self):
+        conn = self._connection()
+        while True:
+            rows = [self._queue.get()]
+            deadline = time.monotonic() + self.interval
+            # A flush marker means someone is waiting: write what we have now
+            while len(rows) < self.batch_size and rows[-1][0] is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    rows.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            batches = {}
+            markers = []
+            for statement, row in rows:
+                if statement is None:
+                    markers.append(row)
+                else:
+                    batches.setdefault(statement, []).append(row)
+            try:
+                if batches:
+                    with conn:
+                        for statement, batch in batches.items():
+                            conn.executemany(statement, batch)
+                    self.written += len(batches.get(INSERT_TURN, ()))
+            except Exception as e:
+                # Keep the writer alive; later turns still get stored
+                print(f"Failed to store {len(rows) - len(markers)} consultation records: {e}")
+            finally:
+                for marker in markers:
+                    marker.set()
+
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        """
+        Wait until every turn queued before this call has been written, by
+        any session; the writer keeps one FIFO queue for the whole process.
+        Returns False if that took longer than timeout.
+        """
+        marker = threading.Event()
+        self._queue.put((None, marker))
+        return marker.wait(timeout)
+
+    def latest_consultation(self, session_id):
+        """Start time of the session's most recent consultation, or None"""
+        row = self._connection().execute(
+            "SELECT MAX(start) FROM ("
+            "SELECT MAX(consultation_start) AS start FROM turns WHERE session_id = ? UNION ALL "
+            "SELECT MAX(consultation_start) FROM consultations WHERE session_id = ?)",
+            (session_id, session_id),
+        ).fetchone()
+        return row[0]
+
+    def used_image(self, session_id, consultation_start):
+        """Whether any turn of the consultation already analyzed the image"""
+        row = self._connection().execute(
+            "SELECT EXISTS (SELECT 1 FROM turns WHERE session_id = ? AND consultation_start = ? AND image)",
+            (session_id, consultation_start),
+        ).fetchone()
+        return bool(row[0])
+
+    def _select_turns(self, session_id, consultation_start):
+        return self._connection().execute(
+            "SELECT ts, user, doctor FROM turns WHERE session_id = ? AND consultation_start = ? ORDER BY id",
+            (session_id, consultation_start),
+        )
+
+    def load_session(self, session_id, limit=None):
+        """
+        The latest consultation of a session as (start, turns), turns oldest
+        first and at most limit of them; (None, []) when there is none.
+        """
+        start = self.latest_consultation(session_id)
+        if start is None:
+            return None, []
+        if limit is None:
+            rows = self._select_turns(session_id, start).fetchall()
+        else:
+            rows = self._connection().execute(
+                "SELECT ts, user, doctor FROM ("
+                "SELECT id, ts, user, doctor FROM turns WHERE session_id = ? AND consultation_start = ? "
+                "ORDER BY id DESC LIMIT ?) ORDER BY id",
+                (session_id, start, limit),
+            ).fetchall()
+        return start, [{"timestamp": ts, "user": user, "doctor": doctor} for ts, user, doctor in rows]
+
+    def export(self, session_id, consultation_start, path):
+        """
+        Write a consultation to path as JSON in the format save_conversation
+        always used. Rows are streamed from the database, so the whole
+        history is never held in memory. Returns the number of turns written.
+        """
+        count = 0
+        with open(path, "w") as f:
+            f.write('{\n  "session_start": %s,\n  "conversation_history": [' % json.dumps(consultation_start))
+            for ts, user, doctor in self._select_turns(session_id, consultation_start):
+                turn = {"timestamp": ts, "user": user, "doctor": doctor}
+                f.write(("," if count else "") + "\n    " + json.dumps(turn))
+                count += 1
+            f.write("\n  ]\n}\n")
+        return count
+
+    def stats(self):
+        return {"queued": self._queue.qsize(), "written": self.written}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_consultation_store():
+    """Return the process-wide consultation store"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ConsultationStore()
+        return _store
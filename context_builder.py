@@ -0,0 +1,93 @@
+#Token-budgeted conversation context for the LLM
+import os
+import re
+from collections import deque
+
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("MEDIVOX_CONTEXT_TOKENS", "1200"))
+SUMMARY_TOKEN_BUDGET = int(os.environ.get("MEDIVOX_SUMMARY_TOKENS", "300"))
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (roughly four characters per token for English)"""
+    return len(text) // 4 + 1
+
+
+def _first_sentence(text, max_chars=160):
+    sentence = re.split(r"(?<=[.!?])\s", text.strip(), maxsplit=1)[0]
+    return sentence[:max_chars]
+
+
+def summarize_turn(user_text, doctor_text):
+    """Default summarizer: keep the gist of an exchange in one line"""
+    return f"Patient said {_first_sentence(user_text)} Doctor said {_first_sentence(doctor_text)}"
+
+
+class ConversationContext:
+    """
+    Incrementally maintained LLM context for one consultation.
+
+    Recent exchanges are kept verbatim as user/assistant messages. When their
+    estimated size exceeds ``token_budget``, the oldest exchanges are folded
+    into a rolling summary, which is itself capped at ``summary_budget``.
+    Nothing is rebuilt from scratch on each turn.
+    """
+
+    def __init__(self, token_budget=CONTEXT_TOKEN_BUDGET, summary_budget=SUMMARY_TOKEN_BUDGET,
+                 min_recent_turns=1, summarizer=summarize_turn):
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.min_recent_turns = min_recent_turns
+        self.summarizer = summarizer
+        self.reset()
+
+    def reset(self):
+        self._turns = deque()
+        self._turn_tokens = 0
+        self._summary = deque()
+        self._summary_tokens = 0
+
+    @classmethod
+    def from_pairs(cls, pairs, **kwargs):
+        """Build a context from (user, doctor) tuples such as Gradio chat history"""
+        context = cls(**kwargs)
+        for user_text, doctor_text in pairs:
+            context.add_turn(user_text, doctor_text)
+        return context
+
+    @property
+    def token_count(self):
+        return self._turn_tokens + self._summary_tokens
+
+    def add_turn(self, user_text, doctor_text):
+        tokens = estimate_tokens(user_text) + estimate_tokens(doctor_text)
+        self._turns.append((user_text, doctor_text, tokens))
+        self._turn_tokens += tokens
+        while self._turn_tokens > self.token_budget and len(self._turns) > self.min_recent_turns:
+            old_user, old_doctor, old_tokens = self._turns.popleft()
+            self._turn_tokens -= old_tokens
+            self._add_summary(self.summarizer(old_user, old_doctor))
+
+    def _add_summary(self, line):
+        tokens = estimate_tokens(line)
+        self._summary.append((line, tokens))
+        self._summary_tokens += tokens
+        while self._summary_tokens > self.summary_budget and len(self._summary) > 1:
+            _, dropped = self._summary.popleft()
+            self._summary_tokens -= dropped
+
+    def build_messages(self, system_prompt, user_content):
+        """
+        Return chat messages: system prompt, rolling summary, recent exchanges
+        and finally the current user content (text or multimodal parts).
+        """
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        if self._summary:
+            summary = " ".join(line for line, _ in self._summary)
+            messages.append({"role": "system", "content": "Earlier in this consultation: " + summary})
+        for user_text, doctor_text, _ in self._turns:
+            messages.append({"role": "user", "content": user_text})
+            messages.append({"role": "assistant", "content": doctor_text})
+        messages.append({"role": "user", "content": user_content})
+        return messages
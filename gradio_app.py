@@ -1,189 +1,840 @@
-# if you dont use pipenv uncomment the following:
-from dotenv import load_dotenv
-load_dotenv()
+# Loads .env once per process (needed if you dont use pipenv)
+import config
 
 #VoiceBot UI with Gradio - Real-time Conversation Version
 import os
 import gradio as gr
 import time
-import json
-import tempfile
+import asyncio
+import contextlib
+import inspect
+import threading
 import uuid
+from collections import namedtuple
 from datetime import datetime
 
-from brain_of_the_doctor import encode_image, analyze_image_with_query
-from voice_of_the_patient import record_audio, transcribe_with_groq
-from voice_of_the_doctor import text_to_speech_with_gtts, text_to_speech_with_elevenlabs
-
-# System prompts
-initial_consultation_prompt = """You have to act as a professional doctor, i know you are not but this is for learning purpose. 
-            What's in this image?. Do you find anything wrong with it medically? 
-            If you make a differential, suggest some remedies for them. Donot add any numbers or special characters in 
-            your response. Your response should be in one long paragraph. Also always answer as if you are answering to a real person.
-            Donot say 'In the image I see' but say 'With what I see, I think you have ....'
-            Dont respond as an AI model in markdown, your answer should mimic that of an actual doctor not an AI bot, 
-            Keep your answer concise (max 3 sentences). No preamble, start your answer right away please"""
-
-follow_up_prompt = """You are continuing a medical consultation as a professional doctor. 
-            The patient is asking follow-up questions. Respond naturally and professionally as a doctor would. 
-            Keep responses concise and helpful. Don't use markdown formatting. 
-            Answer as if speaking to a real patient. Maximum 3 sentences."""
-
-greeting_prompt = """You are a professional doctor greeting a new patient. 
-            The patient just said something but hasn't provided an image yet. 
-            Greet them warmly and ask them to describe their concern or upload an image if they have one. 
-            Keep it brief and professional. Maximum 2 sentences."""
+from brain_of_the_doctor import (prepare_image, build_image_content, build_image_messages,
+                                 routed_chat_with_model, routed_chat_stream_with_model, iter_sentences,
+                                 routed_chat_with_model_async)
+# The web app never records from a local microphone or plays audio itself
+from voice_of_the_patient import transcribe_audio, transcribe_audio_async
+from voice_of_the_doctor import tts_cache_stats
+from session_store import SessionStore
+from stt_backends import get_transcription_backend
+from vad import VAD_MODE, detect_speech, trim_silence
+from audio_utils import TARGET_SAMPLE_RATE
+from streaming_audio import PARTIAL_WINDOW_SECONDS, StreamingListener
+from metrics import TurnTrace, annotate, registry
+from tts_backends import get_tts_backend
+from context_builder import ConversationContext
+from vision_cache import get_vision_cache, vision_cache_key
+from client_provider import connection_stats
+from turn_graph import TurnGraph, get_executor
+from admission import TURN_QUEUE_SIZE, AdmissionQueue, Overloaded, is_overload_error
+from model_router import get_model_router
+from media_store import MEDIA_SWEEPER, get_media_store
+from consultation_store import get_consultation_store
+from shared_state import get_shared_sessions
+from prompts import (initial_consultation_prompt, follow_up_prompt, greeting_prompt,
+                     image_findings_prompt, speculative_consultation_prompt)
+
+# Upper bound on exchanges kept in memory per session
+MAX_HISTORY_PER_SESSION = int(os.environ.get("MEDIVOX_MAX_HISTORY", "50"))
+# How many turns (from different sessions) may run at the same time
+CONVERSATION_CONCURRENCY = int(os.environ.get("MEDIVOX_CONCURRENCY", "16"))
+# How often a waiting turn refreshes its queue position
+QUEUE_POLL_SECONDS = 1.0
+# Speak the reply sentence by sentence while the LLM is still generating
+STREAMING_TTS = os.environ.get("MEDIVOX_STREAMING_TTS", "0") == "1"
+# "memory" hands the reply audio to Gradio as bytes instead of a path into the TTS cache, so a reply
+# doesn't wait for the cache write. Gradio still saves the bytes to its own cache to serve them.
+TTS_DELIVERY = os.environ.get("MEDIVOX_TTS_DELIVERY", "file").lower()
+# Run each turn as an async handler instead of on a worker thread
+ASYNC_PIPELINE = os.environ.get("MEDIVOX_ASYNC", "0") == "1"
+# How often an async turn checks whether another turn of its session has finished
+LOCK_POLL_SECONDS = 0.02
+# Per-stage timeouts (seconds) for the async pipeline
+STT_TIMEOUT = float(os.environ.get("MEDIVOX_STT_TIMEOUT", "30"))
+LLM_TIMEOUT = float(os.environ.get("MEDIVOX_LLM_TIMEOUT", "45"))
+TTS_TIMEOUT = float(os.environ.get("MEDIVOX_TTS_TIMEOUT", "30"))
+# Analyze an uploaded image while the patient is still recording their question
+SPECULATIVE_PREFETCH = os.environ.get("MEDIVOX_SPECULATIVE", "0") == "1"
+# How long a transcribed turn waits for an in-flight pre-analysis before doing the full vision call
+PREFETCH_WAIT = float(os.environ.get("MEDIVOX_PREFETCH_WAIT", "2"))
 
 class DoctorConversation:
-    def __init__(self):
+    def __init__(self, session_id="default", max_history=MAX_HISTORY_PER_SESSION):
+        self.session_id = session_id
         self.conversation_history = []
         self.session_start = datetime.now()
         self.has_initial_image = False
+        self.max_history = max_history
+        # Token-budgeted LLM context, updated incrementally with each exchange
+        self.context = ConversationContext()
+        # Serializes turns and resets of this session only, in every pipeline; other sessions run freely
+        self.lock = threading.Lock()
+        # Hands-free microphone buffer, created on first streamed chunk
+        self.listener = None
+        # Speculative image pre-analysis started when an image is uploaded
+        self.prefetch = None
+        # Upload currently shown in the image box, released when it is replaced
+        self.image_filepath = None
+        # Version of the shared snapshot this copy matches (multi-worker deployments)
+        self.shared_version = None
+        self.resume()
+        
+    def resume(self):
+        """Pick up the session's latest stored consultation, e.g. after it was evicted from memory"""
+        shared = get_shared_sessions()
+        if shared is not None:
+            try:
+                snapshot = shared.load(self.session_id)
+            except Exception as e:
+                print(f"Could not load shared session {self.session_id}: {e}")
+                snapshot = None
+            if snapshot is not None:
+                self.restore(snapshot)
+                return
+        start, turns = get_consultation_store().load_session(self.session_id, limit=self.max_history)
+        if start is None:
+            return
+        self.session_start = datetime.fromisoformat(start)
+        self.conversation_history = turns
+        self.has_initial_image = get_consultation_store().used_image(self.session_id, start)
+        for turn in turns:
+            self.context.add_turn(turn['user'], turn['doctor'])
         
-    def add_to_history(self, user_input, doctor_response):
-        self.conversation_history.append({
+    def add_to_history(self, user_input, doctor_response, used_image=False):
+        turn = {
             'timestamp': datetime.now().isoformat(),
             'user': user_input,
             'doctor': doctor_response
-        })
+        }
+        self.conversation_history.append(turn)
+        if len(self.conversation_history) > self.max_history:
+            del self.conversation_history[:-self.max_history]
+        self.context.add_turn(user_input, doctor_response)
+        # Written by a background thread; the full consultation stays available for export
+        get_consultation_store().append(self.session_id, self.session_start.isoformat(), turn, image=used_image)
+        self.publish()
     
-    def get_context_for_llm(self, max_exchanges=3):
-        """Get recent conversation context for the LLM"""
-        if not self.conversation_history:
-            return ""
-        
-        context = "Previous conversation:\n"
-        recent_history = self.conversation_history[-max_exchanges:]
-        
-        for exchange in recent_history:
-            context += f"Patient: {exchange['user']}\n"
-            context += f"Doctor: {exchange['doctor']}\n"
-        
-        return context + "\nCurrent question: "
+    def snapshot(self):
+        """The state another worker needs to continue this conversation"""
+        return {
+            'session_start': self.session_start.isoformat(),
+            'has_initial_image': self.has_initial_image,
+            'conversation_history': self.conversation_history,
+        }
+    
+    def restore(self, snapshot):
+        self.session_start = datetime.fromisoformat(snapshot['session_start'])
+        self.has_initial_image = snapshot['has_initial_image']
+        self.conversation_history = snapshot['conversation_history']
+        self.context.reset()
+        for turn in self.conversation_history:
+            self.context.add_turn(turn['user'], turn['doctor'])
+        self.shared_version = snapshot.get('version')
+    
+    def publish(self):
+        """Write this session to the shared backend, if workers share one"""
+        shared = get_shared_sessions()
+        if shared is None:
+            return
+        version = uuid.uuid4().hex
+        try:
+            shared.save(self.session_id, self.snapshot(), version)
+            self.shared_version = version
+        except Exception as e:
+            # The conversation goes on from this worker's copy
+            print(f"Could not publish session {self.session_id}: {e}")
+    
+    def sync(self):
+        """Reload the shared snapshot if another worker changed the session since we last saw it"""
+        shared = get_shared_sessions()
+        if shared is None:
+            return
+        try:
+            if shared.version(self.session_id) in (None, self.shared_version):
+                return
+            snapshot = shared.load(self.session_id)
+        except Exception as e:
+            print(f"Could not sync session {self.session_id}: {e}")
+            return
+        if snapshot is not None:
+            self.restore(snapshot)
+    
+    def get_messages_for_llm(self, system_prompt, user_content):
+        """Get multi-turn messages (summary, recent exchanges, current input) for the LLM"""
+        return self.context.build_messages(system_prompt, user_content)
     
     def reset(self):
         self.conversation_history = []
         self.session_start = datetime.now()
         self.has_initial_image = False
+        self.context.reset()
+        self.listener = None
+        self.cancel_prefetch()
+        # Recorded right away, so resuming this session doesn't bring back the cleared consultation
+        get_consultation_store().start_consultation(self.session_id, self.session_start.isoformat())
+        self.publish()
+    
+    def cancel_prefetch(self):
+        """Drop any speculative pre-analysis; a call already in flight finishes but is ignored"""
+        if self.prefetch is not None:
+            self.prefetch.future.cancel()
+            self.prefetch = None
+
+# Uploaded recordings and images are deleted once no session holds them
+media_store = get_media_store()
+# One conversation per browser session, evicted after inactivity. The browser may still show an
+# evicted session's image, so its files are left to the sweeper instead of being deleted.
+session_store = SessionStore(DoctorConversation, on_evict=media_store.forget_session)
+# Turns beyond CONVERSATION_CONCURRENCY wait here (or are shed) before touching any upstream
+turn_queue = AdmissionQueue(CONVERSATION_CONCURRENCY)
+
+def session_id_of(request):
+    return request.session_hash if request is not None else "default"
+
+def get_session(request):
+    """Look up the conversation belonging to the caller's Gradio session"""
+    doctor_session = session_store.get(session_id_of(request))
+    # With several workers, another one may have served this session in the meantime
+    doctor_session.sync()
+    return doctor_session
 
-# Global conversation manager
-doctor_session = DoctorConversation()
+@contextlib.asynccontextmanager
+async def session_lock_async(doctor_session):
+    """
+    Hold the session's lock from the event loop. It is the same lock the
+    threaded handlers take; polling for it keeps the loop free and leaves
+    nothing held if the waiting turn is cancelled.
+    """
+    while not doctor_session.lock.acquire(blocking=False):
+        await asyncio.sleep(LOCK_POLL_SECONDS)
+    try:
+        yield
+    finally:
+        doctor_session.lock.release()
 
 def text_to_speech_with_elevenlabs_fixed(input_text):
-    """Generate speech and return the file path"""
+    """Generate speech with the configured TTS backend; returns a file path, or bytes in memory delivery"""
     try:
-        from elevenlabs.client import ElevenLabs
-        import elevenlabs
-        
-        ELEVENLABS_API_KEY = os.environ.get("ELEVEN_API_KEY")
-        if not ELEVENLABS_API_KEY:
-            print("ElevenLabs API key not found")
-            return None
-            
-        client = ElevenLabs(api_key=ELEVENLABS_API_KEY)
-        
-        # Create a unique temporary file
-        temp_dir = tempfile.gettempdir()
-        unique_id = str(uuid.uuid4())[:8]
-        output_filepath = os.path.join(temp_dir, f"doctor_response_{unique_id}.mp3")
-        
-        audio = client.generate(
-            text=input_text,
-            voice="Aria",
-            output_format="mp3_22050_32",
-            model="eleven_turbo_v2"
-        )
-        
-        elevenlabs.save(audio, output_filepath)
-        return output_filepath
+        if TTS_DELIVERY == "memory":
+            # Not written to the TTS cache before returning; Gradio still saves the bytes to serve them
+            return get_tts_backend().synthesize_bytes(input_text)
+        # Served from the shared TTS cache, so repeated phrases aren't re-synthesized
+        return get_tts_backend().synthesize(input_text)
         
     except Exception as e:
         print(f"Error generating speech: {e}")
         return None
 
-def process_conversation(audio_filepath, image_filepath, chat_history):
+def audio_size(audio):
+    """Size of reply audio given as a path or as bytes"""
+    return len(audio) if isinstance(audio, bytes) else os.path.getsize(audio)
+
+def speech_note(vad_result):
+    """Short status note about how much silence VAD removed"""
+    trimmed = vad_result.original_seconds - vad_result.trimmed_seconds
+    return f"trimmed {trimmed:.1f}s of silence" if trimmed >= 0.1 else ""
+
+def transcribe_turn(audio_filepath, trace):
+    """
+    Convert the patient's recording to text with the configured STT backend.
+    Silence is trimmed first and clips without speech never reach the network.
+    Returns the text and a status note.
+    """
+    if VAD_MODE == "off":
+        with trace.stage("stt"):
+            return transcribe_audio(audio_filepath), ""
+    with trace.stage("vad"):
+        vad_result = detect_speech(audio_filepath)
+    if not vad_result.has_speech:
+        return "", "no speech detected"
+    with trace.stage("stt"):
+        return transcribe_audio(vad_result.samples), speech_note(vad_result)
+
+async def transcribe_turn_async(audio_filepath, trace):
+    """Async version of transcribe_turn"""
+    if VAD_MODE == "off":
+        with trace.stage("stt"):
+            return await transcribe_audio_async(audio_filepath), ""
+    with trace.stage("vad"):
+        vad_result = await asyncio.to_thread(detect_speech, audio_filepath)
+    if not vad_result.has_speech:
+        return "", "no speech detected"
+    with trace.stage("stt"):
+        return await transcribe_audio_async(vad_result.samples), speech_note(vad_result)
+
+# A background pre-analysis of one uploaded image
+SpeculativePrefetch = namedtuple("SpeculativePrefetch", ["image_filepath", "future"])
+# The image side of a turn: the PreparedImage and, when prefetched, its findings
+TurnImage = namedtuple("TurnImage", ["prepared", "findings"])
+
+def analyze_image_findings(image_filepath, session_id):
+    """Describe an image's findings independent of the patient's question; returns (content hash, findings)"""
+    trace = TurnTrace("prefetch", session_id)
+    try:
+        with trace.stage("prefetch"):
+            image = prepare_image(image_filepath)
+            vision_cache = get_vision_cache()
+            cache_keys = vision_cache_keys(image.content_hash, image_findings_prompt)
+            findings = cached_vision_reply(vision_cache, cache_keys) if vision_cache else None
+            if findings is None:
+                messages = build_image_messages(image_findings_prompt, image.encoded, image.mime_type)
+                findings, model = routed_chat_with_model(messages)
+                findings = findings.strip()
+                if vision_cache:
+                    vision_cache.set(cache_keys[model], findings)
+        trace.finish()
+        return image.content_hash, findings
+    except Exception:
+        trace.finish("error")
+        raise
+
+def on_image_change(image_filepath, request: gr.Request = None):
+    """
+    A new image was uploaded or the image was removed. The previous upload
+    is no longer shown, so it can go; a new one may be pre-analyzed.
+    """
+    doctor_session = get_session(request)
+    previous = doctor_session.image_filepath
+    doctor_session.image_filepath = media_store.track(session_id_of(request), image_filepath)
+    if previous and previous != image_filepath:
+        media_store.release(session_id_of(request), previous)
+    start_speculative_analysis(doctor_session, image_filepath, request)
+
+def start_speculative_analysis(doctor_session, image_filepath, request):
+    """
+    On image upload, start analyzing it before the patient has finished asking.
+    A new image or a cleared one cancels the previous pre-analysis.
+    """
+    doctor_session.cancel_prefetch()
+    if not SPECULATIVE_PREFETCH or not image_filepath or doctor_session.has_initial_image:
+        return
+    future = get_executor("prefetch").submit(analyze_image_findings, image_filepath, session_id_of(request))
+    doctor_session.prefetch = SpeculativePrefetch(image_filepath, future)
+
+def prefetched_findings(doctor_session, image):
+    """Findings of the speculative pre-analysis of this image, or None to do the full vision call"""
+    prefetch = doctor_session.prefetch
+    if prefetch is None or prefetch.future.cancelled():
+        return None
+    try:
+        content_hash, findings = prefetch.future.result(timeout=PREFETCH_WAIT)
+    except Exception as e:
+        print(f"Speculative analysis unavailable: {e}")
+        return None
+    # Guards against a prefetch for an image that was replaced meanwhile
+    return findings if content_hash == image.content_hash else None
+
+def image_for_turn(doctor_session, image_filepath, trace):
+    """
+    Prepare the photo when this turn is the initial image consultation.
+    It doesn't depend on the transcript, so it runs alongside STT.
+    Returns a TurnImage, or None when the turn won't send an image.
+    """
+    if not image_filepath or doctor_session.has_initial_image:
+        return None
+    if not os.path.exists(image_filepath):
+        # Uploads nobody referenced for MEDIVOX_MEDIA_MAX_AGE are swept
+        raise FileNotFoundError("The uploaded image has expired. Please upload it again.")
+    with trace.stage("image_encode"):
+        return TurnImage(prepare_image(image_filepath), None)
+
+def with_prefetched_findings(doctor_session, image, trace):
+    """
+    Attach the speculative pre-analysis to the turn's image once the transcript is in.
+    The wait only starts after STT and is capped at PREFETCH_WAIT, so a slow
+    pre-analysis costs a turn at most that much before the full vision call.
+    """
+    if image is None or doctor_session.prefetch is None:
+        return image
+    with trace.stage("prefetch_wait"):
+        return image._replace(findings=prefetched_findings(doctor_session, image.prepared))
+
+def start_turn_graph(doctor_session, transcribe, image_filepath, trace, recording=None):
+    """
+    Start the input stages of a turn: STT ("stt") and image preparation
+    ("image") run concurrently. Text-only turns share the same graph; their
+    image node simply yields None. The uploaded recording is only needed
+    by STT, so it is deleted ("cleanup") as soon as transcription ends.
+    """
+    media_store.track(trace.session_id, image_filepath)
+    media_store.track(trace.session_id, recording)
+    graph = TurnGraph()
+    graph.add("stt", transcribe)
+    graph.add("image", image_for_turn, doctor_session, image_filepath, trace)
+    if recording:
+        graph.background("cleanup", media_store.release, trace.session_id, recording, after=("stt",))
+    return graph
+
+def finish_turn(graph, trace, status="ok"):
+    """Close the trace and log pool stats off the critical path, once every stage has ended"""
+    graph.background("finish", trace.finish, status, after=("stt", "image"))
+    if status == "ok":
+        graph.background("stats", log_pool_stats)
+
+def log_pool_stats():
+    print(f"Connection reuse: {connection_stats()}")
+    print(f"TTS cache: {tts_cache_stats()}")
+
+# What a turn sends to the LLM; cache_keys is set only for cacheable image consultations
+TurnPlan = namedtuple("TurnPlan", ["messages", "used_image", "cache_keys"])
+
+def vision_cache_keys(image_hash, prompt):
+    """Vision cache key of an image question for each routed model, in the order the router tries them"""
+    return {model: vision_cache_key(image_hash, model, prompt) for model in get_model_router().candidates()}
+
+def cached_vision_reply(vision_cache, cache_keys):
+    """A cached answer to the question from any of the models, or None"""
+    for key in cache_keys.values():
+        cached = vision_cache.get(key)
+        if cached is not None:
+            return cached
+    return None
+
+def build_turn_messages(doctor_session, user_text, image):
+    """
+    Pick the prompt for this turn and build the LLM messages.
+    image is the TurnImage from image_for_turn, or None.
+    Returns a TurnPlan with the messages and whether this is the initial image consultation.
+    """
+    if image is not None:
+        # First consultation with image
+        if image.findings:
+            # The image was already analyzed; a short text-only call combines it with the question
+            prompt = speculative_consultation_prompt
+            content = f"Your findings from the image: {image.findings}\nPatient said: {user_text}"
+        else:
+            prompt = initial_consultation_prompt
+            content = build_image_content(user_text, image.prepared.encoded, image.prepared.mime_type)
+        messages = doctor_session.get_messages_for_llm(prompt, content)
+        # Only a fresh consultation depends on nothing but the image and the question
+        cache_keys = None
+        if get_vision_cache() and not doctor_session.conversation_history:
+            cache_keys = vision_cache_keys(image.prepared.content_hash, prompt + " " + user_text)
+        return TurnPlan(messages, True, cache_keys)
+        
+    if doctor_session.conversation_history:
+        # Follow-up conversation
+        return TurnPlan(doctor_session.get_messages_for_llm(follow_up_prompt, user_text), False, None)
+        
+    # First interaction without image
+    return TurnPlan(doctor_session.get_messages_for_llm(greeting_prompt, "Patient said: " + user_text), False, None)
+
+def generate_reply(plan, trace):
+    """Get the doctor's reply for a turn, answering repeated image questions from the vision cache"""
+    with trace.stage("llm"):
+        vision_cache = get_vision_cache() if plan.cache_keys else None
+        if vision_cache:
+            cached = cached_vision_reply(vision_cache, plan.cache_keys)
+            if cached is not None:
+                annotate(cache_hits=1)
+                return cached
+        doctor_response, model = routed_chat_with_model(plan.messages)
+        if vision_cache:
+            # Stored under the model that answered, which may be the fallback
+            vision_cache.set(plan.cache_keys[model], doctor_response)
+        return doctor_response
+
+def stream_reply(plan):
+    """Streaming version of generate_reply, yielding text chunks"""
+    vision_cache = get_vision_cache() if plan.cache_keys else None
+    if vision_cache:
+        cached = cached_vision_reply(vision_cache, plan.cache_keys)
+        if cached is not None:
+            yield cached
+            return
+    chunks = []
+    model = None
+    for chunk, model in routed_chat_stream_with_model(plan.messages):
+        chunks.append(chunk)
+        yield chunk
+    if vision_cache and model:
+        vision_cache.set(plan.cache_keys[model], "".join(chunks))
+
+async def generate_reply_async(plan, trace):
+    """Async version of generate_reply"""
+    with trace.stage("llm"):
+        vision_cache = get_vision_cache() if plan.cache_keys else None
+        if vision_cache:
+            cached = await asyncio.to_thread(cached_vision_reply, vision_cache, plan.cache_keys)
+            if cached is not None:
+                annotate(cache_hits=1)
+                return cached
+        doctor_response, model = await routed_chat_with_model_async(plan.messages)
+        if vision_cache:
+            await asyncio.to_thread(vision_cache.set, plan.cache_keys[model], doctor_response)
+        return doctor_response
+
+def failure_kind(error):
+    """Trace status of a failed turn"""
+    return "busy" if is_overload_error(error) else "error"
+
+def failure_status(error):
+    """Status line for a failed turn; overload and provider rate limits get a quick "busy" answer"""
+    if is_overload_error(error):
+        retry_after = getattr(error, "retry_after", 10)
+        return f"🚦 The doctor is busy right now. Please try again in about {retry_after:.0f} seconds."
+    return f"Error: {str(error)}"
+
+def queue_status(position):
+    return f"⏳ Many patients right now, you are number {position} in line..."
+
+def admitted(handler):
+    """
+    Wrap a send handler with admission control. Turns beyond
+    CONVERSATION_CONCURRENCY wait in line and see their position in the
+    status box; when the line is full or too slow they get a "busy" answer
+    right away instead of a timeout.
+    """
+    def busy(chat_history, error):
+        return chat_history, None, failure_status(error), gr.update()
+    
+    def waiting(position):
+        return gr.update(), gr.update(), queue_status(position), gr.update()
+    
+    if inspect.iscoroutinefunction(handler):
+        async def run_async(audio_filepath, image_filepath, chat_history, request: gr.Request = None):
+            try:
+                ticket = turn_queue.enter()
+            except Overloaded as e:
+                yield busy(chat_history, e)
+                return
+            try:
+                while not ticket.admitted:
+                    if turn_queue.expired(ticket):
+                        yield busy(chat_history, Overloaded("the doctor", retry_after=5.0))
+                        return
+                    yield waiting(turn_queue.position(ticket))
+                    await asyncio.sleep(QUEUE_POLL_SECONDS)
+                yield await handler(audio_filepath, image_filepath, chat_history, request)
+            finally:
+                turn_queue.leave(ticket)
+        return run_async
+    
+    def run(audio_filepath, image_filepath, chat_history, request: gr.Request = None):
+        try:
+            ticket = turn_queue.enter()
+        except Overloaded as e:
+            yield busy(chat_history, e)
+            return
+        try:
+            while not turn_queue.wait(ticket, QUEUE_POLL_SECONDS):
+                if turn_queue.expired(ticket):
+                    yield busy(chat_history, Overloaded("the doctor", retry_after=5.0))
+                    return
+                yield waiting(turn_queue.position(ticket))
+            if inspect.isgeneratorfunction(handler):
+                yield from handler(audio_filepath, image_filepath, chat_history, request)
+            else:
+                yield handler(audio_filepath, image_filepath, chat_history, request)
+        finally:
+            turn_queue.leave(ticket)
+    return run
+
+def ready_status(*notes):
+    """Status line shown after a successful turn"""
+    status = "✅ Response generated. Ready for next question!"
+    details = [note for note in notes if note]
+    vision_cache = get_vision_cache()
+    if vision_cache:
+        details.append(vision_cache.status_text())
+    if details:
+        status += f" ({', '.join(details)})"
+    return status
+
+def record_turn(doctor_session, user_text, doctor_response, used_image, chat_history):
+    """Store a finished exchange in the session and the chat window"""
+    if used_image:
+        doctor_session.has_initial_image = True
+        doctor_session.cancel_prefetch()
+    doctor_session.add_to_history(user_text, doctor_response, used_image)
+    chat_history.append([user_text, doctor_response])
+
+def process_conversation(audio_filepath, image_filepath, chat_history, request: gr.Request = None):
     """Main function to process user input and generate doctor response"""
     
     if not audio_filepath:
         return chat_history, None, "Please record your voice message first.", gr.Audio(value=None)
     
+    doctor_session = get_session(request)
+    trace = TurnTrace("sync", session_id_of(request))
+    with doctor_session.lock:
+        return _process_turn(doctor_session, audio_filepath, image_filepath, chat_history, trace)
+
+def _process_turn(doctor_session, audio_filepath, image_filepath, chat_history, trace):
+    """Run one consultation turn for an already locked session"""
+    # Transcription and image preparation run concurrently
+    graph = start_turn_graph(
+        doctor_session, lambda: transcribe_turn(audio_filepath, trace), image_filepath, trace, recording=audio_filepath
+    )
     try:
-        # Transcribe the audio
-        user_text = transcribe_with_groq(
-            GROQ_API_KEY=os.environ.get("GROQ_API_KEY"), 
-            audio_filepath=audio_filepath,
-            stt_model="whisper-large-v3"
-        )
+        user_text, stt_note = graph.result("stt")
         
         if not user_text or user_text.strip() == "":
+            finish_turn(graph, trace, "no_speech")
             return chat_history, None, "Sorry, I couldn't understand what you said. Please try again.", gr.Audio(value=None)
         
-        # Determine the type of response needed
-        doctor_response = ""
+        chat_history, voice_file, status = respond_to_text(
+            doctor_session, user_text, graph.result("image"), chat_history, trace, stt_note
+        )
+        finish_turn(graph, trace)
         
-        if image_filepath and not doctor_session.has_initial_image:
-            # First consultation with image
-            query = initial_consultation_prompt + " " + user_text
-            doctor_response = analyze_image_with_query(
-                query=query,
-                encoded_image=encode_image(image_filepath),
-                model="meta-llama/llama-4-scout-17b-16e-instruct"
-            )
-            doctor_session.has_initial_image = True
+        # Return updated chat, audio response, status, and clear audio input
+        return chat_history, voice_file, status, gr.Audio(value=None)
+        
+    except Exception as e:
+        finish_turn(graph, trace, failure_kind(e))
+        print(f"Error in process_conversation: {e}")
+        return chat_history, None, failure_status(e), gr.Audio(value=None)
+
+def respond_to_text(doctor_session, user_text, image, chat_history, trace, *notes):
+    """Answer an already transcribed patient message: LLM reply, history and voice"""
+    # Determine the type of response needed
+    image = with_prefetched_findings(doctor_session, image, trace)
+    plan = build_turn_messages(doctor_session, user_text, image)
+    doctor_response = generate_reply(plan, trace)
+    
+    # Clean up the response
+    doctor_response = doctor_response.strip()
+    
+    # Add to conversation history and update chat interface
+    record_turn(doctor_session, user_text, doctor_response, plan.used_image, chat_history)
+    
+    # Generate speech response
+    with trace.stage("tts"):
+        voice_file = text_to_speech_with_elevenlabs_fixed(doctor_response)
+        if voice_file:
+            annotate(bytes_received=audio_size(voice_file))
+    
+    return chat_history, voice_file, ready_status(*notes)
+
+def transcribe_utterance(utterance, trace):
+    """transcribe_turn for an utterance already buffered in memory by hands-free mode"""
+    with trace.stage("vad"):
+        vad_result = trim_silence(utterance, TARGET_SAMPLE_RATE)
+    if not vad_result.has_speech:
+        return "", "no speech detected"
+    with trace.stage("stt"):
+        return transcribe_audio(vad_result.samples), speech_note(vad_result)
+
+def process_stream_chunk(chunk, image_filepath, chat_history, request: gr.Request = None):
+    """
+    Hands-free mode: called for every chunk of the streaming microphone.
+    Chunks are buffered until the patient stops talking, then the turn runs
+    without a Send click. While they talk, a partial transcript is shown.
+    """
+    if chunk is None:
+        return gr.update(), gr.update(), gr.update()
+    
+    doctor_session = get_session(request)
+    if doctor_session.listener is None:
+        doctor_session.listener = StreamingListener()
+    listener = doctor_session.listener
+    
+    sample_rate, samples = chunk
+    state = listener.add_chunk(sample_rate, samples)
+    
+    if state == "speech":
+        if listener.partial_due():
+            try:
+                listener.mark_partial(transcribe_audio(listener.partial_audio()))
+            except Exception as e:
+                print(f"Partial transcription failed: {e}")
+                listener.mark_partial(listener.partial_text)
+        # Only the latest seconds are transcribed, so a long utterance shows its tail
+        clipped = "…" if listener.buffer.seconds > PARTIAL_WINDOW_SECONDS else ""
+        partial = f": {clipped}{listener.partial_text}" if listener.partial_text else "..."
+        return gr.update(), gr.update(), f"🎤 Listening{partial}"
+    
+    if state != "end":
+        return gr.update(), gr.update(), gr.update()
+    
+    utterance = listener.take_utterance()
+    trace = TurnTrace("hands_free", session_id_of(request))
+    try:
+        # Hands-free turns can't show a queue position, so they just wait their turn
+        with turn_queue.slot(), doctor_session.lock:
+            return _process_utterance(doctor_session, utterance, image_filepath, chat_history, trace)
+    except Overloaded as e:
+        trace.finish("busy")
+        return chat_history, gr.update(), failure_status(e)
+
+def _process_utterance(doctor_session, utterance, image_filepath, chat_history, trace):
+    """Run one hands-free turn for an already locked session"""
+    graph = start_turn_graph(doctor_session, lambda: transcribe_utterance(utterance, trace), image_filepath, trace)
+    try:
+        user_text, stt_note = graph.result("stt")
+        if not user_text:
+            finish_turn(graph, trace, "no_speech")
+            return chat_history, gr.update(), "Sorry, I couldn't understand what you said. Please try again."
+        chat_history, voice_file, status = respond_to_text(
+            doctor_session, user_text, graph.result("image"), chat_history, trace, stt_note
+        )
+        finish_turn(graph, trace)
+        return chat_history, voice_file, status
+    except Exception as e:
+        finish_turn(graph, trace, failure_kind(e))
+        print(f"Error in process_stream_chunk: {e}")
+        return chat_history, gr.update(), failure_status(e)
+
+def process_conversation_streaming(audio_filepath, image_filepath, chat_history, request: gr.Request = None):
+    """
+    Streaming variant of process_conversation.
+    The reply is read from the LLM token by token, cut into sentences and each
+    sentence is voiced as soon as it is complete, so playback starts while the
+    rest of the answer is still being generated.
+    """
+    if not audio_filepath:
+        yield chat_history, None, "Please record your voice message first.", gr.Audio(value=None)
+        return
+    
+    doctor_session = get_session(request)
+    trace = TurnTrace("streaming", session_id_of(request))
+    with doctor_session.lock:
+        graph = start_turn_graph(
+            doctor_session, lambda: transcribe_turn(audio_filepath, trace), image_filepath, trace, recording=audio_filepath
+        )
+        live_row = False
+        try:
+            user_text, stt_note = graph.result("stt")
+            
+            if not user_text or user_text.strip() == "":
+                finish_turn(graph, trace, "no_speech")
+                yield chat_history, None, "Sorry, I couldn't understand what you said. Please try again.", gr.Audio(value=None)
+                return
             
-        elif doctor_session.conversation_history:
-            # Follow-up conversation
-            context = doctor_session.get_context_for_llm()
-            full_query = follow_up_prompt + "\n\n" + context + user_text
+            image = with_prefetched_findings(doctor_session, graph.result("image"), trace)
+            plan = build_turn_messages(doctor_session, user_text, image)
+            chat_history.append([user_text, ""])
+            live_row = True
             
-            # Use Groq for text-only follow-up
-            from groq import Groq
-            client = Groq()
-            chat_completion = client.chat.completions.create(
-                messages=[{"role": "user", "content": full_query}],
-                model="meta-llama/llama-4-scout-17b-16e-instruct"
+            # LLM and TTS interleave here, so they are timed as one stage
+            spoken = []
+            first_audio = None
+            reply_start = time.perf_counter()
+            with trace.stage("llm_tts_stream"):
+                for sentence in iter_sentences(stream_reply(plan)):
+                    spoken.append(sentence)
+                    chat_history[-1][1] = " ".join(spoken)
+                    for audio_chunk in get_tts_backend().stream(sentence):
+                        if first_audio is None:
+                            first_audio = time.perf_counter() - reply_start
+                            registry.observe("medivox_time_to_first_audio_seconds", first_audio)
+                        yield chat_history, audio_chunk, "🔊 Doctor is speaking...", gr.Audio(value=None)
+            
+            # Replace the live row with the final exchange
+            chat_history.pop()
+            live_row = False
+            record_turn(doctor_session, user_text, " ".join(spoken).strip(), plan.used_image, chat_history)
+            finish_turn(graph, trace)
+            yield chat_history, None, ready_status(stt_note), gr.Audio(value=None)
+            
+        except Exception as e:
+            if live_row:
+                # The exchange isn't recorded, so drop its half-written row as the other handlers do
+                chat_history.pop()
+            finish_turn(graph, trace, failure_kind(e))
+            print(f"Error in process_conversation_streaming: {e}")
+            yield chat_history, None, failure_status(e), gr.Audio(value=None)
+
+async def process_conversation_async(audio_filepath, image_filepath, chat_history, request: gr.Request = None):
+    """
+    Async variant of process_conversation.
+    STT, the LLM call and TTS are awaited on the event loop with a timeout per
+    stage, so a turn doesn't hold a worker thread. Clicking "New Session"
+    cancels the running turn.
+    """
+    if not audio_filepath:
+        return chat_history, None, "Please record your voice message first.", gr.Audio(value=None)
+    
+    # Looking up a session may read SQLite or the shared state backend; keep that off the event loop
+    doctor_session = await asyncio.to_thread(get_session, request)
+    trace = TurnTrace("async", session_id_of(request))
+    media_store.track(trace.session_id, audio_filepath)
+    media_store.track(trace.session_id, image_filepath)
+    async with session_lock_async(doctor_session):
+        stage = "transcription"
+        try:
+            # Same graph as the sync path: STT and image preparation concurrently
+            (user_text, stt_note), image = await asyncio.wait_for(
+                asyncio.gather(
+                    transcribe_turn_async(audio_filepath, trace),
+                    asyncio.to_thread(image_for_turn, doctor_session, image_filepath, trace),
+                ),
+                timeout=STT_TIMEOUT
             )
-            doctor_response = chat_completion.choices[0].message.content
             
-        else:
-            # First interaction without image
-            query = greeting_prompt + " Patient said: " + user_text
-            from groq import Groq
-            client = Groq()
-            chat_completion = client.chat.completions.create(
-                messages=[{"role": "user", "content": query}],
-                model="meta-llama/llama-4-scout-17b-16e-instruct"
+            if not user_text or user_text.strip() == "":
+                trace.finish("no_speech")
+                return chat_history, None, "Sorry, I couldn't understand what you said. Please try again.", gr.Audio(value=None)
+            
+            stage = "doctor response"
+            image = await asyncio.to_thread(with_prefetched_findings, doctor_session, image, trace)
+            plan = build_turn_messages(doctor_session, user_text, image)
+            doctor_response = await asyncio.wait_for(
+                generate_reply_async(plan, trace),
+                timeout=LLM_TIMEOUT
             )
-            doctor_response = chat_completion.choices[0].message.content
-        
-        # Clean up the response
-        doctor_response = doctor_response.strip()
-        
-        # Add to conversation history
-        doctor_session.add_to_history(user_text, doctor_response)
-        
-        # Update chat interface
-        chat_history.append([user_text, doctor_response])
-        
-        # Generate speech response
-        voice_file = text_to_speech_with_elevenlabs_fixed(doctor_response)
-        
-        # Return updated chat, audio response, status, and clear audio input
-        return chat_history, voice_file, f"✅ Response generated. Ready for next question!", gr.Audio(value=None)
-        
-    except Exception as e:
-        error_msg = f"Error: {str(e)}"
-        print(f"Error in process_conversation: {e}")
-        return chat_history, None, error_msg, gr.Audio(value=None)
+            doctor_response = doctor_response.strip()
+            # Publishing the session to the shared backend is a blocking round trip
+            await asyncio.to_thread(record_turn, doctor_session, user_text, doctor_response, plan.used_image, chat_history)
+            
+            stage = "speech"
+            try:
+                with trace.stage("tts"):
+                    if TTS_DELIVERY == "memory":
+                        synthesis = asyncio.to_thread(get_tts_backend().synthesize_bytes, doctor_response)
+                    else:
+                        synthesis = get_tts_backend().synthesize_async(doctor_response)
+                    voice_file = await asyncio.wait_for(synthesis, timeout=TTS_TIMEOUT)
+                    annotate(bytes_received=audio_size(voice_file))
+            except Exception as e:
+                # The text answer is still useful without audio
+                print(f"Error generating speech: {e}")
+                voice_file = None
+            
+            trace.finish()
+            return chat_history, voice_file, ready_status(stt_note), gr.Audio(value=None)
+            
+        except asyncio.TimeoutError:
+            trace.finish("timeout")
+            print(f"Timed out during {stage}")
+            return chat_history, None, f"Error: {stage} took too long, please try again.", gr.Audio(value=None)
+        except asyncio.CancelledError:
+            trace.finish("cancelled")
+            raise
+        except Exception as e:
+            trace.finish(failure_kind(e))
+            print(f"Error in process_conversation_async: {e}")
+            return chat_history, None, failure_status(e), gr.Audio(value=None)
+        finally:
+            # The recording is never needed again; delete it off the event loop
+            get_executor("background").submit(media_store.release, trace.session_id, audio_filepath)
+
+def select_conversation_handler():
+    """Choose the send handler configured for this deployment"""
+    if ASYNC_PIPELINE:
+        return process_conversation_async
+    if STREAMING_TTS:
+        return process_conversation_streaming
+    return process_conversation
 
-def clear_conversation():
+def clear_conversation(request: gr.Request = None):
     """Reset the conversation"""
-    global doctor_session
-    doctor_session.reset()
-    return [], None, "Conversation cleared. Ready for new consultation!", gr.Audio(value=None)
+    doctor_session = get_session(request)
+    with doctor_session.lock:
+        doctor_session.reset()
+        doctor_session.image_filepath = None
+    # The image is cleared too, so its upload can go
+    media_store.release_session(session_id_of(request))
+    return [], None, "Conversation cleared. Ready for new consultation!", gr.Audio(value=None), None
 
-def save_conversation():
-    """Save current conversation to file"""
+def save_conversation(request: gr.Request = None):
+    """Export the current consultation from the consultation store to a file"""
+    doctor_session = get_session(request)
     if not doctor_session.conversation_history:
         return "No conversation to save."
     
@@ -196,15 +847,27 @@ def save_conversation():
         else:
             filename = f"doctor_consultation_{timestamp}.json"
         
-        with open(filename, 'w') as f:
-            json.dump({
-                'session_start': doctor_session.session_start.isoformat(),
-                'conversation_history': doctor_session.conversation_history
-            }, f, indent=2)
+        store = get_consultation_store()
+        # Waits for every session's queued turns, not just this one's: the single writer is FIFO.
+        # The flush marker ends the batch being collected, so this is one write, not a batch interval.
+        if not store.flush():
+            print(f"Consultation store is behind; the export of {doctor_session.session_id} may miss recent turns")
+        store.export(doctor_session.session_id, doctor_session.session_start.isoformat(), filename)
         return f"Conversation saved as {filename}"
     except Exception as e:
         return f"Error saving conversation: {str(e)}"
 
+def end_session(request: gr.Request):
+    """Drop the session state when the browser tab is closed"""
+    session_store.discard(request.session_hash)
+    media_store.release_session(request.session_hash)
+    shared = get_shared_sessions()
+    if shared is not None:
+        try:
+            shared.discard(request.session_hash)
+        except Exception as e:
+            print(f"Could not drop shared session {request.session_hash}: {e}")
+
 def update_status_for_recording():
     """Update status when recording starts"""
     return "🎤 Recording... Speak now!"
@@ -260,6 +923,16 @@ with gr.Blocks(
                     show_label=True
                 )
                 
+                gr.Markdown("### 🎙️ Hands-free Mode (Optional)")
+                gr.Markdown("*Turn on the live microphone and just talk — the doctor answers when you pause*")
+                stream_input = gr.Audio(
+                    sources=["microphone"],
+                    type="numpy",
+                    streaming=True,
+                    label="Live microphone",
+                    show_label=False
+                )
+                
                 gr.Markdown("### 📷 Upload Image (Optional)")
                 gr.Markdown("*Only needed for initial consultation with visual analysis*")
                 image_input = gr.Image(
@@ -283,7 +956,9 @@ with gr.Blocks(
                 audio_output = gr.Audio(
                     label="Listen to doctor's response",
                     show_label=True,
-                    interactive=False
+                    interactive=False,
+                    streaming=STREAMING_TTS,
+                    autoplay=STREAMING_TTS
                 )
             
             # Control buttons
@@ -321,16 +996,22 @@ with gr.Blocks(
         """)
     
     # Event handlers with proper clearing
-    send_btn.click(
-        fn=process_conversation,
+    send_event = send_btn.click(
+        fn=admitted(select_conversation_handler()),
         inputs=[audio_input, image_input, chatbot],
         outputs=[chatbot, audio_output, status_display, audio_input],
-        show_progress=True
+        show_progress=True,
+        # Stable name for API clients (batch jobs, load tests)
+        api_name="consult",
+        # Waiting turns need a worker too, to report their place in line
+        concurrency_limit=CONVERSATION_CONCURRENCY + TURN_QUEUE_SIZE
     )
     
+    # Starting a new session cancels a turn that is still running
     clear_btn.click(
         fn=clear_conversation,
-        outputs=[chatbot, audio_output, status_display, audio_input]
+        outputs=[chatbot, audio_output, status_display, audio_input, image_input],
+        cancels=[send_event]
     )
     
     save_btn.click(
@@ -338,6 +1019,14 @@ with gr.Blocks(
         outputs=[status_display]
     )
     
+    # Release a replaced upload; in speculative mode, start analyzing the new image right away
+    image_input.change(
+        fn=on_image_change,
+        inputs=[image_input],
+        outputs=None,
+        show_progress="hidden"
+    )
+    
     # Update status based on recording state
     audio_input.start_recording(
         fn=update_status_for_recording,
@@ -348,16 +1037,82 @@ with gr.Blocks(
         fn=update_status_for_stop,
         outputs=[status_display]
     )
+    
+    # Hands-free mode: process microphone chunks as they arrive
+    stream_input.stream(
+        fn=process_stream_chunk,
+        inputs=[stream_input, image_input, chatbot],
+        outputs=[chatbot, audio_output, status_display],
+        stream_every=0.5,
+        concurrency_limit=CONVERSATION_CONCURRENCY,
+        show_progress="hidden"
+    )
+    
+    # Free per-session state as soon as the tab goes away
+    app.unload(end_session)
+
+# Bound Gradio's own queue too, so a burst beyond our admission queue is rejected quickly
+app.queue(max_size=TURN_QUEUE_SIZE * 2, default_concurrency_limit=CONVERSATION_CONCURRENCY)
+
+def metrics_text():
+    """Prometheus exposition of turn/stage latencies plus connection and cache gauges"""
+    lines = [registry.render_prometheus().rstrip("\n")]
+    lines.append("# TYPE medivox_http_connection_reuse_ratio gauge")
+    for provider, stats in connection_stats().items():
+        lines.append(f'medivox_http_connection_reuse_ratio{{provider="{provider}"}} {stats["reuse_ratio"]:.4f}')
+    cache_stats = tts_cache_stats()
+    lines.append("# TYPE medivox_tts_cache_hits_total counter")
+    lines.append(f"medivox_tts_cache_hits_total {cache_stats['hits']}")
+    lines.append("# TYPE medivox_tts_cache_misses_total counter")
+    lines.append(f"medivox_tts_cache_misses_total {cache_stats['misses']}")
+    lines.append("# TYPE medivox_turn_queue_length gauge")
+    lines.append(f"medivox_turn_queue_length {len(turn_queue)}")
+    media_stats = media_store.stats()
+    lines.append("# TYPE medivox_media_tracked_files gauge")
+    lines.append(f"medivox_media_tracked_files {media_stats['tracked_files']}")
+    lines.append("# TYPE medivox_media_removed_bytes_total counter")
+    lines.append(f"medivox_media_removed_bytes_total {media_stats['removed_bytes']}")
+    consultation_stats = get_consultation_store().stats()
+    lines.append("# TYPE medivox_consultation_turns_queued gauge")
+    lines.append(f"medivox_consultation_turns_queued {consultation_stats['queued']}")
+    lines.append("# TYPE medivox_consultation_turns_written_total counter")
+    lines.append(f"medivox_consultation_turns_written_total {consultation_stats['written']}")
+    lines.append("# TYPE medivox_active_sessions gauge")
+    lines.append(f"medivox_active_sessions {len(session_store)}")
+    return "\n".join(lines) + "\n"
+
+def create_server():
+    """FastAPI app serving the Gradio UI at / and Prometheus metrics at /metrics"""
+    from fastapi import FastAPI
+    from fastapi.responses import PlainTextResponse
+    
+    server = FastAPI()
+    
+    @server.get("/metrics", response_class=PlainTextResponse)
+    def metrics_endpoint():
+        return metrics_text()
+    
+    # Age/size limits for Gradio's upload and output cache
+    if MEDIA_SWEEPER:
+        media_store.start_sweeper()
+    # Like launch(show_error=True): handler exceptions are shown in the UI as well as logged.
+    # launch(debug=True) only kept the main thread blocked, which uvicorn.run does anyway.
+    return gr.mount_gradio_app(server, app, path="/", show_error=True)
 
 if __name__ == "__main__":
+    import uvicorn
+    
+    # Set by load_balancer.py when it starts several workers
+    host = os.environ.get("MEDIVOX_HOST", "127.0.0.1")
+    port = int(os.environ.get("MEDIVOX_PORT", "7860"))
+    
     print("🩺 Starting AI Doctor Application...")
-    print("📍 Access at: http://127.0.0.1:7860")
+    print(f"📍 Access at: http://{host}:{port}")
+    print(f"📈 Metrics at: http://{host}:{port}/metrics")
     print("💡 Usage: Record → Send → Get Response → Repeat")
     
-    app.launch(
-        debug=True,
-        share=False,
-        server_port=7860,
-        server_name="127.0.0.1",
-        show_error=True
-    )
\ No newline at end of file
+    # Load a local STT model before the first patient is waiting on it
+    get_transcription_backend().warm_up()
+    get_tts_backend().warm_up()
+    
+    uvicorn.run(create_server(), host=host, port=port)
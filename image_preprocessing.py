@@ -0,0 +1,77 @@
+#Image preprocessing before sending a photo to the vision model
+import base64
+import hashlib
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from io import BytesIO
+
+from metrics import annotate
+
+IMAGE_MAX_EDGE = int(os.environ.get("MEDIVOX_IMAGE_MAX_EDGE", "1024"))
+IMAGE_FORMAT = os.environ.get("MEDIVOX_IMAGE_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.environ.get("MEDIVOX_IMAGE_QUALITY", "85"))
+IMAGE_CACHE_SIZE = int(os.environ.get("MEDIVOX_IMAGE_CACHE_SIZE", "64"))
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+PreparedImage = namedtuple("PreparedImage", ["encoded", "mime_type", "content_hash", "size_bytes"])
+
+_prepared = OrderedDict()
+_prepared_lock = threading.Lock()
+
+
+def image_content_hash(raw_bytes):
+    """Stable identifier of an uploaded image's exact bytes"""
+    return hashlib.sha256(raw_bytes).hexdigest()
+
+
+def _reencode(raw_bytes, max_edge, image_format, quality):
+    # Pillow is loaded with the first image instead of at startup
+    from PIL import Image, ImageOps
+    with Image.open(BytesIO(raw_bytes)) as img:
+        # Apply the camera rotation before the EXIF block is dropped
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        if image_format in ("JPEG", "WEBP") and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        output = BytesIO()
+        # No exif= argument, so metadata is not written to the new file
+        img.save(output, format=image_format, quality=quality, optimize=True)
+        return output.getvalue()
+
+
+def prepare_image(image_path, max_edge=IMAGE_MAX_EDGE, image_format=IMAGE_FORMAT, quality=IMAGE_QUALITY):
+    """
+    Downscale, strip metadata and re-encode an image for the vision model.
+
+    Returns a PreparedImage with the base64 payload and its MIME type.
+    Results are remembered by content hash, so re-uploading the same photo
+    skips decoding and re-encoding.
+    """
+    with open(image_path, "rb") as f:
+        raw_bytes = f.read()
+    content_hash = image_content_hash(raw_bytes)
+    cache_key = (content_hash, max_edge, image_format, quality)
+
+    with _prepared_lock:
+        prepared = _prepared.get(cache_key)
+        if prepared is not None:
+            _prepared.move_to_end(cache_key)
+            annotate(input_bytes=len(raw_bytes), output_bytes=prepared.size_bytes, cache_hits=1)
+            return prepared
+
+    encoded_bytes = _reencode(raw_bytes, max_edge, image_format, quality)
+    annotate(input_bytes=len(raw_bytes), output_bytes=len(encoded_bytes))
+    prepared = PreparedImage(
+        encoded=base64.b64encode(encoded_bytes).decode("utf-8"),
+        mime_type=MIME_TYPES[image_format],
+        content_hash=content_hash,
+        size_bytes=len(encoded_bytes),
+    )
+
+    with _prepared_lock:
+        _prepared[cache_key] = prepared
+        while len(_prepared) > IMAGE_CACHE_SIZE:
+            _prepared.popitem(last=False)
+    return prepared
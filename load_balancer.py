@@ -0,0 +1,290 @@
+#Runs several app workers behind one address, keeping each Gradio session on one worker
+#Usage: python load_balancer.py --workers 4 [--port 7860]
+#       python load_balancer.py --backend 10.0.0.5:7861 --backend 10.0.0.6:7861   (workers started elsewhere)
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from media_store import GRADIO_TEMP_DIR
+from tts_cache import TTS_CACHE_MAX_BYTES
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+# JSON bodies up to this size are read to find the session hash (Gradio's queue/join)
+MAX_INSPECTED_BODY = 1024 * 1024
+# A worker that refused a connection is skipped for this long
+WORKER_RETRY_SECONDS = 5.0
+STATUS_PATH = "/lb-status"
+
+
+class Worker:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.down_until = 0.0
+        self.in_flight = 0
+        self.requests = 0
+
+    @property
+    def name(self):
+        return f"{self.host}:{self.port}"
+
+    @property
+    def healthy(self):
+        return time.monotonic() >= self.down_until
+
+    def status(self):
+        return {"worker": self.name, "healthy": self.healthy, "in_flight": self.in_flight, "requests": self.requests}
+
+
+def session_key(target, body):
+    """
+    The Gradio session hash of a request, or None. Gradio sends it as a
+    query parameter (queue/data), in the path (heartbeat) or in the JSON
+    body (queue/join). File uploads carry none, so they may land on any
+    worker: workers must share GRADIO_TEMP_DIR, where uploads are stored.
+    """
+    url = urlsplit(target)
+    values = parse_qs(url.query).get("session_hash")
+    if values:
+        return values[0]
+    parts = url.path.rstrip("/").split("/")
+    if len(parts) >= 2 and parts[-2] == "heartbeat":
+        return parts[-1]
+    if body:
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return None
+        if isinstance(payload, dict) and isinstance(payload.get("session_hash"), str):
+            return payload["session_hash"]
+    return None
+
+
+class LoadBalancer:
+    """
+    HTTP reverse proxy with session affinity. Requests carrying a session
+    hash go to the healthy worker with the highest rendezvous hash for it, so
+    a session stays put and only the sessions of a failed or removed worker
+    move; everything else goes to the least busy worker. Each proxied
+    request uses its own upstream connection, which keeps the proxy a plain
+    byte pipe for streamed (SSE) responses.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._next = 0
+
+    def candidates(self, key):
+        """Workers in the order they should be tried"""
+        healthy = [w for w in self.workers if w.healthy]
+        others = [w for w in self.workers if not w.healthy]
+        if key is None:
+            self._next += 1
+            # Least busy first; the rotating offset spreads ties
+            order = sorted(
+                range(len(healthy)),
+                key=lambda i: (healthy[i].in_flight, (i - self._next) % len(healthy)),
+            )
+            return [healthy[i] for i in order] + others
+        def score(worker):
+            return hashlib.sha1(f"{worker.name}/{key}".encode()).digest()
+        return sorted(healthy, key=score, reverse=True) + sorted(others, key=score, reverse=True)
+
+    def status(self):
+        return [worker.status() for worker in self.workers]
+
+    async def handle(self, client_reader, client_writer):
+        upstream_writer = None
+        try:
+            try:
+                head = await client_reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                return
+            lines = head.decode("latin-1").split("\r\n")
+            _, target, _ = lines[0].split(" ", 2)
+            headers = [line.split(":", 1) for line in lines[1:] if ":" in line]
+            lookup = {name.strip().lower(): value.strip() for name, value in headers}
+
+            if target == STATUS_PATH:
+                await self._respond(client_writer, 200, json.dumps(self.status()))
+                return
+
+            body = b""
+            length = int(lookup.get("content-length", "0") or 0)
+            if "json" in lookup.get("content-type", "") and 0 < length <= MAX_INSPECTED_BODY:
+                body = await client_reader.readexactly(length)
+            key = session_key(target, body)
+
+            upgrade = "upgrade" in lookup.get("connection", "").lower()
+            forwarded = [lines[0]]
+            for name, value in headers:
+                if not upgrade and name.strip().lower() in ("connection", "keep-alive"):
+                    continue
+                forwarded.append(f"{name}:{value}")
+            if not upgrade:
+                # One request per upstream connection: the response ends when the worker closes it
+                forwarded.append("Connection: close")
+            peer = client_writer.get_extra_info("peername")
+            if peer:
+                forwarded.append(f"X-Forwarded-For: {peer[0]}")
+            request_head = ("\r\n".join(forwarded) + "\r\n\r\n").encode("latin-1")
+
+            worker = None
+            for candidate in self.candidates(key):
+                try:
+                    upstream_reader, upstream_writer = await asyncio.open_connection(candidate.host, candidate.port)
+                except OSError:
+                    candidate.down_until = time.monotonic() + WORKER_RETRY_SECONDS
+                    continue
+                worker = candidate
+                break
+            if worker is None:
+                await self._respond(client_writer, 503, "No app worker available")
+                return
+
+            worker.in_flight += 1
+            worker.requests += 1
+            try:
+                upstream_writer.write(request_head + body)
+                to_worker = asyncio.ensure_future(self._pipe(client_reader, upstream_writer))
+                await self._pipe(upstream_reader, client_writer)
+                to_worker.cancel()
+            finally:
+                worker.in_flight -= 1
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            for writer in (upstream_writer, client_writer):
+                if writer is not None:
+                    writer.close()
+
+    @staticmethod
+    async def _pipe(reader, writer):
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+
+    @staticmethod
+    async def _respond(writer, status, text):
+        body = text.encode("utf-8")
+        reason = {200: "OK", 503: "Service Unavailable"}[status]
+        content_type = "application/json" if status == 200 else "text/plain"
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+
+
+def free_port(host="127.0.0.1"):
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(host, port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def start_workers(count, host, base_port, env):
+    """
+    Launch gradio_app.py count times on consecutive ports. The workers share
+    one upload directory, so a file uploaded through any of them is found by
+    the one running the session; deleting uploads is left to the age-based
+    sweeper of the first worker. They also split one TTS cache budget, since
+    each process only evicts the files it knows about.
+    """
+    shared = {
+        "GRADIO_TEMP_DIR": env.get("GRADIO_TEMP_DIR", GRADIO_TEMP_DIR),
+        "MEDIVOX_TTS_CACHE_MAX_BYTES": str(int(env.get("MEDIVOX_TTS_CACHE_MAX_BYTES", TTS_CACHE_MAX_BYTES)) // count),
+    }
+    processes = []
+    for i in range(count):
+        worker_env = dict(env, **shared, MEDIVOX_HOST=host, MEDIVOX_PORT=str(base_port + i))
+        # Uploads may be held by sessions on any worker: none deletes them, one sweeps them by age
+        worker_env.update(MEDIVOX_MEDIA_SHARED="1", MEDIVOX_MEDIA_SWEEPER="1" if i == 0 else "0")
+        processes.append(subprocess.Popen([sys.executable, "gradio_app.py"], cwd=REPO_ROOT, env=worker_env))
+    return processes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run app workers behind a session-affine load balancer")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7860)
+    parser.add_argument("--workers", type=int, default=2, help="app workers to start")
+    parser.add_argument("--base-port", type=int, default=7861, help="port of the first started worker")
+    parser.add_argument("--backend", action="append", default=[],
+                        help="host:port of an already running worker (repeatable; nothing is started)")
+    parser.add_argument("--state-port", type=int, default=6379,
+                        help="port for the bundled state server when MEDIVOX_SESSION_BACKEND is unset")
+    parser.add_argument("--startup-timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    processes = []
+    if args.backend:
+        workers = [Worker(*backend.rsplit(":", 1)) for backend in args.backend]
+        for worker in workers:
+            worker.port = int(worker.port)
+    else:
+        env = dict(os.environ)
+        if not env.get("MEDIVOX_SESSION_BACKEND"):
+            # Workers must share session state; start the stand-in unless Redis is configured
+            processes.append(subprocess.Popen(
+                [sys.executable, "state_server.py", "--host", "127.0.0.1", "--port", str(args.state_port)],
+                cwd=REPO_ROOT,
+            ))
+            if not wait_for_port("127.0.0.1", args.state_port, 10):
+                sys.exit("State server did not start")
+            env["MEDIVOX_SESSION_BACKEND"] = f"redis://127.0.0.1:{args.state_port}/0"
+        processes.extend(start_workers(args.workers, "127.0.0.1", args.base_port, env))
+        workers = [Worker("127.0.0.1", args.base_port + i) for i in range(args.workers)]
+        for worker in workers:
+            if not wait_for_port(worker.host, worker.port, args.startup_timeout):
+                print(f"Worker {worker.name} is not up yet; it gets traffic once it accepts connections")
+
+    def stop(*_):
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+
+    balancer = LoadBalancer(workers)
+
+    async def serve():
+        server = await asyncio.start_server(balancer.handle, args.host, args.port)
+        print(f"⚖️  Load balancer on http://{args.host}:{args.port} -> {', '.join(w.name for w in workers)}")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+#Lifecycle of uploaded and generated media files
+import os
+import tempfile
+import threading
+import time
+
+# Where Gradio keeps uploads and the files it serves
+GRADIO_TEMP_DIR = os.environ.get("GRADIO_TEMP_DIR", os.path.join(tempfile.gettempdir(), "gradio"))
+# Untracked files older than this are swept
+MEDIA_MAX_AGE = float(os.environ.get("MEDIVOX_MEDIA_MAX_AGE", str(6 * 3600)))
+# Above this total, the oldest untracked files are swept first
+MEDIA_MAX_BYTES = int(os.environ.get("MEDIVOX_MEDIA_MAX_BYTES", str(1024 * 1024 * 1024)))
+SWEEP_INTERVAL = float(os.environ.get("MEDIVOX_MEDIA_SWEEP_INTERVAL", "300"))
+# Several worker processes share GRADIO_TEMP_DIR, and with it uploads other workers may hold
+MEDIA_SHARED = os.environ.get("MEDIVOX_MEDIA_SHARED", "0") == "1"
+# Whether this process runs the sweeper; with shared media only one worker should
+MEDIA_SWEEPER = os.environ.get("MEDIVOX_MEDIA_SWEEPER", "1") == "1"
+# Replies older versions wrote straight into the temp dir
+LEGACY_PREFIX = "doctor_response_"
+
+
+class MediaStore:
+    """
+    Reference-counted ownership of media files by session.
+
+    Gradio names uploads by content hash, so two sessions may share one path;
+    a file is deleted only when the last session holding it lets go. Only
+    files under the managed roots are ever deleted. A background sweeper
+    removes untracked files past the age limit, then the oldest ones while
+    the roots exceed the size limit.
+
+    Reference counts only cover this process. With ``shared`` set, other
+    workers may hold the same files, so releasing never deletes anything:
+    using a file refreshes its modification time instead, and the sweeper
+    of a single worker removes files by age alone.
+    """
+
+    def __init__(self, roots=(GRADIO_TEMP_DIR,), max_age=MEDIA_MAX_AGE, max_bytes=MEDIA_MAX_BYTES, shared=MEDIA_SHARED):
+        self.roots = [os.path.realpath(root) for root in roots]
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self._refs = {}
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self.removed_files = 0
+        self.removed_bytes = 0
+
+    def _managed(self, path):
+        return any(path.startswith(root + os.sep) for root in self.roots)
+
+    def track(self, session_id, path):
+        """Record that session_id uses path; returns path unchanged"""
+        if not path:
+            return path
+        real = os.path.realpath(path)
+        if not self._managed(real):
+            return path
+        if self.shared:
+            # Tells every worker's sweeper the file is in use
+            try:
+                os.utime(real)
+            except OSError:
+                pass
+        with self._lock:
+            owned = self._sessions.setdefault(session_id, set())
+            if real not in owned:
+                owned.add(real)
+                self._refs[real] = self._refs.get(real, 0) + 1
+        return path
+
+    def release(self, session_id, path):
+        """Drop session_id's hold on path, deleting the file if nobody else holds it"""
+        if not path:
+            return
+        real = os.path.realpath(path)
+        with self._lock:
+            owned = self._sessions.get(session_id)
+            if owned is None or real not in owned:
+                return
+            owned.discard(real)
+            unused = self._drop_ref(real)
+        if unused and not self.shared:
+            self._remove(real)
+
+    def release_session(self, session_id):
+        """Release everything a session held (tab closed or session expired)"""
+        with self._lock:
+            owned = self._sessions.pop(session_id, set())
+            unused = [path for path in owned if self._drop_ref(path)]
+        if self.shared:
+            return
+        for path in unused:
+            self._remove(path)
+
+    def forget_session(self, session_id):
+        """
+        Drop a session's holds without deleting anything, e.g. when its state
+        is evicted while the browser may still show the files. They are then
+        left to the sweeper's age and size limits.
+        """
+        with self._lock:
+            owned = self._sessions.pop(session_id, set())
+            for path in owned:
+                self._drop_ref(path)
+
+    def _drop_ref(self, path):
+        # Caller holds the lock; True when the last reference went away
+        count = self._refs.get(path, 0) - 1
+        if count > 0:
+            self._refs[path] = count
+            return False
+        self._refs.pop(path, None)
+        return True
+
+    def _remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            self.removed_files += 1
+            self.removed_bytes += size
+
+    def _candidates(self):
+        """Untracked files under the managed roots and legacy replies, as (mtime, size, path)"""
+        files = []
+        for root in self.roots:
+            for dirpath, _, filenames in os.walk(root):
+                for name in filenames:
+                    files.append(os.path.join(dirpath, name))
+        temp_dir = tempfile.gettempdir()
+        try:
+            files.extend(
+                os.path.join(temp_dir, name) for name in os.listdir(temp_dir)
+                if name.startswith(LEGACY_PREFIX) and name.endswith(".mp3")
+            )
+        except OSError:
+            pass
+        candidates = []
+        with self._lock:
+            in_use = set(self._refs)
+        for path in files:
+            if os.path.realpath(path) in in_use:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            candidates.append((stat.st_mtime, stat.st_size, path))
+        return candidates
+
+    def sweep(self):
+        """One sweeper pass; returns (files removed, bytes freed)"""
+        before = (self.removed_files, self.removed_bytes)
+        now = time.time()
+        candidates = sorted(self._candidates())
+        total = sum(size for _, size, _ in candidates)
+        # Other workers' files are only known by their age, so the size limit can't apply
+        max_bytes = float("inf") if self.shared else self.max_bytes
+        for mtime, size, path in candidates:
+            if now - mtime <= self.max_age and total <= max_bytes:
+                # Sorted oldest first: everything after this is newer
+                break
+            self._remove(path)
+            total -= size
+        self._remove_empty_dirs()
+        return self.removed_files - before[0], self.removed_bytes - before[1]
+
+    def _remove_empty_dirs(self):
+        # Gradio gives every file its own hash-named directory
+        cutoff = time.time() - 60
+        for root in self.roots:
+            for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+                if dirpath == root or filenames:
+                    continue
+                try:
+                    # Skip directories that may be about to receive a file
+                    if os.path.getmtime(dirpath) < cutoff:
+                        os.rmdir(dirpath)
+                except OSError:
+                    pass
+
+    def start_sweeper(self, interval=SWEEP_INTERVAL):
+        """Run sweep() every interval seconds on a daemon thread"""
+        if self._sweeper is not None:
+            return
+        def loop():
+            while True:
+                try:
+                    removed, freed = self.sweep()
+                    if removed:
+                        print(f"Media sweeper removed {removed} files ({freed / 1e6:.1f} MB)")
+                except Exception as e:
+                    print(f"Media sweeper failed: {e}")
+                time.sleep(interval)
+        self._sweeper = threading.Thread(target=loop, name="medivox-media-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "tracked_files": len(self._refs),
+                "sessions": len(self._sessions),
+                "removed_files": self.removed_files,
+                "removed_bytes": self.removed_bytes,
+            }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_media_store():
+    """Return the process-wide media store"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = MediaStore()
+        return _store
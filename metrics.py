@@ -0,0 +1,201 @@
+#Per-turn latency tracing and in-process metrics
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+# Optional JSONL file receiving one trace record per turn
+TRACE_FILE = os.environ.get("MEDIVOX_TRACE_FILE", "")
+# Samples kept per series for percentile estimates
+RESERVOIR_SIZE = int(os.environ.get("MEDIVOX_METRICS_RESERVOIR", "2048"))
+QUANTILES = (0.5, 0.95, 0.99)
+
+_current_span = contextvars.ContextVar("medivox_current_span", default=None)
+
+
+class Summary:
+    """Count, sum and a sliding window of recent observations for quantiles"""
+
+    def __init__(self, size=RESERVOIR_SIZE):
+        self.count = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=size)
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.samples.append(value)
+
+    def quantile(self, q):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        index = min(int(q * len(ordered)), len(ordered) - 1)
+        return ordered[index]
+
+
+class MetricsRegistry:
+    """Thread-safe store of summaries and counters keyed by name and labels"""
+
+    def __init__(self):
+        self._summaries = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            key = self._key(name, labels)
+            summary = self._summaries.get(key)
+            if summary is None:
+                summary = self._summaries[key] = Summary()
+            summary.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            key = self._key(name, labels)
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def percentiles(self, name, **labels):
+        with self._lock:
+            summary = self._summaries.get(self._key(name, labels))
+            if summary is None:
+                return {}
+            return {f"p{int(q * 100)}": summary.quantile(q) for q in QUANTILES}
+
+    def render_prometheus(self):
+        """Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, labels), summary in sorted(self._summaries.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} summary")
+                    typed.add(name)
+                for q in QUANTILES:
+                    lines.append(f"{name}{_labels(labels + (('quantile', str(q)),))} {summary.quantile(q):.6f}")
+                lines.append(f"{name}_sum{_labels(labels)} {summary.total:.6f}")
+                lines.append(f"{name}_count{_labels(labels)} {summary.count}")
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{name}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+registry = MetricsRegistry()
+_trace_file_lock = threading.Lock()
+
+
+class Span:
+    """Timing and counters (bytes, tokens) of one stage in a turn"""
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.counters = {}
+
+    def add(self, **counters):
+        for key, value in counters.items():
+            if value:
+                self.counters[key] = self.counters.get(key, 0) + value
+
+
+class TurnTrace:
+    """
+    Collects the stages of one consultation turn.
+
+    Use ``with trace.stage("stt"):`` around each stage and call ``finish``
+    once; stage timings feed the shared registry as they complete.
+    """
+
+    def __init__(self, kind, session_id=None):
+        self.turn_id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.session_id = session_id
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.spans = []
+        self.finished = False
+
+    @contextmanager
+    def stage(self, name, **counters):
+        span = Span(name)
+        span.add(**counters)
+        token = _current_span.set(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span.seconds = time.perf_counter() - start
+            try:
+                _current_span.reset(token)
+            except ValueError:
+                # Generators may resume in another context
+                _current_span.set(None)
+            self.spans.append(span)
+            registry.observe("medivox_stage_seconds", span.seconds, stage=name)
+            for key, value in span.counters.items():
+                registry.inc(f"medivox_stage_{key}_total", value, stage=name)
+
+    def finish(self, status="ok"):
+        if self.finished:
+            return
+        self.finished = True
+        total = time.perf_counter() - self._start
+        registry.observe("medivox_turn_seconds", total, kind=self.kind)
+        registry.inc("medivox_turns_total", kind=self.kind, status=status)
+        if TRACE_FILE:
+            record = {
+                "turn_id": self.turn_id,
+                "kind": self.kind,
+                "session": self.session_id,
+                "started_at": self.started_at,
+                "total_seconds": round(total, 6),
+                "status": status,
+                "stages": [
+                    {"stage": span.name, "seconds": round(span.seconds, 6), **span.counters}
+                    for span in self.spans
+                ],
+            }
+            with _trace_file_lock:
+                with open(TRACE_FILE, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+
+
+def annotate(**counters):
+    """Add bytes/token counters to the stage currently running, if any"""
+    span = _current_span.get()
+    if span is not None:
+        span.add(**counters)
+
+
+def message_bytes(messages):
+    """Approximate request size of chat messages without serializing them"""
+    total = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            total += len(content)
+        elif isinstance(content, list):
+            for part in content:
+                total += len(part.get("text") or part.get("image_url", {}).get("url", ""))
+    return total
@@ -0,0 +1,279 @@
+#Routing of LLM calls across models: retries, hedged requests and fallback
+import asyncio
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from admission import Overloaded
+from metrics import registry
+from turn_graph import get_executor
+
+PRIMARY_MODEL = os.environ.get("MEDIVOX_LLM_MODEL", "meta-llama/llama-4-scout-17b-16e-instruct")
+FALLBACK_MODEL = os.environ.get("MEDIVOX_LLM_FALLBACK_MODEL", "meta-llama/llama-4-maverick-17b-128e-instruct")
+# Extra attempts after a failed call, alternating between the models
+LLM_RETRIES = int(os.environ.get("MEDIVOX_LLM_RETRIES", "2"))
+# First backoff delay (seconds); doubles per attempt, with full jitter
+LLM_BACKOFF = float(os.environ.get("MEDIVOX_LLM_BACKOFF", "0.5"))
+# Send a duplicate request once a call runs past the model's recent p95
+LLM_HEDGE = os.environ.get("MEDIVOX_LLM_HEDGE", "0") == "1"
+# Demote a model whose recent p95 latency (seconds) or error rate exceeds these
+LLM_LATENCY_BUDGET = float(os.environ.get("MEDIVOX_LLM_LATENCY_BUDGET", "10"))
+LLM_ERROR_BUDGET = float(os.environ.get("MEDIVOX_LLM_ERROR_BUDGET", "0.25"))
+# Longest one routed call may take, retries and hedged requests included
+LLM_TIMEOUT = float(os.environ.get("MEDIVOX_LLM_TIMEOUT", "45"))
+# Samples needed before stats influence routing, and how long samples count
+MIN_SAMPLES = 20
+STATS_WINDOW_SECONDS = 300
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+def is_retryable(error):
+    """Timeouts, dropped connections, rate limits and server errors are worth another attempt"""
+    if isinstance(error, Overloaded):
+        # Shedding is deliberate; retrying would only add load
+        return False
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    # groq.APIConnectionError / APITimeoutError carry no status code
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+class ModelStats:
+    """Latency and error samples of one model over the last STATS_WINDOW_SECONDS"""
+
+    def __init__(self):
+        self._samples = deque()
+        self._lock = threading.Lock()
+
+    def record(self, seconds, ok):
+        with self._lock:
+            self._samples.append((time.monotonic(), seconds, ok))
+            self._expire()
+
+    def _expire(self):
+        horizon = time.monotonic() - STATS_WINDOW_SECONDS
+        while self._samples and self._samples[0][0] < horizon:
+            self._samples.popleft()
+
+    def snapshot(self):
+        with self._lock:
+            self._expire()
+            latencies = sorted(seconds for _, seconds, ok in self._samples if ok and seconds is not None)
+            errors = sum(1 for _, _, ok in self._samples if not ok)
+            count = len(self._samples)
+        p95 = latencies[min(int(0.95 * len(latencies)), len(latencies) - 1)] if latencies else None
+        return {
+            "samples": count,
+            "p95_s": p95 if len(latencies) >= MIN_SAMPLES else None,
+            "error_rate": errors / count if count >= MIN_SAMPLES else 0.0,
+        }
+
+
+class ModelRouter:
+    """
+    Runs an LLM call against an ordered list of models.
+
+    ``call`` is a function of the model name. Failed attempts are retried
+    with exponential backoff, moving to the next model; a model over its
+    latency or error budget is tried last. With hedging on, a second request
+    goes out once the first runs past its model's p95 and the first answer wins.
+    """
+
+    def __init__(self, models, retries=LLM_RETRIES, backoff=LLM_BACKOFF, hedge=LLM_HEDGE, timeout=LLM_TIMEOUT):
+        self.models = [m for i, m in enumerate(models) if m and m not in models[:i]]
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge = hedge
+        self.timeout = timeout
+        self.stats = {model: ModelStats() for model in self.models}
+
+    @property
+    def primary(self):
+        return self.models[0]
+
+    def over_budget(self, model):
+        snapshot = self.stats[model].snapshot()
+        slow = snapshot["p95_s"] is not None and snapshot["p95_s"] > LLM_LATENCY_BUDGET
+        return slow or snapshot["error_rate"] > LLM_ERROR_BUDGET
+
+    def candidates(self):
+        """Models in the order they should be tried; healthy ones first"""
+        healthy = [m for m in self.models if not self.over_budget(m)]
+        return healthy + [m for m in self.models if m not in healthy]
+
+    def _attempts(self):
+        order = self.candidates()
+        return [order[i % len(order)] for i in range(self.retries + 1)]
+
+    def _delay(self, attempt):
+        return random.uniform(0, self.backoff * 2 ** attempt)
+
+    def _record(self, model, start, ok, latency=True):
+        seconds = time.perf_counter() - start
+        self.stats[model].record(seconds if latency else None, ok)
+        registry.inc("medivox_llm_requests_total", model=model, outcome="ok" if ok else "error")
+        if ok and latency:
+            registry.observe("medivox_llm_seconds", seconds, model=model)
+
+    def _timed(self, call, model):
+        # Returns (result, model), so a hedged race tells which model answered
+        start = time.perf_counter()
+        try:
+            result = call(model)
+        except Exception:
+            self._record(model, start, False)
+            raise
+        self._record(model, start, True)
+        return result, model
+
+    def _hedge_deadline(self, model):
+        return self.stats[model].snapshot()["p95_s"] if self.hedge else None
+
+    def _hedged(self, call, model, backup, give_up_at):
+        """Start call(model); past its p95, race call(backup) against it until give_up_at"""
+        deadline = self._hedge_deadline(model)
+        if deadline is None:
+            return self._timed(call, model)
+        executor = get_executor("hedge")
+        # Each request runs in a copy of the caller's context so usage lands on its trace stage
+        pending = {executor.submit(contextvars.copy_context().run, self._timed, call, model)}
+        done, pending = wait(pending, timeout=deadline)
+        if not done:
+            registry.inc("medivox_llm_hedges_total", model=backup)
+            pending.add(executor.submit(contextvars.copy_context().run, self._timed, call, backup))
+        error = None
+        while pending or done:
+            for future in done:
+                if future.exception() is None:
+                    # The slower request finishes in the background and is ignored
+                    return future.result()
+                error = future.exception()
+            if not pending:
+                break
+            done, pending = wait(pending, timeout=max(give_up_at - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+            if not done:
+                # The requests finish in the background and are ignored
+                raise TimeoutError(f"LLM call to {model} took longer than {self.timeout:.0f}s")
+        raise error
+
+    def run(self, call):
+        return self.run_with_model(call)[0]
+
+    def run_with_model(self, call):
+        """Like run, but returns (result, model that produced it)"""
+        give_up_at = time.monotonic() + self.timeout
+        attempts = self._attempts()
+        for attempt, model in enumerate(attempts):
+            backup = attempts[attempt + 1] if attempt + 1 < len(attempts) else model
+            try:
+                return self._hedged(call, model, backup, give_up_at)
+            except Exception as e:
+                if attempt == len(attempts) - 1 or not is_retryable(e) or time.monotonic() >= give_up_at:
+                    raise
+                print(f"LLM call to {model} failed ({e}), retrying")
+                time.sleep(self._delay(attempt))
+
+    async def _timed_async(self, call, model):
+        start = time.perf_counter()
+        try:
+            result = await call(model)
+        except Exception:
+            self._record(model, start, False)
+            raise
+        self._record(model, start, True)
+        return result, model
+
+    async def _hedged_async(self, call, model, backup):
+        deadline = self._hedge_deadline(model)
+        if deadline is None:
+            return await self._timed_async(call, model)
+        pending = {asyncio.ensure_future(self._timed_async(call, model))}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=deadline)
+            if not done:
+                registry.inc("medivox_llm_hedges_total", model=backup)
+                pending.add(asyncio.ensure_future(self._timed_async(call, backup)))
+            error = None
+            while pending or done:
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            raise error
+        finally:
+            # Unlike threads, the losing request can really be cancelled
+            for task in pending:
+                task.cancel()
+
+    async def run_async(self, call):
+        return (await self.run_async_with_model(call))[0]
+
+    async def run_async_with_model(self, call):
+        """Async version of run_with_model"""
+        attempts = self._attempts()
+        for attempt, model in enumerate(attempts):
+            backup = attempts[attempt + 1] if attempt + 1 < len(attempts) else model
+            try:
+                return await self._hedged_async(call, model, backup)
+            except Exception as e:
+                if attempt == len(attempts) - 1 or not is_retryable(e):
+                    raise
+                print(f"LLM call to {model} failed ({e}), retrying")
+                await asyncio.sleep(self._delay(attempt))
+
+    def stream(self, call):
+        """
+        Yield from call(model), an iterator of text chunks. Attempts are only
+        retried before the first chunk; after that a failure ends the stream.
+        """
+        for chunk, _ in self.stream_with_model(call):
+            yield chunk
+
+    def stream_with_model(self, call):
+        """Like stream, but yields (chunk, model that produced it)"""
+        attempts = self._attempts()
+        for attempt, model in enumerate(attempts):
+            start = time.perf_counter()
+            started = False
+            try:
+                for chunk in call(model):
+                    started = True
+                    yield chunk, model
+            except Exception as e:
+                # Streamed durations aren't comparable to completions; only outcomes count
+                self._record(model, start, False, latency=False)
+                if started or attempt == len(attempts) - 1 or not is_retryable(e):
+                    raise
+                print(f"LLM stream from {model} failed ({e}), retrying")
+                time.sleep(self._delay(attempt))
+                continue
+            self._record(model, start, True, latency=False)
+            return
+
+    def status(self):
+        """Per-model stats for logs and the metrics endpoint"""
+        return {model: self.stats[model].snapshot() for model in self.models}
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_model_router():
+    """Return the process-wide router over the primary and fallback models"""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter([PRIMARY_MODEL, FALLBACK_MODEL])
+        return _router
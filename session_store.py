@@ -0,0 +1,91 @@
+#Per-session state registry for the Gradio app
+import os
+import threading
+import time
+from collections import OrderedDict
+
+SESSION_TTL_SECONDS = int(os.environ.get("MEDIVOX_SESSION_TTL", "1800"))
+MAX_SESSIONS = int(os.environ.get("MEDIVOX_MAX_SESSIONS", "500"))
+
+
+class SessionStore:
+    """
+    Thread-safe registry mapping a Gradio session hash to its own state object.
+
+    Sessions are kept in least-recently-used order. A session is evicted when it
+    has been idle for longer than ``ttl_seconds`` or when the store grows beyond
+    ``max_sessions``. The internal lock only guards the registry itself, so
+    turns belonging to different sessions never wait on each other.
+    ``factory(session_id)`` builds the state of a new session and, like
+    ``on_evict(session_id)`` for every evicted session, runs outside the lock.
+    """
+
+    def __init__(self, factory, max_sessions=MAX_SESSIONS, ttl_seconds=SESSION_TTL_SECONDS, on_evict=None):
+        self.factory = factory
+        self.on_evict = on_evict
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions = OrderedDict()
+        self._last_seen = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, session_id):
+        """Return the state for ``session_id``, creating it on first use"""
+        session = self._touch(session_id)
+        if session is None:
+            # Building a session may query storage, so it happens outside the lock;
+            # if another request created the same session meanwhile, theirs is kept
+            session = self._touch(session_id, self.factory(session_id))
+        return session
+
+    def _touch(self, session_id, created=None):
+        """Mark a session as used and return it, registering ``created`` if it is missing"""
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            self._evict_expired(now, evicted)
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+            elif created is not None:
+                session = self._sessions[session_id] = created
+            if session is not None:
+                self._last_seen[session_id] = now
+            while len(self._sessions) > self.max_sessions:
+                oldest, _ = self._sessions.popitem(last=False)
+                self._last_seen.pop(oldest, None)
+                self.evictions += 1
+                evicted.append(oldest)
+        self._notify(evicted)
+        return session
+
+    def discard(self, session_id):
+        """Forget a session, e.g. when its browser tab is closed"""
+        with self._lock:
+            self._last_seen.pop(session_id, None)
+            return self._sessions.pop(session_id, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def _notify(self, evicted):
+        if self.on_evict is None:
+            return
+        for session_id in evicted:
+            try:
+                self.on_evict(session_id)
+            except Exception as e:
+                print(f"Session cleanup failed for {session_id}: {e}")
+
+    def _evict_expired(self, now, evicted):
+        # Oldest entries sit at the front, so stop at the first live one
+        while self._sessions:
+            session_id = next(iter(self._sessions))
+            if now - self._last_seen.get(session_id, now) <= self.ttl_seconds:
+                break
+            self._sessions.popitem(last=False)
+            self._last_seen.pop(session_id, None)
+            self.evictions += 1
+            evicted.append(session_id)
@@ -0,0 +1,191 @@
+#Session state shared by app workers through a Redis-compatible server
+import json
+import os
+import socket
+import threading
+from urllib.parse import urlparse
+
+# e.g. redis://127.0.0.1:6379/0; empty keeps sessions in process memory only
+SESSION_BACKEND_URL = os.environ.get("MEDIVOX_SESSION_BACKEND", "")
+# How long a shared session outlives its last turn
+SHARED_SESSION_TTL = int(os.environ.get("MEDIVOX_SHARED_SESSION_TTL", str(24 * 3600)))
+KEY_PREFIX = "medivox:"
+
+
+class RespError(Exception):
+    """Error reply from the server"""
+
+
+class RespClient:
+    """
+    Minimal client for the Redis protocol (RESP2): enough for GET/SET style
+    commands against Redis, Valkey or state_server.py, without another
+    dependency. Each thread keeps its own connection and reconnects once
+    after a dropped connection.
+    """
+
+    def __init__(self, url, timeout=2.0):
+        parsed = urlparse(url)
+        if parsed.scheme not in ("redis", "tcp"):
+            raise ValueError(f"Unsupported state backend URL: {url}")
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = (sock, sock.makefile("rb"))
+        self._local.conn = conn
+        if self.password:
+            self._roundtrip(conn, [("AUTH", self.password)])
+        if self.db:
+            self._roundtrip(conn, [("SELECT", self.db)])
+        return conn
+
+    def _close(self):
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            conn[1].close()
+            conn[0].close()
+
+    @staticmethod
+    def _encode(args):
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    def _read_reply(self, reader):
+        line = reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("state backend closed the connection")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode("utf-8")
+        if kind == b"-":
+            return RespError(payload.decode("utf-8"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            if len(data) != length + 2:
+                raise ConnectionError("state backend closed the connection")
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            return None if length < 0 else [self._read_reply(reader) for _ in range(length)]
+        raise ConnectionError(f"unexpected reply from state backend: {line!r}")
+
+    def _roundtrip(self, conn, commands):
+        sock, reader = conn
+        sock.sendall(b"".join(self._encode(command) for command in commands))
+        replies = [self._read_reply(reader) for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    def pipeline(self, *commands):
+        """Send several commands in one round trip; returns their replies"""
+        for attempt in range(2):
+            conn = getattr(self._local, "conn", None)
+            try:
+                if conn is None:
+                    conn = self._connect()
+                return self._roundtrip(conn, commands)
+            except (OSError, ConnectionError):
+                self._close()
+                if attempt:
+                    raise
+
+    def execute(self, *args):
+        return self.pipeline(args)[0]
+
+    def get(self, key):
+        return self.execute("GET", key)
+
+    def set(self, key, value, ex=None):
+        if ex:
+            return self.execute("SET", key, value, "EX", int(ex))
+        return self.execute("SET", key, value)
+
+    def delete(self, *keys):
+        return self.execute("DEL", *keys)
+
+
+class SharedSessions:
+    """
+    Session snapshots in the shared backend, so any worker can continue a
+    conversation. A snapshot and its version live under separate keys; the
+    small version key lets a worker check whether its copy is stale with a
+    single GET and fetch the snapshot only when it changed.
+    """
+
+    def __init__(self, client, ttl=SHARED_SESSION_TTL):
+        self.client = client
+        self.ttl = ttl
+
+    def _keys(self, session_id):
+        return f"{KEY_PREFIX}session:{session_id}", f"{KEY_PREFIX}session:{session_id}:version"
+
+    def load(self, session_id):
+        """The stored snapshot (with its "version") or None"""
+        snapshot_key, _ = self._keys(session_id)
+        data = self.client.get(snapshot_key)
+        return json.loads(data) if data is not None else None
+
+    def version(self, session_id):
+        _, version_key = self._keys(session_id)
+        data = self.client.get(version_key)
+        return data.decode("utf-8") if data is not None else None
+
+    def save(self, session_id, snapshot, version):
+        """Store a snapshot under a new version token"""
+        snapshot_key, version_key = self._keys(session_id)
+        payload = json.dumps(dict(snapshot, version=version))
+        # Snapshot first: a reader that sees the new version always finds the new snapshot
+        self.client.pipeline(
+            ("SET", snapshot_key, payload, "EX", self.ttl),
+            ("SET", version_key, version, "EX", self.ttl),
+        )
+
+    def discard(self, session_id):
+        self.client.delete(*self._keys(session_id))
+
+
+_client = None
+_shared_sessions = None
+_lock = threading.Lock()
+
+
+def get_state_client():
+    """Client for the shared backend, or None when MEDIVOX_SESSION_BACKEND is unset"""
+    global _client
+    if not SESSION_BACKEND_URL:
+        return None
+    with _lock:
+        if _client is None:
+            _client = RespClient(SESSION_BACKEND_URL)
+        return _client
+
+
+def get_shared_sessions():
+    """Return the shared session store, or None when sessions are process-local"""
+    global _shared_sessions
+    client = get_state_client()
+    if client is None:
+        return None
+    with _lock:
+        if _shared_sessions is None:
+            _shared_sessions = SharedSessions(client)
+        return _shared_sessions
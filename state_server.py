@@ -0,0 +1,225 @@
+#Minimal Redis-compatible server, so several app workers can share state without installing Redis
+#Usage: python state_server.py [--host 127.0.0.1] [--port 6379]
+import argparse
+import asyncio
+import fnmatch
+import time
+
+COMMANDS = {}
+
+
+def command(name):
+    def register(fn):
+        COMMANDS[name] = fn
+        return fn
+    return register
+
+
+class StateServer:
+    """
+    In-memory key/value store speaking RESP2, with expiry. Implements the
+    string commands the app uses (GET, SET with EX/PX/NX/XX, DEL, EXPIRE, INCR,
+    ...); everything lives in one process and is lost on restart.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+
+    def _alive(self, key):
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def purge_expired(self):
+        now = time.monotonic()
+        for key in [key for key, at in self.expires.items() if at <= now]:
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+
+    def dispatch(self, args):
+        if not args:
+            return RuntimeError("ERR empty command")
+        handler = COMMANDS.get(args[0].upper().decode("utf-8", "replace"))
+        if handler is None:
+            return RuntimeError(f"ERR unknown command '{args[0].decode('utf-8', 'replace')}'")
+        try:
+            return handler(self, *args[1:])
+        except TypeError:
+            return RuntimeError(f"ERR wrong number of arguments for '{args[0].decode().lower()}'")
+        except ValueError:
+            return RuntimeError("ERR value is not an integer or out of range")
+
+    @command("PING")
+    def ping(self, message=None):
+        return message if message is not None else "PONG"
+
+    @command("ECHO")
+    def echo(self, message):
+        return message
+
+    @command("SELECT")
+    def select(self, db):
+        return "OK"
+
+    @command("CLIENT")
+    def client(self, *args):
+        return "OK"
+
+    @command("GET")
+    def get(self, key):
+        return self.data[key] if self._alive(key) else None
+
+    @command("MGET")
+    def mget(self, *keys):
+        return [self.get(key) for key in keys]
+
+    @command("SET")
+    def set(self, key, value, *options):
+        options = [option.upper() for option in options]
+        ttl = None
+        for i, option in enumerate(options):
+            if option == b"EX":
+                ttl = int(options[i + 1])
+            elif option == b"PX":
+                ttl = int(options[i + 1]) / 1000
+        exists = self._alive(key)
+        if (b"NX" in options and exists) or (b"XX" in options and not exists):
+            return None
+        self.data[key] = value
+        if ttl is not None:
+            self.expires[key] = time.monotonic() + ttl
+        elif b"KEEPTTL" not in options:
+            self.expires.pop(key, None)
+        return "OK"
+
+    @command("DEL")
+    def delete(self, *keys):
+        removed = 0
+        for key in keys:
+            if self._alive(key):
+                del self.data[key]
+                self.expires.pop(key, None)
+                removed += 1
+        return removed
+
+    @command("EXISTS")
+    def exists(self, *keys):
+        return sum(1 for key in keys if self._alive(key))
+
+    @command("EXPIRE")
+    def expire(self, key, seconds):
+        if not self._alive(key):
+            return 0
+        self.expires[key] = time.monotonic() + int(seconds)
+        return 1
+
+    @command("TTL")
+    def ttl(self, key):
+        if not self._alive(key):
+            return -2
+        expires_at = self.expires.get(key)
+        return -1 if expires_at is None else int(expires_at - time.monotonic())
+
+    @command("INCR")
+    def incr(self, key):
+        value = int(self.data[key]) + 1 if self._alive(key) else 1
+        self.data[key] = str(value).encode()
+        return value
+
+    @command("KEYS")
+    def keys(self, pattern):
+        pattern = pattern.decode("utf-8")
+        return [key for key in list(self.data) if self._alive(key) and fnmatch.fnmatchcase(key.decode("utf-8"), pattern)]
+
+    @command("DBSIZE")
+    def dbsize(self):
+        self.purge_expired()
+        return len(self.data)
+
+    @command("FLUSHDB")
+    def flushdb(self, *args):
+        self.data.clear()
+        self.expires.clear()
+        return "OK"
+
+    COMMANDS["FLUSHALL"] = flushdb
+
+
+def encode(reply):
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, RuntimeError):
+        return b"-%s\r\n" % str(reply).encode("utf-8")
+    if isinstance(reply, str):
+        return b"+%s\r\n" % reply.encode("utf-8")
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if isinstance(reply, bytes):
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+    return b"*%d\r\n" % len(reply) + b"".join(encode(item) for item in reply)
+
+
+async def read_command(reader):
+    """One command as a list of bytes; also accepts inline commands (e.g. from telnet)"""
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        return line.split()
+    args = []
+    for _ in range(int(line[1:])):
+        header = await reader.readline()
+        length = int(header[1:])
+        args.append((await reader.readexactly(length + 2))[:-2])
+    return args
+
+
+async def serve(host="127.0.0.1", port=6379, ready=None):
+    state = StateServer()
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                args = await read_command(reader)
+                if args is None:
+                    break
+                if args and args[0].upper() == b"QUIT":
+                    writer.write(encode("OK"))
+                    break
+                writer.write(encode(state.dispatch(args)))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def purge():
+        while True:
+            await asyncio.sleep(10)
+            state.purge_expired()
+
+    server = await asyncio.start_server(handle, host, port)
+    asyncio.get_running_loop().create_task(purge())
+    if ready is not None:
+        ready(server.sockets[0].getsockname()[1])
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Minimal Redis-compatible state server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+    print(f"State server listening on redis://{args.host}:{args.port}")
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+#Hands-free microphone streaming: buffering and end-of-utterance detection
+import os
+import time
+from collections import deque
+
+import numpy as np
+
+from audio_utils import TARGET_SAMPLE_RATE, pcm_to_array, resample
+from vad import VAD_FRAME_MS, VAD_MIN_RMS, VAD_THRESHOLD_DB
+
+# Longest utterance kept in memory; older audio is overwritten
+STREAM_BUFFER_SECONDS = float(os.environ.get("MEDIVOX_STREAM_BUFFER_SECONDS", "30"))
+# Silence that ends an utterance
+END_OF_UTTERANCE_MS = int(os.environ.get("MEDIVOX_END_OF_UTTERANCE_MS", "800"))
+# Minimum speech before an utterance counts
+MIN_UTTERANCE_MS = int(os.environ.get("MEDIVOX_MIN_UTTERANCE_MS", "300"))
+# How often to refresh the live partial transcript (0 disables partials)
+PARTIAL_INTERVAL_SECONDS = float(os.environ.get("MEDIVOX_PARTIAL_INTERVAL", "1.5"))
+# Partial transcripts cover only the latest audio, so each upload stays small
+PARTIAL_WINDOW_SECONDS = float(os.environ.get("MEDIVOX_PARTIAL_WINDOW", "5"))
+# The noise floor is the quietest frame of this much recent audio
+NOISE_WINDOW_MS = int(os.environ.get("MEDIVOX_NOISE_WINDOW_MS", "2000"))
+
+
+class RingBuffer:
+    """Fixed-size float32 sample buffer that overwrites its oldest audio"""
+
+    def __init__(self, seconds=STREAM_BUFFER_SECONDS, sample_rate=TARGET_SAMPLE_RATE):
+        self.capacity = int(seconds * sample_rate)
+        self.sample_rate = sample_rate
+        self._data = np.zeros(self.capacity, dtype=np.float32)
+        self._write = 0
+        self._size = 0
+
+    def append(self, samples):
+        samples = samples[-self.capacity:]
+        n = len(samples)
+        first = min(n, self.capacity - self._write)
+        self._data[self._write:self._write + first] = samples[:first]
+        self._data[:n - first] = samples[first:]
+        self._write = (self._write + n) % self.capacity
+        self._size = min(self._size + n, self.capacity)
+
+    def get(self):
+        """Buffered samples in chronological order"""
+        start = (self._write - self._size) % self.capacity
+        if start + self._size <= self.capacity:
+            return self._data[start:start + self._size].copy()
+        return np.concatenate((self._data[start:], self._data[:self._write]))
+
+    def clear(self):
+        self._write = 0
+        self._size = 0
+
+    @property
+    def seconds(self):
+        return self._size / self.sample_rate
+
+
+class UtteranceDetector:
+    """
+    Frame-level energy VAD with a running noise floor.
+    ``feed`` returns "speech" while the patient talks and "end" once they have
+    been quiet for END_OF_UTTERANCE_MS after enough speech.
+
+    The floor is the minimum frame energy over the last NOISE_WINDOW_MS
+    (minimum statistics). It doesn't depend on the speech decision, so it
+    follows steady background noise at any level, and the pauses between
+    words keep it from rising to the level of speech.
+    """
+
+    def __init__(self, sample_rate=TARGET_SAMPLE_RATE):
+        self.frame_length = int(sample_rate * VAD_FRAME_MS / 1000)
+        self.recent_rms = deque(maxlen=max(NOISE_WINDOW_MS // VAD_FRAME_MS, 1))
+        self.reset()
+
+    @property
+    def noise_floor(self):
+        return min(self.recent_rms) if self.recent_rms else VAD_MIN_RMS
+
+    def reset(self):
+        self.speech_ms = 0
+        self.silence_ms = 0
+        self._pending = np.zeros(0, dtype=np.float32)
+
+    def feed(self, samples):
+        samples = np.concatenate((self._pending, samples))
+        usable = len(samples) - len(samples) % self.frame_length
+        self._pending = samples[usable:]
+        if usable == 0:
+            return "speech" if self.speech_ms else None
+
+        rms = np.sqrt(np.mean(samples[:usable].reshape(-1, self.frame_length) ** 2, axis=1))
+        for frame_rms in rms:
+            self.recent_rms.append(float(frame_rms))
+            threshold = max(self.noise_floor * 10 ** (VAD_THRESHOLD_DB / 20), VAD_MIN_RMS)
+            if frame_rms > threshold:
+                self.speech_ms += VAD_FRAME_MS
+                self.silence_ms = 0
+            else:
+                self.silence_ms += VAD_FRAME_MS
+
+        if self.silence_ms >= END_OF_UTTERANCE_MS:
+            if self.speech_ms >= MIN_UTTERANCE_MS:
+                return "end"
+            # A click or cough, not an utterance
+            self.speech_ms = 0
+        return "speech" if self.speech_ms else None
+
+
+class StreamingListener:
+    """Per-session state for the hands-free microphone"""
+
+    def __init__(self):
+        self.buffer = RingBuffer()
+        self.detector = UtteranceDetector()
+        self.last_partial = 0.0
+        self.partial_text = ""
+
+    def add_chunk(self, sample_rate, chunk):
+        """
+        Add a Gradio microphone chunk ((rate, int array)) and return the
+        detector state: None, "speech" or "end".
+        """
+        channels = chunk.shape[1] if chunk.ndim == 2 else 1
+        if chunk.dtype.kind == "f":
+            samples = chunk.astype(np.float32)
+            if channels > 1:
+                samples = samples.mean(axis=1)
+        else:
+            samples = pcm_to_array(np.ascontiguousarray(chunk).tobytes(), chunk.dtype.itemsize, channels)
+        samples = resample(samples, sample_rate, TARGET_SAMPLE_RATE)
+        state = self.detector.feed(samples)
+        if state is None:
+            # Keep only a short lead-in while nobody is talking
+            self.buffer.append(samples)
+            lead_in = self.buffer.get()[-int(0.3 * TARGET_SAMPLE_RATE):]
+            self.buffer.clear()
+            self.buffer.append(lead_in)
+        else:
+            self.buffer.append(samples)
+        return state
+
+    def partial_due(self):
+        if PARTIAL_INTERVAL_SECONDS <= 0:
+            return False
+        return time.monotonic() - self.last_partial >= PARTIAL_INTERVAL_SECONDS
+
+    def partial_audio(self):
+        """The latest PARTIAL_WINDOW_SECONDS of the utterance, for a partial transcript"""
+        return self.buffer.get()[-int(PARTIAL_WINDOW_SECONDS * self.buffer.sample_rate):]
+
+    def mark_partial(self, text):
+        self.last_partial = time.monotonic()
+        self.partial_text = text
+
+    def take_utterance(self):
+        """Return the buffered utterance and start listening for the next one"""
+        samples = self.buffer.get()
+        self.buffer.clear()
+        self.detector.reset()
+        self.partial_text = ""
+        return samples
@@ -0,0 +1,190 @@
+#Pluggable speech-to-text backends
+import asyncio
+import logging
+import os
+import threading
+from io import BytesIO
+
+from client_provider import get_groq_client, get_async_groq_client
+from metrics import annotate
+from admission import limiter
+
+# "groq" (remote Whisper) or "local" (faster-whisper on CPU)
+STT_BACKEND = os.environ.get("MEDIVOX_STT_BACKEND", "groq").lower()
+# Optional backend to use when the primary one fails, e.g. "local" when offline
+STT_FALLBACK = os.environ.get("MEDIVOX_STT_FALLBACK", "").lower()
+GROQ_STT_MODEL = os.environ.get("MEDIVOX_GROQ_STT_MODEL", "whisper-large-v3")
+LOCAL_STT_MODEL = os.environ.get("MEDIVOX_LOCAL_STT_MODEL", "base.en")
+LOCAL_STT_COMPUTE_TYPE = os.environ.get("MEDIVOX_LOCAL_STT_COMPUTE_TYPE", "int8")
+LOCAL_STT_THREADS = int(os.environ.get("MEDIVOX_LOCAL_STT_THREADS", "0"))
+
+
+def _audio_payload(audio, filename):
+    """Return (filename, bytes) for a file path, encoded bytes or a 16 kHz sample array"""
+    if isinstance(audio, (bytes, bytearray)):
+        return filename, bytes(audio)
+    if hasattr(audio, "dtype"):
+        from audio_utils import encode_audio
+        audio_bytes, encoded_name = encode_audio(audio)
+        return encoded_name, audio_bytes
+    if not audio or not os.path.exists(audio):
+        raise ValueError("Audio file not found or invalid path")
+    with open(audio, "rb") as f:
+        return os.path.basename(audio), f.read()
+
+
+class TranscriptionBackend:
+    """
+    Common interface: ``transcribe`` takes a file path, encoded audio bytes or
+    a float32 16 kHz mono sample array and returns the text, or an empty
+    string when nothing was said.
+    """
+
+    name = "base"
+
+    def transcribe(self, audio, filename="audio.wav"):
+        raise NotImplementedError
+
+    async def transcribe_async(self, audio, filename="audio.wav"):
+        return await asyncio.to_thread(self.transcribe, audio, filename)
+
+    def warm_up(self):
+        """Load models or open connections ahead of the first request"""
+
+
+class GroqTranscriptionBackend(TranscriptionBackend):
+    """Whisper hosted by Groq"""
+
+    name = "groq"
+
+    def __init__(self, model=GROQ_STT_MODEL, language="en"):
+        self.model = model
+        self.language = language
+
+    def transcribe(self, audio, filename="audio.wav"):
+        payload = _audio_payload(audio, filename)
+        with limiter("stt").slot():
+            transcription = get_groq_client().audio.transcriptions.create(
+                model=self.model,
+                file=payload,
+                language=self.language
+            )
+        text = (transcription.text or "").strip()
+        annotate(bytes_sent=len(payload[1]), bytes_received=len(text))
+        return text
+
+    async def transcribe_async(self, audio, filename="audio.wav"):
+        payload = await asyncio.to_thread(_audio_payload, audio, filename)
+        async with limiter("stt").slot_async():
+            transcription = await get_async_groq_client().audio.transcriptions.create(
+                model=self.model,
+                file=payload,
+                language=self.language
+            )
+        text = (transcription.text or "").strip()
+        annotate(bytes_sent=len(payload[1]), bytes_received=len(text))
+        return text
+
+
+class LocalWhisperBackend(TranscriptionBackend):
+    """
+    faster-whisper (CTranslate2) running on the local CPU.
+    The model is loaded once per process and reused for every request.
+    """
+
+    name = "local"
+    _models = {}
+    _load_lock = threading.Lock()
+
+    def __init__(self, model_size=LOCAL_STT_MODEL, compute_type=LOCAL_STT_COMPUTE_TYPE,
+                 cpu_threads=LOCAL_STT_THREADS, language="en"):
+        self.model_size = model_size
+        self.compute_type = compute_type
+        self.cpu_threads = cpu_threads
+        self.language = language
+
+    def _model(self):
+        key = (self.model_size, self.compute_type, self.cpu_threads)
+        model = self._models.get(key)
+        if model is None:
+            with self._load_lock:
+                model = self._models.get(key)
+                if model is None:
+                    from faster_whisper import WhisperModel
+                    logging.info(f"Loading local Whisper model {self.model_size} ({self.compute_type})")
+                    model = WhisperModel(
+                        self.model_size,
+                        device="cpu",
+                        compute_type=self.compute_type,
+                        cpu_threads=self.cpu_threads
+                    )
+                    self._models[key] = model
+        return model
+
+    def warm_up(self):
+        self._model()
+
+    def transcribe(self, audio, filename="audio.wav"):
+        # Float32 16 kHz sample arrays are passed straight through, skipping decoding
+        source = BytesIO(audio) if isinstance(audio, (bytes, bytearray)) else audio
+        if isinstance(source, str) and not os.path.exists(source):
+            raise ValueError("Audio file not found or invalid path")
+        segments, _ = self._model().transcribe(source, language=self.language, beam_size=1)
+        return " ".join(segment.text.strip() for segment in segments).strip()
+
+
+class FallbackTranscriptionBackend(TranscriptionBackend):
+    """Try the primary backend and switch to the secondary one if it fails"""
+
+    def __init__(self, primary, secondary):
+        self.primary = primary
+        self.secondary = secondary
+        self.name = f"{primary.name}+{secondary.name}"
+
+    def transcribe(self, audio, filename="audio.wav"):
+        try:
+            return self.primary.transcribe(audio, filename)
+        except Exception as e:
+            logging.warning(f"{self.primary.name} transcription failed ({e}), using {self.secondary.name}")
+            return self.secondary.transcribe(audio, filename)
+
+    async def transcribe_async(self, audio, filename="audio.wav"):
+        try:
+            return await self.primary.transcribe_async(audio, filename)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning(f"{self.primary.name} transcription failed ({e}), using {self.secondary.name}")
+            return await self.secondary.transcribe_async(audio, filename)
+
+    def warm_up(self):
+        self.primary.warm_up()
+        self.secondary.warm_up()
+
+
+BACKENDS = {
+    "groq": GroqTranscriptionBackend,
+    "local": LocalWhisperBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def create_transcription_backend(name, fallback=""):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown STT backend: {name}")
+    backend = BACKENDS[name]()
+    if fallback and fallback != name:
+        backend = FallbackTranscriptionBackend(backend, create_transcription_backend(fallback))
+    return backend
+
+
+def get_transcription_backend():
+    """Return the backend configured by MEDIVOX_STT_BACKEND (and MEDIVOX_STT_FALLBACK)"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_transcription_backend(STT_BACKEND, STT_FALLBACK)
+    return _backend
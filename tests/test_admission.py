@@ -0,0 +1,75 @@
+#Turn queue and upstream rate limits shed load with Overloaded instead of waiting forever
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import admission
+from admission import AdmissionQueue, Overloaded, TokenBucket, UpstreamLimiter
+
+
+def test_full_queue_rejects_new_turns():
+    queue = AdmissionQueue(max_active=1, max_waiting=1)
+    running = queue.enter()
+    waiting = queue.enter()
+    assert running.admitted and not waiting.admitted
+    assert queue.position(waiting) == 1
+    with pytest.raises(Overloaded):
+        queue.enter()
+
+
+def test_leaving_admits_the_next_turn():
+    queue = AdmissionQueue(max_active=1, max_waiting=1)
+    running = queue.enter()
+    waiting = queue.enter()
+    queue.leave(running)
+    assert waiting.admitted
+    assert queue.position(waiting) == 0
+    assert len(queue) == 0
+
+
+def test_expired_ticket_is_shed(monkeypatch):
+    monkeypatch.setattr(admission, "TURN_QUEUE_TIMEOUT", 0.1)
+    queue = AdmissionQueue(max_active=1, max_waiting=1)
+    running = queue.enter()
+    waiting = queue.enter()
+    time.sleep(0.15)
+    assert queue.expired(waiting)
+    assert not queue.expired(running)
+    queue.leave(waiting)
+    with pytest.raises(Overloaded):
+        with queue.slot():
+            pass
+    # The timed-out turn gave up its place in line
+    assert len(queue) == 0
+
+
+def test_token_bucket_refills_at_its_rate():
+    bucket = TokenBucket(rate=20, burst=2)
+    assert bucket.reserve() == 0 and bucket.reserve() == 0
+    wait = bucket.reserve()
+    assert 0 < wait <= 1 / 20
+    time.sleep(wait + 0.01)
+    assert bucket.reserve() == 0
+
+
+def test_limiter_sheds_when_the_bucket_refills_too_slowly():
+    slow = UpstreamLimiter("chat", max_concurrent=4, requests_per_minute=6, burst=1)
+    slow.acquire(timeout=0.1)
+    slow._release()
+    with pytest.raises(Overloaded) as shed:
+        slow.acquire(timeout=0.1)
+    assert shed.value.retry_after >= 1
+
+
+def test_limiter_waits_for_a_refill_within_its_timeout():
+    limited = UpstreamLimiter("chat", max_concurrent=4, requests_per_minute=600, burst=1)
+    with limited.slot():
+        pass
+    start = time.monotonic()
+    with limited.slot():
+        pass
+    assert 0.05 <= time.monotonic() - start < 0.5
@@ -0,0 +1,79 @@
+#Async pooled clients against a local HTTP server
+import asyncio
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("httpx")
+pytest.importorskip("dotenv")
+
+import client_provider
+
+
+class OkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+
+@pytest.fixture
+def server_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), OkHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def test_async_requests_are_traced_and_closed_with_the_loop(server_url):
+    stats = client_provider._stats["groq"]
+    before = stats.snapshot()
+    seen = []
+
+    async def turn():
+        http_client = client_provider._get_or_create_for_loop(
+            "test_async", lambda: client_provider._build_async_http_client("groq")
+        )
+        for _ in range(3):
+            response = await http_client.get(server_url)
+            assert response.text == "ok"
+        seen.append(http_client)
+
+    asyncio.run(turn())
+    asyncio.run(turn())
+
+    after = stats.snapshot()
+    assert after["requests"] - before["requests"] == 6
+    # One connection per loop, reused by the later requests on it
+    assert after["new_connections"] - before["new_connections"] == 2
+    assert seen[0] is not seen[1]
+    assert all(http_client.is_closed for http_client in seen)
+    assert len(client_provider._loop_clients) == 0
+
+
+def test_close_clients_closes_async_clients_of_a_live_loop(server_url):
+    loop = asyncio.new_event_loop()
+    try:
+        async def request():
+            http_client = client_provider._get_or_create_for_loop(
+                "test_async", lambda: client_provider._build_async_http_client("groq")
+            )
+            await http_client.get(server_url)
+            return http_client
+
+        http_client = loop.run_until_complete(request())
+        client_provider.close_clients()
+        assert http_client.is_closed
+    finally:
+        loop.close()
@@ -0,0 +1,98 @@
+#Retries, fallback and hedged requests of the model router, with stub model calls
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model_router import MIN_SAMPLES, ModelRouter
+
+
+def router(**kwargs):
+    kwargs.setdefault("retries", 1)
+    kwargs.setdefault("backoff", 0)
+    return ModelRouter(["primary", "fallback"], **kwargs)
+
+
+def test_falls_back_after_the_primary_fails():
+    calls = []
+
+    def call(model):
+        calls.append(model)
+        if model == "primary":
+            raise ConnectionError("connection reset")
+        return f"answer from {model}"
+
+    assert router().run_with_model(call) == ("answer from fallback", "fallback")
+    assert calls == ["primary", "fallback"]
+
+
+def test_async_and_streamed_calls_report_the_fallback_model():
+    async def call(model):
+        if model == "primary":
+            raise ConnectionError("connection reset")
+        return f"answer from {model}"
+
+    def stream(model):
+        if model == "primary":
+            raise ConnectionError("connection reset")
+        yield "answer "
+        yield f"from {model}"
+
+    assert asyncio.run(router().run_async_with_model(call)) == ("answer from fallback", "fallback")
+    assert list(router().stream_with_model(stream)) == [("answer ", "fallback"), ("from fallback", "fallback")]
+
+
+def test_errors_that_are_not_retryable_are_raised_at_once():
+    calls = []
+
+    def call(model):
+        calls.append(model)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        router().run(call)
+    assert calls == ["primary"]
+
+
+def hedging_router(p95):
+    hedged = router(hedge=True)
+    for _ in range(MIN_SAMPLES):
+        hedged.stats["primary"].record(p95, True)
+    return hedged
+
+
+def test_hedge_fires_only_after_the_deadline():
+    started = {}
+    primary_done = threading.Event()
+
+    def call(model):
+        started[model] = time.monotonic()
+        if model == "primary":
+            primary_done.wait(2)
+            return "slow primary"
+        return "fast fallback"
+
+    start = time.monotonic()
+    try:
+        result = hedging_router(p95=0.2).run_with_model(call)
+    finally:
+        primary_done.set()
+    assert result == ("fast fallback", "fallback")
+    assert started["fallback"] - start >= 0.2
+
+
+def test_no_hedge_when_the_primary_answers_in_time():
+    calls = []
+
+    def call(model):
+        calls.append(model)
+        return f"answer from {model}"
+
+    assert hedging_router(p95=0.5).run_with_model(call) == ("answer from primary", "primary")
+    time.sleep(0.6)
+    assert calls == ["primary"]
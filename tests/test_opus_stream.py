@@ -0,0 +1,120 @@
+#Ogg/Opus replies cut into independently playable pieces, against a real Opus stream
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("httpx")
+pytest.importorskip("dotenv")
+
+import voice_of_the_doctor
+from voice_of_the_doctor import OPUS_GRANULE_RATE, STREAM_PIECE_SECONDS, PlayableChunks, _without_pre_skip, ogg_pages
+
+# 1.2 s of libopus output (48 kHz mono, pre-skip 312), muxed with a page every 60 ms
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "reply.ogg")
+
+
+@pytest.fixture
+def stream():
+    with open(FIXTURE, "rb") as f:
+        return f.read()
+
+
+def crc_is_valid(page):
+    """Bit-by-bit Ogg CRC (polynomial 0x04C11DB7) over the page with its checksum field zeroed"""
+    crc = 0
+    for byte in page[:22] + b"\x00\x00\x00\x00" + page[26:]:
+        crc ^= byte << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7 if crc & 0x80000000 else crc << 1) & 0xFFFFFFFF
+    return crc == int.from_bytes(page[22:26], "little")
+
+
+def pre_skip(page):
+    body_start = 27 + page[26]
+    assert page[body_start:body_start + 8] == b"OpusHead"
+    return int.from_bytes(page[body_start + 10:body_start + 12], "little")
+
+
+def test_pages_cover_the_stream(stream):
+    pages, rest = ogg_pages(stream)
+    assert rest == b""
+    assert b"".join(pages) == stream
+    assert all(page.startswith(b"OggS") and crc_is_valid(page) for page in pages)
+    sequence = [int.from_bytes(page[18:22], "little") for page in pages]
+    assert sequence == list(range(len(pages)))
+
+
+@pytest.mark.parametrize("cut", [1, 26, 27, 30, 100, 1000])
+def test_torn_page_is_kept_for_the_next_chunk(stream, cut):
+    all_pages, _ = ogg_pages(stream)
+    pages, rest = ogg_pages(stream[:cut])
+    assert b"".join(pages) + rest == stream[:cut]
+    assert pages == all_pages[:len(pages)]
+    more, rest = ogg_pages(rest + stream[cut:])
+    assert pages + more == all_pages and rest == b""
+
+
+def test_non_ogg_data_is_rejected():
+    with pytest.raises(ValueError):
+        ogg_pages(b"ID3" + b"\x00" * 40)
+
+
+def test_pre_skip_rewrite_keeps_a_valid_checksum(stream):
+    pages, _ = ogg_pages(stream)
+    headers = pages[0] + pages[1]
+    assert pre_skip(pages[0]) == 312
+    rewritten, _ = ogg_pages(_without_pre_skip(headers))
+    assert pre_skip(rewritten[0]) == 0
+    assert crc_is_valid(rewritten[0])
+    # Only the pre-skip and the checksum changed
+    changed = [i for i, (a, b) in enumerate(zip(pages[0], rewritten[0])) if a != b]
+    body_start = 27 + pages[0][26]
+    assert set(changed) <= set(range(22, 26)) | {body_start + 10, body_start + 11}
+    assert rewritten[1] == pages[1]
+
+
+@pytest.mark.parametrize("chunk_size", [7, 500, 4096])
+def test_pieces_are_whole_pages_with_headers(monkeypatch, stream, chunk_size):
+    monkeypatch.setattr(voice_of_the_doctor, "TTS_FORMAT", "opus")
+    chunks = PlayableChunks()
+    pieces = []
+    for offset in range(0, len(stream), chunk_size):
+        pieces += chunks.feed(stream[offset:offset + chunk_size])
+    pieces += chunks.flush()
+
+    original, _ = ogg_pages(stream)
+    assert len(pieces) > 1
+    audio = []
+    piece_start = 0
+    for index, piece in enumerate(pieces):
+        pages, rest = ogg_pages(piece)
+        assert rest == b""
+        assert all(crc_is_valid(page) for page in pages)
+        # Every piece starts with OpusHead and OpusTags; only the first keeps the pre-skip
+        assert pre_skip(pages[0]) == (312 if index == 0 else 0)
+        assert pages[1] == original[1]
+        audio += pages[2:]
+        piece_end = int.from_bytes(pages[-1][6:14], "little")
+        if index < len(pieces) - 1:
+            assert piece_end - piece_start >= OPUS_GRANULE_RATE * STREAM_PIECE_SECONDS
+        piece_start = piece_end
+    # Nothing is dropped, duplicated or reordered
+    assert audio == original[2:]
+
+
+def test_pieces_decode_on_their_own(monkeypatch, stream):
+    av = pytest.importorskip("av")
+    monkeypatch.setattr(voice_of_the_doctor, "TTS_FORMAT", "opus")
+    chunks = PlayableChunks()
+    pieces = chunks.feed(stream) + chunks.flush()
+    samples = 0
+    for piece in pieces:
+        with av.open(io.BytesIO(piece), format="ogg") as container:
+            samples += sum(frame.samples for frame in container.decode(audio=0))
+    # The pre-skip is dropped once, at the start of the reply
+    total = int.from_bytes(ogg_pages(stream)[0][-1][6:14], "little")
+    assert abs(samples - (total - 312)) <= 960
@@ -0,0 +1,61 @@
+#Silence trimming: silent clips are rejected, anything that might be speech reaches STT
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+np = pytest.importorskip("numpy")
+
+from vad import VAD_MIN_RMS, trim_silence
+
+SAMPLE_RATE = 16000
+
+
+def noise(seconds, rms, seed=0):
+    return (np.random.default_rng(seed).standard_normal(int(seconds * SAMPLE_RATE)) * rms).astype(np.float32)
+
+
+def voiced(seconds, amplitude=0.3, syllables_per_second=None):
+    """Harmonic "voice"; with syllables_per_second it is broken up by short pauses"""
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    signal = sum(np.sin(2 * np.pi * f * t) / k for k, f in enumerate((150, 300, 450, 600), start=1))
+    signal *= amplitude / np.sqrt(np.mean(signal ** 2))
+    if syllables_per_second:
+        signal *= np.sin(2 * np.pi * syllables_per_second * t) > -0.3
+    return signal.astype(np.float32)
+
+
+def test_digital_silence_is_rejected():
+    result = trim_silence(np.zeros(SAMPLE_RATE * 2, dtype=np.float32), SAMPLE_RATE, mode="energy")
+    assert not result.has_speech
+    assert len(result.samples) == 0
+
+
+def test_quiet_room_tone_is_rejected():
+    result = trim_silence(noise(2, VAD_MIN_RMS / 3), SAMPLE_RATE, mode="energy")
+    assert not result.has_speech
+
+
+def test_clean_speech_is_kept_and_trimmed():
+    clip = np.concatenate((np.zeros(SAMPLE_RATE, dtype=np.float32), voiced(1.5, syllables_per_second=3),
+                           np.zeros(SAMPLE_RATE, dtype=np.float32)))
+    result = trim_silence(clip, SAMPLE_RATE, mode="energy")
+    assert result.has_speech
+    assert 1.4 <= result.trimmed_seconds < result.original_seconds
+
+
+def test_continuous_voice_without_pauses_reaches_stt():
+    result = trim_silence(voiced(2), SAMPLE_RATE, mode="energy")
+    assert result.has_speech
+    assert len(result.samples) == 2 * SAMPLE_RATE
+
+
+@pytest.mark.parametrize("snr_db", [8, 10])
+def test_speech_over_steady_noise_reaches_stt(snr_db):
+    noise_rms = 0.05
+    speech = voiced(2, amplitude=noise_rms * 10 ** (snr_db / 20), syllables_per_second=3)
+    result = trim_silence(speech + noise(2, noise_rms), SAMPLE_RATE, mode="energy")
+    assert result.has_speech
+    assert result.trimmed_seconds >= 1.5
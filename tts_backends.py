@@ -0,0 +1,198 @@
+#Pluggable text-to-speech backends
+import asyncio
+import logging
+import os
+import threading
+
+from tts_cache import get_tts_cache, speech_cache_key
+from voice_of_the_doctor import (synthesize_with_gtts, synthesize_with_elevenlabs, speech_bytes_with_elevenlabs,
+                                 synthesize_with_elevenlabs_async, stream_speech_with_elevenlabs, pcm_to_wav)
+
+# "elevenlabs", "gtts" or "piper" (local ONNX voice)
+TTS_BACKEND = os.environ.get("MEDIVOX_TTS_BACKEND", "elevenlabs").lower()
+# Optional backend to use when the primary one fails, e.g. "piper"
+TTS_FALLBACK = os.environ.get("MEDIVOX_TTS_FALLBACK", "").lower()
+PIPER_MODEL = os.environ.get("MEDIVOX_PIPER_MODEL", "en_US-lessac-medium.onnx")
+
+
+class TTSBackend:
+    """
+    Common interface: ``synthesize`` returns the path of a (cached) audio file,
+    ``synthesize_bytes`` the audio itself, and ``stream`` yields playable audio
+    chunks as they are produced.
+    """
+
+    name = "base"
+
+    def synthesize(self, text):
+        raise NotImplementedError
+
+    def synthesize_bytes(self, text):
+        with open(self.synthesize(text), "rb") as f:
+            return f.read()
+
+    def stream(self, text):
+        with open(self.synthesize(text), "rb") as f:
+            yield f.read()
+
+    async def synthesize_async(self, text):
+        return await asyncio.to_thread(self.synthesize, text)
+
+    def warm_up(self):
+        """Load models or open connections ahead of the first request"""
+
+
+class ElevenLabsTTSBackend(TTSBackend):
+    name = "elevenlabs"
+
+    def synthesize(self, text):
+        if not os.environ.get("ELEVEN_API_KEY"):
+            raise RuntimeError("ElevenLabs API key not found")
+        return synthesize_with_elevenlabs(text)
+
+    def synthesize_bytes(self, text):
+        if not os.environ.get("ELEVEN_API_KEY"):
+            raise RuntimeError("ElevenLabs API key not found")
+        return speech_bytes_with_elevenlabs(text)
+
+    def stream(self, text):
+        return stream_speech_with_elevenlabs(text)
+
+    async def synthesize_async(self, text):
+        return await synthesize_with_elevenlabs_async(text)
+
+
+class GTTSBackend(TTSBackend):
+    name = "gtts"
+
+    def synthesize(self, text):
+        return synthesize_with_gtts(text)
+
+
+class PiperTTSBackend(TTSBackend):
+    """
+    Piper voice (ONNX) running on the local CPU.
+    The voice is loaded once per process; output is 16-bit mono PCM.
+    """
+
+    name = "piper"
+    _voices = {}
+    _load_lock = threading.Lock()
+
+    def __init__(self, model_path=PIPER_MODEL):
+        self.model_path = model_path
+
+    def _voice(self):
+        voice = self._voices.get(self.model_path)
+        if voice is None:
+            with self._load_lock:
+                voice = self._voices.get(self.model_path)
+                if voice is None:
+                    from piper.voice import PiperVoice
+                    logging.info(f"Loading Piper voice {self.model_path}")
+                    voice = PiperVoice.load(self.model_path)
+                    self._voices[self.model_path] = voice
+        return voice
+
+    @property
+    def sample_rate(self):
+        return self._voice().config.sample_rate
+
+    def warm_up(self):
+        self._voice()
+
+    def stream_pcm(self, text):
+        """Yield raw 16-bit PCM chunks (one per sentence) as they are synthesized"""
+        for pcm_chunk in self._voice().synthesize_stream_raw(text):
+            if pcm_chunk:
+                yield pcm_chunk
+
+    def stream(self, text):
+        # Each PCM chunk is wrapped so it can be played on its own
+        for pcm_chunk in self.stream_pcm(text):
+            yield pcm_to_wav(pcm_chunk, self.sample_rate)
+
+    def synthesize(self, text):
+        key = speech_cache_key(text, os.path.basename(self.model_path), "piper", "wav")
+        return get_tts_cache().get_or_create(
+            key,
+            lambda: pcm_to_wav(b"".join(self.stream_pcm(text)), self.sample_rate),
+            extension="wav"
+        )
+
+
+class FallbackTTSBackend(TTSBackend):
+    """Try the primary backend and switch to the secondary one if it fails"""
+
+    def __init__(self, primary, secondary):
+        self.primary = primary
+        self.secondary = secondary
+        self.name = f"{primary.name}+{secondary.name}"
+
+    def synthesize(self, text):
+        try:
+            return self.primary.synthesize(text)
+        except Exception as e:
+            logging.warning(f"{self.primary.name} TTS failed ({e}), using {self.secondary.name}")
+            return self.secondary.synthesize(text)
+
+    def synthesize_bytes(self, text):
+        try:
+            return self.primary.synthesize_bytes(text)
+        except Exception as e:
+            logging.warning(f"{self.primary.name} TTS failed ({e}), using {self.secondary.name}")
+            return self.secondary.synthesize_bytes(text)
+
+    def stream(self, text):
+        started = False
+        try:
+            for chunk in self.primary.stream(text):
+                started = True
+                yield chunk
+        except Exception as e:
+            if started:
+                raise
+            logging.warning(f"{self.primary.name} TTS failed ({e}), using {self.secondary.name}")
+            yield from self.secondary.stream(text)
+
+    async def synthesize_async(self, text):
+        try:
+            return await self.primary.synthesize_async(text)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning(f"{self.primary.name} TTS failed ({e}), using {self.secondary.name}")
+            return await self.secondary.synthesize_async(text)
+
+    def warm_up(self):
+        self.primary.warm_up()
+        self.secondary.warm_up()
+
+
+BACKENDS = {
+    "elevenlabs": ElevenLabsTTSBackend,
+    "gtts": GTTSBackend,
+    "piper": PiperTTSBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def create_tts_backend(name, fallback=""):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown TTS backend: {name}")
+    backend = BACKENDS[name]()
+    if fallback and fallback != name:
+        backend = FallbackTTSBackend(backend, create_tts_backend(fallback))
+    return backend
+
+
+def get_tts_backend():
+    """Return the backend configured by MEDIVOX_TTS_BACKEND (and MEDIVOX_TTS_FALLBACK)"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_tts_backend(TTS_BACKEND, TTS_FALLBACK)
+    return _backend
@@ -0,0 +1,147 @@
+#Content-addressed cache for synthesized speech
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+TTS_CACHE_DIR = os.environ.get(
+    "MEDIVOX_TTS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "medivox_tts_cache")
+)
+TTS_CACHE_MAX_BYTES = int(os.environ.get("MEDIVOX_TTS_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+
+
+def speech_cache_key(text, voice, model, output_format):
+    """Hash everything that influences the synthesized audio"""
+    payload = json.dumps([text, voice, model, output_format], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    """
+    Disk cache of audio files named by their content key.
+
+    The total size is kept under ``max_bytes`` by evicting the least recently
+    used files. Entries are written to a temporary file and renamed into place,
+    so readers never see a partially written file.
+    """
+
+    def __init__(self, cache_dir=TTS_CACHE_DIR, max_bytes=TTS_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_existing()
+
+    def _load_existing(self):
+        # Rebuild the LRU order from the files left by a previous run
+        files = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if not os.path.isfile(path):
+                continue
+            if name.startswith(".tmp_"):
+                # Leftover from an interrupted write
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            files.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._total_bytes += size
+        with self._lock:
+            self._evict()
+
+    def _filename(self, key, extension):
+        return f"{key}.{extension}"
+
+    def get(self, key, extension="mp3"):
+        """Return the cached file path for ``key`` or None"""
+        name = self._filename(key, extension)
+        path = os.path.join(self.cache_dir, name)
+        with self._lock:
+            if name in self._entries and os.path.exists(path):
+                self._entries.move_to_end(name)
+                self.hits += 1
+                os.utime(path)
+                return path
+            if name in self._entries:
+                # Removed behind our back
+                self._total_bytes -= self._entries.pop(name)
+            self.misses += 1
+            return None
+
+    def put(self, key, data, extension="mp3"):
+        """Store ``data`` under ``key`` and return its file path"""
+        name = self._filename(key, extension)
+        path = os.path.join(self.cache_dir, name)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".tmp_")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self._lock:
+            if name in self._entries:
+                self._total_bytes -= self._entries.pop(name)
+            self._entries[name] = len(data)
+            self._total_bytes += len(data)
+            self._evict(keep=name)
+        return path
+
+    def get_or_create(self, key, synthesize, extension="mp3"):
+        """Return the cached path for ``key``, calling ``synthesize()`` for the bytes on a miss"""
+        path = self.get(key, extension)
+        if path is not None:
+            return path
+        return self.put(key, synthesize(), extension)
+
+    def _evict(self, keep=None):
+        while self._total_bytes > self.max_bytes and self._entries:
+            name = next(iter(self._entries))
+            if name == keep and len(self._entries) == 1:
+                break
+            if name == keep:
+                self._entries.move_to_end(name)
+                continue
+            self._total_bytes -= self._entries.pop(name)
+            self.evictions += 1
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+            }
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_tts_cache():
+    """Process-wide TTS cache shared by all speech providers"""
+    global _default_cache
+    if _default_cache is None:
+        with _default_lock:
+            if _default_cache is None:
+                _default_cache = TTSCache()
+    return _default_cache
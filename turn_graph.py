@@ -0,0 +1,97 @@
+#Runs the stages of a consultation turn as a small dependency graph
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Threads shared by all turns for stages that run beside the critical path
+TURN_WORKERS = int(os.environ.get("MEDIVOX_TURN_WORKERS", "32"))
+# Work that turn stages wait on gets pools of its own: if it shared the turn
+# pool, stages blocked on it could hold every thread and wait forever.
+POOL_SIZES = {
+    "turn": TURN_WORKERS,
+    # Duplicate (hedged) LLM requests, waited on by image and prefetch stages
+    "hedge": int(os.environ.get("MEDIVOX_HEDGE_WORKERS", "32")),
+    # Speculative image analysis started on upload
+    "prefetch": int(os.environ.get("MEDIVOX_PREFETCH_WORKERS", "8")),
+    # Fire-and-forget writes, e.g. storing synthesized speech in the cache
+    "background": int(os.environ.get("MEDIVOX_BACKGROUND_WORKERS", "4")),
+}
+
+_executors = {}
+_executor_lock = threading.Lock()
+
+
+def get_executor(kind):
+    """Return the process-wide pool for one kind of work (see POOL_SIZES)"""
+    with _executor_lock:
+        executor = _executors.get(kind)
+        if executor is None:
+            executor = _executors[kind] = ThreadPoolExecutor(
+                max_workers=POOL_SIZES[kind], thread_name_prefix=f"medivox-{kind}"
+            )
+        return executor
+
+
+def get_turn_executor():
+    """Return the process-wide pool that runs turn graph nodes"""
+    return get_executor("turn")
+
+
+def _run(node, fn, args):
+    try:
+        node.set_result(fn(*args))
+    except BaseException as e:
+        node.set_exception(e)
+
+
+class TurnGraph:
+    """
+    Independent stages of one turn, started as soon as the stages they come
+    after have finished.
+
+    ``add`` schedules a node and returns immediately; ``result`` waits for it.
+    A node listed in ``after`` only orders execution: it runs even if an
+    earlier node failed, so cleanup and trace bookkeeping always happen.
+    """
+
+    def __init__(self, executor=None):
+        self._executor = executor or get_turn_executor()
+        self._nodes = {}
+
+    def add(self, name, fn, *args, after=()):
+        deps = [self._nodes[dep] for dep in after]
+        node = Future()
+        self._nodes[name] = node
+        remaining = [len(deps)]
+        lock = threading.Lock()
+
+        def start():
+            if node.set_running_or_notify_cancel():
+                self._executor.submit(_run, node, fn, args)
+
+        def dep_done(_):
+            with lock:
+                remaining[0] -= 1
+                ready = remaining[0] == 0
+            if ready:
+                start()
+
+        if not deps:
+            start()
+        for dep in deps:
+            dep.add_done_callback(dep_done)
+        return node
+
+    def background(self, name, fn, *args, after=()):
+        """Schedule work nobody waits for (persistence, logging, cleanup)"""
+        node = self.add(name, fn, *args, after=after)
+        node.add_done_callback(lambda f: _log_failure(name, f))
+        return node
+
+    def result(self, name, timeout=None):
+        return self._nodes[name].result(timeout)
+
+
+def _log_failure(name, future):
+    if not future.cancelled() and future.exception() is not None:
+        print(f"Background step {name} failed: {future.exception()}")
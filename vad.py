@@ -0,0 +1,112 @@
+#Voice activity detection and silence trimming before transcription
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from audio_utils import TARGET_SAMPLE_RATE, array_to_pcm16, pcm_to_array, read_wav, resample
+
+# "energy" (NumPy, no extra dependency), "webrtc" (needs webrtcvad) or "off"
+VAD_MODE = os.environ.get("MEDIVOX_VAD", "energy").lower()
+VAD_FRAME_MS = 30
+# Speech must be this many dB above the estimated noise floor
+VAD_THRESHOLD_DB = float(os.environ.get("MEDIVOX_VAD_THRESHOLD_DB", "12"))
+# Frames below this absolute level are never speech (about -50 dBFS); a clip that never
+# rises above it is the only kind rejected outright
+VAD_MIN_RMS = 0.003
+# Silence kept around the detected speech so words are not clipped
+VAD_PADDING_MS = int(os.environ.get("MEDIVOX_VAD_PADDING_MS", "200"))
+# Clips with less detected speech than this are rejected
+VAD_MIN_SPEECH_MS = int(os.environ.get("MEDIVOX_VAD_MIN_SPEECH_MS", "250"))
+
+VADResult = namedtuple(
+    "VADResult",
+    ["samples", "sample_rate", "has_speech", "original_seconds", "trimmed_seconds"],
+)
+
+
+def load_audio(audio_filepath):
+    """Load an audio file as (float32 mono samples, sample rate)"""
+    if audio_filepath.lower().endswith(".wav"):
+        return read_wav(audio_filepath)
+    # Compressed formats are decoded through pydub/ffmpeg
+    from pydub import AudioSegment
+    segment = AudioSegment.from_file(audio_filepath)
+    return (
+        pcm_to_array(segment.raw_data, segment.sample_width, segment.channels),
+        segment.frame_rate,
+    )
+
+
+def _frames(samples, frame_length):
+    usable = len(samples) - len(samples) % frame_length
+    return samples[:usable].reshape(-1, frame_length)
+
+
+def energy_speech_frames(samples, sample_rate, frame_ms=VAD_FRAME_MS):
+    """Boolean speech flag per frame from RMS energy relative to the noise floor"""
+    frames = _frames(samples, int(sample_rate * frame_ms / 1000))
+    if len(frames) == 0:
+        return np.zeros(0, dtype=bool)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    noise_floor = max(np.percentile(rms, 10), 1e-6)
+    threshold = max(noise_floor * 10 ** (VAD_THRESHOLD_DB / 20), VAD_MIN_RMS)
+    return rms > threshold
+
+
+def webrtc_speech_frames(samples, sample_rate, frame_ms=VAD_FRAME_MS, aggressiveness=2):
+    """Speech flag per frame from WebRTC VAD (expects 16 kHz)"""
+    import webrtcvad
+    vad = webrtcvad.Vad(aggressiveness)
+    frame_length = int(sample_rate * frame_ms / 1000)
+    pcm = array_to_pcm16(samples)
+    frame_bytes = frame_length * 2
+    return np.array([
+        vad.is_speech(pcm[i:i + frame_bytes], sample_rate)
+        for i in range(0, len(pcm) - frame_bytes + 1, frame_bytes)
+    ], dtype=bool)
+
+
+def trim_silence(samples, sample_rate, mode=VAD_MODE):
+    """
+    Cut leading and trailing silence.
+    Returns a VADResult; has_speech is False only when the whole clip stays
+    below VAD_MIN_RMS, so callers can skip the STT request entirely.
+
+    The detector fails open: speech it can't separate from the background
+    (no pauses, steady noise at a low SNR) doesn't clear the threshold, so a
+    clip with too few speech frames is passed to STT untrimmed rather than
+    dropped.
+    """
+    original_seconds = len(samples) / sample_rate if sample_rate else 0.0
+    if mode == "off":
+        return VADResult(samples, sample_rate, len(samples) > 0, original_seconds, original_seconds)
+
+    if mode == "webrtc":
+        speech = webrtc_speech_frames(samples, sample_rate)
+    else:
+        speech = energy_speech_frames(samples, sample_rate)
+
+    frame_length = int(sample_rate * VAD_FRAME_MS / 1000)
+    speech_ms = int(speech.sum()) * VAD_FRAME_MS
+    if speech_ms < VAD_MIN_SPEECH_MS:
+        frames = _frames(samples, frame_length)
+        loudest = np.sqrt(np.mean(frames ** 2, axis=1)).max() if len(frames) else 0.0
+        if loudest < VAD_MIN_RMS:
+            return VADResult(samples[:0], sample_rate, False, original_seconds, 0.0)
+        # Not clearly speech, not clearly silence: let the STT model decide
+        return VADResult(samples, sample_rate, True, original_seconds, original_seconds)
+
+    speech_indices = np.flatnonzero(speech)
+    padding = int(sample_rate * VAD_PADDING_MS / 1000)
+    start = max(speech_indices[0] * frame_length - padding, 0)
+    end = min((speech_indices[-1] + 1) * frame_length + padding, len(samples))
+    trimmed = samples[start:end]
+    return VADResult(trimmed, sample_rate, True, original_seconds, len(trimmed) / sample_rate)
+
+
+def detect_speech(audio_filepath, mode=VAD_MODE):
+    """Load a recording, resample it to 16 kHz mono and trim its silence"""
+    samples, sample_rate = load_audio(audio_filepath)
+    samples = resample(samples, sample_rate, TARGET_SAMPLE_RATE)
+    return trim_silence(samples, TARGET_SAMPLE_RATE, mode)
@@ -0,0 +1,176 @@
+#Opt-in cache of vision analysis results
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# "memory", "sqlite", "redis" (the shared state backend) or empty to disable
+VISION_CACHE_BACKEND = os.environ.get("MEDIVOX_VISION_CACHE", "").lower()
+VISION_CACHE_PATH = os.environ.get("MEDIVOX_VISION_CACHE_PATH", "vision_cache.sqlite3")
+VISION_CACHE_TTL = float(os.environ.get("MEDIVOX_VISION_CACHE_TTL", str(24 * 3600)))
+VISION_CACHE_SIZE = int(os.environ.get("MEDIVOX_VISION_CACHE_SIZE", "256"))
+
+
+def normalize_prompt(prompt):
+    """Lower-case and drop punctuation and extra whitespace so near-identical questions match"""
+    prompt = re.sub(r"[^\w\s]", " ", prompt.lower())
+    return " ".join(prompt.split())
+
+
+def vision_cache_key(image_hash, model, prompt):
+    payload = "\x1f".join([image_hash, model, normalize_prompt(prompt)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryBackend:
+    """In-process LRU with per-entry expiry"""
+
+    def __init__(self, max_items=VISION_CACHE_SIZE):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.time():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._items[key] = (value, time.time() + ttl)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+
+class SQLiteBackend:
+    """Local file cache that survives restarts and is shared by workers on one host"""
+
+    def __init__(self, path=VISION_CACHE_PATH):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS vision_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _connection(self):
+        # sqlite3 connections must stay on the thread that created them
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT value, expires_at FROM vision_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] < time.time():
+            with conn:
+                conn.execute("DELETE FROM vision_cache WHERE key = ?", (key,))
+            return None
+        return row[0]
+
+    def set(self, key, value, ttl):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO vision_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + ttl),
+            )
+
+
+class RedisBackend:
+    """Cache in the shared state backend, so every app worker benefits from each analysis"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key):
+        try:
+            value = self.client.get(f"medivox:vision:{key}")
+        except Exception as e:
+            print(f"Vision cache lookup failed: {e}")
+            return None
+        return value.decode("utf-8") if value is not None else None
+
+    def set(self, key, value, ttl):
+        try:
+            self.client.set(f"medivox:vision:{key}", value, ex=ttl)
+        except Exception as e:
+            print(f"Vision cache write failed: {e}")
+
+
+class VisionCache:
+    """Vision replies keyed by image hash, model and normalized prompt"""
+
+    def __init__(self, backend, ttl=VISION_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value, self.ttl)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    def status_text(self):
+        stats = self.stats()
+        lookups = stats["hits"] + stats["misses"]
+        return f"vision cache {stats['hits']}/{lookups} hits"
+
+
+_vision_cache = None
+_vision_cache_lock = threading.Lock()
+
+
+def get_vision_cache():
+    """Return the configured vision cache, or None when caching is disabled"""
+    global _vision_cache
+    if not VISION_CACHE_BACKEND:
+        return None
+    if _vision_cache is None:
+        with _vision_cache_lock:
+            if _vision_cache is None:
+                if VISION_CACHE_BACKEND == "sqlite":
+                    backend = SQLiteBackend()
+                elif VISION_CACHE_BACKEND == "memory":
+                    backend = MemoryBackend()
+                elif VISION_CACHE_BACKEND == "redis":
+                    from shared_state import get_state_client
+                    client = get_state_client()
+                    if client is None:
+                        raise ValueError("MEDIVOX_VISION_CACHE=redis needs MEDIVOX_SESSION_BACKEND")
+                    backend = RedisBackend(client)
+                else:
+                    raise ValueError(f"Unknown vision cache backend: {VISION_CACHE_BACKEND}")
+                _vision_cache = VisionCache(backend)
+    return _vision_cache
@@ -1,17 +1,196 @@
-# if you dont use pipenv uncomment the following:
-from dotenv import load_dotenv
-load_dotenv()
+# Loads .env once per process (needed if you dont use pipenv)
+import config
 
+import asyncio
 import os
+import shutil
 import subprocess
 import platform
-from gtts import gTTS
-import elevenlabs
-from elevenlabs.client import ElevenLabs
+import queue
+import threading
+import wave
+from concurrent.futures import CancelledError, Future
+from io import BytesIO
 
-ELEVENLABS_API_KEY = os.environ.get("ELEVEN_API_KEY")
+from client_provider import get_elevenlabs_client, get_async_elevenlabs_client
+from tts_cache import get_tts_cache, speech_cache_key
+from admission import limiter
+from turn_graph import get_executor, get_turn_executor
+
+GTTS_LANGUAGE = "en"
+ELEVENLABS_VOICE = "Aria"
+ELEVENLABS_MODEL = "eleven_turbo_v2"
+# Codec of synthesized replies: "mp3", "opus" (Ogg/Opus, about half the bytes at similar quality)
+# or "pcm" (raw 16-bit, nothing to decode; served as WAV). gTTS always produces MP3.
+TTS_FORMAT = os.environ.get("MEDIVOX_TTS_FORMAT", "mp3").lower()
+# ElevenLabs output_format and file extension per codec
+OUTPUT_FORMATS = {
+    "mp3": ("mp3_22050_32", "mp3"),
+    "opus": ("opus_48000_32", "ogg"),
+    "pcm": ("pcm_22050", "wav"),
+}
+if TTS_FORMAT not in OUTPUT_FORMATS:
+    raise ValueError(f"Unknown TTS format: {TTS_FORMAT}")
+# Any other ElevenLabs format of the same codec, e.g. "opus_48000_64" or "pcm_16000"
+ELEVENLABS_OUTPUT_FORMAT = os.environ.get("MEDIVOX_ELEVENLABS_OUTPUT_FORMAT", OUTPUT_FORMATS[TTS_FORMAT][0])
+AUDIO_EXTENSION = OUTPUT_FORMATS[TTS_FORMAT][1]
+# Streamed PCM and Opus are regrouped into playable pieces of about this length
+STREAM_PIECE_SECONDS = 0.25
+# Opus granule positions always count 48 kHz samples
+OPUS_GRANULE_RATE = 48000
+# Granule position of an Ogg page on which no packet ends
+OGG_NO_GRANULE = 0xFFFFFFFFFFFFFFFF
+
+def pcm_to_wav(pcm_bytes, sample_rate, channels=1, sample_width=2):
+    """Wrap raw 16-bit PCM in a WAV container"""
+    buffer = BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(sample_width)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(pcm_bytes)
+    return buffer.getvalue()
+
+def _pcm_sample_rate(output_format):
+    # "pcm_22050" -> 22050
+    return int(output_format.split("_")[1])
+
+def _playable(audio_bytes):
+    """Provider bytes in a form a player (or the browser) can open on its own"""
+    if TTS_FORMAT == "pcm":
+        return pcm_to_wav(audio_bytes, _pcm_sample_rate(ELEVENLABS_OUTPUT_FORMAT))
+    return audio_bytes
+
+def _ogg_crc_entry(index):
+    crc = index << 24
+    for _ in range(8):
+        crc = (crc << 1) ^ 0x04C11DB7 if crc & 0x80000000 else crc << 1
+    return crc & 0xFFFFFFFF
+
+_OGG_CRC_TABLE = [_ogg_crc_entry(i) for i in range(256)]
+
+def _ogg_crc(page):
+    crc = 0
+    for byte in page:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ _OGG_CRC_TABLE[(crc >> 24) ^ byte]
+    return crc
+
+def ogg_pages(data):
+    """Split the complete Ogg pages off the front of data; returns (pages, rest)"""
+    pages = []
+    offset = 0
+    while len(data) - offset >= 27:
+        if data[offset:offset + 4] != b"OggS":
+            raise ValueError("Not an Ogg stream")
+        body_start = offset + 27 + data[offset + 26]
+        if len(data) < body_start:
+            break
+        end = body_start + sum(data[offset + 27:body_start])
+        if len(data) < end:
+            break
+        pages.append(data[offset:end])
+        offset = end
+    return pages, data[offset:]
+
+def _ogg_granule(page):
+    return int.from_bytes(page[6:14], "little")
+
+def _without_pre_skip(headers):
+    """
+    Opus header pages with the pre-skip set to zero. Pieces after the first
+    continue the stream, so the decoder must not drop their first samples.
+    """
+    pages, _ = ogg_pages(headers)
+    head = bytearray(pages[0])
+    body_start = 27 + head[26]
+    # OpusHead: magic (8), version (1), channels (1), pre-skip (2, little-endian)
+    head[body_start + 10:body_start + 12] = b"\x00\x00"
+    # The checksum is computed over the page with its own field zeroed
+    head[22:26] = b"\x00\x00\x00\x00"
+    head[22:26] = _ogg_crc(head).to_bytes(4, "little")
+    return bytes(head) + b"".join(pages[1:])
+
+class PlayableChunks:
+    """
+    Turns provider chunks into independently playable pieces. MP3 chunks
+    pass straight through, since a decoder resyncs on the next frame. Raw
+    PCM is cut on sample boundaries into short WAV pieces. Ogg/Opus is cut
+    between whole pages, and every piece gets the stream's header pages,
+    which only the first chunk carries.
+    """
+
+    def __init__(self):
+        self.pending = b""
+        if TTS_FORMAT == "pcm":
+            self.sample_rate = _pcm_sample_rate(ELEVENLABS_OUTPUT_FORMAT)
+            self.block = int(self.sample_rate * STREAM_PIECE_SECONDS) * 2
+        elif TTS_FORMAT == "opus":
+            self.headers = b""
+            self.pages = []
+            self.pieces = 0
+            self.piece_start = 0
+            self.granule = 0
+
+    def feed(self, chunk):
+        if TTS_FORMAT == "pcm":
+            return self._feed_pcm(chunk)
+        if TTS_FORMAT == "opus":
+            return self._feed_opus(chunk)
+        return [chunk]
+
+    def flush(self):
+        if TTS_FORMAT == "pcm":
+            # A trailing odd byte isn't a whole sample
+            tail = self.pending[:len(self.pending) - len(self.pending) % 2]
+            self.pending = b""
+            return [pcm_to_wav(tail, self.sample_rate)] if tail else []
+        if TTS_FORMAT == "opus":
+            # A torn last page can't be decoded and is dropped
+            return [self._opus_piece()] if self.pages else []
+        return []
+
+    def _feed_pcm(self, chunk):
+        self.pending += chunk
+        pieces = []
+        while len(self.pending) >= self.block:
+            pieces.append(pcm_to_wav(self.pending[:self.block], self.sample_rate))
+            self.pending = self.pending[self.block:]
+        return pieces
+
+    def _feed_opus(self, chunk):
+        self.pending += chunk
+        pages, self.pending = ogg_pages(self.pending)
+        pieces = []
+        for page in pages:
+            granule = _ogg_granule(page)
+            # Header pages (OpusHead, OpusTags) come first and have granule position 0
+            if granule == 0 and not self.pages and not self.pieces:
+                self.headers += page
+                continue
+            # Cut only where a new packet starts, and once a piece is long enough
+            continued = page[5] & 0x01
+            if self.pages and not continued and \
+                    self.granule - self.piece_start >= OPUS_GRANULE_RATE * STREAM_PIECE_SECONDS:
+                pieces.append(self._opus_piece())
+            self.pages.append(page)
+            if granule != OGG_NO_GRANULE:
+                self.granule = granule
+        return pieces
+
+    def _opus_piece(self):
+        headers = self.headers if not self.pieces else _without_pre_skip(self.headers)
+        piece = headers + b"".join(self.pages)
+        self.pages = []
+        self.pieces += 1
+        self.piece_start = self.granule
+        return piece
+
+def _cache_later(key, audio):
+    """Store synthesized audio off the request path; the caller already has the bytes"""
+    get_executor("background").submit(get_tts_cache().put, key, audio, AUDIO_EXTENSION)
 
 def text_to_speech_with_gtts_old(input_text, output_filepath):
+    from gtts import gTTS
     language = "en"
     audioobj = gTTS(
         text=input_text,
@@ -21,7 +200,8 @@ def text_to_speech_with_gtts_old(input_text, output_filepath):
     audioobj.save(output_filepath)
 
 def text_to_speech_with_elevenlabs_old(input_text, output_filepath):
-    client = ElevenLabs(api_key=ELEVENLABS_API_KEY)
+    import elevenlabs
+    client = get_elevenlabs_client()
     audio = client.generate(
         text=input_text,
         voice="Aria",
@@ -30,57 +210,253 @@ def text_to_speech_with_elevenlabs_old(input_text, output_filepath):
     )
     elevenlabs.save(audio, output_filepath)
 
+# Linux players in order of preference, with the file types each can open
+LINUX_PLAYERS = [
+    (["mpg123", "-q"], {".mp3"}),
+    (["ffplay", "-nodisp", "-autoexit", "-loglevel", "quiet"], None),
+    (["aplay", "-q"], {".wav"}),
+]
+
+_players = None
+_players_lock = threading.Lock()
+
+def detect_players():
+    """
+    Audio players available on this machine as (command, extensions) pairs,
+    extensions None meaning any file. Probed once per process.
+    """
+    global _players
+    with _players_lock:
+        if _players is None:
+            os_name = platform.system()
+            if os_name == "Darwin":  # macOS
+                _players = [(["afplay"], None)]
+            elif os_name == "Windows":
+                # Windows Media Player handles MP3, unlike SoundPlayer; it plays detached
+                _players = [(["powershell", "-c", "Start-Process -WindowStyle Hidden -FilePath wmplayer.exe -ArgumentList"], None)]
+            elif os_name == "Linux":
+                _players = [(command, extensions) for command, extensions in LINUX_PLAYERS if shutil.which(command[0])]
+            else:
+                _players = []
+        return _players
+
+def player_command(filepath):
+    """Command line that plays filepath, or None when no installed player can open it"""
+    extension = os.path.splitext(filepath)[1].lower()
+    for command, extensions in detect_players():
+        if extensions is None or extension in extensions:
+            if command[0] == "powershell":
+                return command[:-1] + [f'{command[-1]} "{filepath}"']
+            return command + [filepath]
+    return None
+
 def play_audio_file(filepath):
     """
-    Improved audio playback function for different operating systems
+    Play filepath and wait until it ends; see PlaybackQueue for non-blocking playback
     """
-    os_name = platform.system()
     try:
-        if os_name == "Darwin":  # macOS
-            subprocess.run(['afplay', filepath], check=True)
-        elif os_name == "Windows":  # Windows
-            # Use Windows Media Player instead of SoundPlayer for MP3 support
-            subprocess.run([
-                'powershell', '-c', 
-                f'Start-Process -FilePath "wmplayer.exe" -ArgumentList "{filepath}" -WindowStyle Hidden'
-            ], check=True)
-        elif os_name == "Linux":  # Linux
-            # Try multiple players
-            for player in ['mpg123', 'ffplay', 'aplay']:
-                try:
-                    subprocess.run([player, filepath], check=True)
-                    break
-                except (subprocess.CalledProcessError, FileNotFoundError):
-                    continue
-            else:
-                raise OSError("No suitable audio player found")
-        else:
-            raise OSError("Unsupported operating system")
+        command = player_command(filepath)
+        if command is None:
+            raise OSError("No suitable audio player found")
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
     except Exception as e:
         print(f"An error occurred while trying to play the audio: {e}")
         print(f"Audio file saved to: {filepath}")
 
-def text_to_speech_with_gtts(input_text, output_filepath):
-    language = "en"
+class PlaybackQueue:
+    """
+    Plays audio files one after another on a background thread, so the
+    caller can record the next question while the doctor is speaking.
+
+    Queued items are paths or Futures of paths: synthesis of the next
+    sentence runs while the current one plays. interrupt() stops the clip
+    that is playing and drops everything queued (barge-in).
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        # Bumped by interrupt(); items queued under an older generation are skipped
+        self._generation = 0
+        self._pending = 0
+        self._process = None
+        self._idle = threading.Event()
+        self._idle.set()
+        self._thread = threading.Thread(target=self._run, name="medivox-playback", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, item):
+        """Queue a path (or a Future of one) behind whatever is already playing"""
+        with self._lock:
+            self._pending += 1
+            self._idle.clear()
+            self._queue.put((self._generation, item))
+
+    def speak(self, text, synthesize):
+        """Start synthesize(text) now and play the result when its turn comes"""
+        future = get_turn_executor().submit(synthesize, text)
+        self.enqueue(future)
+        return future
+
+    def interrupt(self):
+        """Stop playback now and forget everything queued"""
+        with self._lock:
+            self._generation += 1
+            process = self._process
+            while True:
+                try:
+                    _, item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if isinstance(item, Future):
+                    item.cancel()
+                self._done()
+        if process is not None and process.poll() is None:
+            process.terminate()
+
+    def wait_until_idle(self, timeout=None):
+        """Block until everything queued has played; False on timeout"""
+        return self._idle.wait(timeout)
+
+    @property
+    def playing(self):
+        return not self._idle.is_set()
+
+    def _done(self):
+        # Caller holds the lock
+        self._pending -= 1
+        if self._pending == 0:
+            self._idle.set()
+
+    def _run(self):
+        while True:
+            generation, item = self._queue.get()
+            try:
+                filepath = item.result() if isinstance(item, Future) else item
+                if filepath:
+                    self._play(filepath, generation)
+            except CancelledError:
+                pass
+            except Exception as e:
+                print(f"An error occurred while trying to play the audio: {e}")
+            finally:
+                with self._lock:
+                    self._done()
+
+    def _play(self, filepath, generation):
+        command = player_command(filepath)
+        if command is None:
+            print(f"No suitable audio player found; audio file saved to: {filepath}")
+            return
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            self._process.wait()
+        finally:
+            with self._lock:
+                self._process = None
+
+_playback = None
+_playback_lock = threading.Lock()
+
+def get_playback_queue():
+    """Return the process-wide playback queue, starting its thread on first use"""
+    global _playback
+    with _playback_lock:
+        if _playback is None:
+            _playback = PlaybackQueue()
+        return _playback
+
+def wait_for_playback(timeout=None):
+    """Wait for queued speech to finish; returns at once if nothing was ever queued"""
+    if _playback is None:
+        return True
+    return _playback.wait_until_idle(timeout)
+
+def speak(text_chunks, synthesize=None):
+    """
+    Queue a reply for playback sentence by sentence and return without
+    waiting. text_chunks is a string or an iterator of streamed LLM text;
+    each sentence is synthesized while the previous one plays.
+    """
+    from brain_of_the_doctor import iter_sentences
+    if synthesize is None:
+        from tts_backends import get_tts_backend
+        synthesize = get_tts_backend().synthesize
+    if isinstance(text_chunks, str):
+        text_chunks = [text_chunks]
+    playback = get_playback_queue()
+    return [playback.speak(sentence, synthesize) for sentence in iter_sentences(text_chunks)]
+
+def _gtts_bytes(input_text):
+    # gTTS is only imported when it is the configured backend or the fallback
+    from gtts import gTTS
     audioobj = gTTS(
         text=input_text,
-        lang=language,
+        lang=GTTS_LANGUAGE,
         slow=False
     )
-    audioobj.save(output_filepath)
-    play_audio_file(output_filepath)
+    buffer = BytesIO()
+    audioobj.write_to_fp(buffer)
+    return buffer.getvalue()
+
+def _elevenlabs_bytes(input_text):
+    client = get_elevenlabs_client()
+    with limiter("tts").slot():
+        audio = client.generate(
+            text=input_text,
+            voice=ELEVENLABS_VOICE,
+            output_format=ELEVENLABS_OUTPUT_FORMAT,
+            model=ELEVENLABS_MODEL
+        )
+        return _playable(b"".join(audio))
+
+def _gtts_key(input_text):
+    return speech_cache_key(input_text, GTTS_LANGUAGE, "gtts", "mp3")
+
+def _elevenlabs_key(input_text):
+    return speech_cache_key(input_text, ELEVENLABS_VOICE, ELEVENLABS_MODEL, ELEVENLABS_OUTPUT_FORMAT)
+
+def synthesize_with_gtts(input_text):
+    """Return the path of a cached gTTS rendering of input_text"""
+    return get_tts_cache().get_or_create(_gtts_key(input_text), lambda: _gtts_bytes(input_text))
+
+def synthesize_with_elevenlabs(input_text):
+    """Return the path of a cached ElevenLabs rendering of input_text"""
+    return get_tts_cache().get_or_create(
+        _elevenlabs_key(input_text), lambda: _elevenlabs_bytes(input_text), extension=AUDIO_EXTENSION
+    )
+
+def speech_bytes_with_elevenlabs(input_text):
+    """
+    ElevenLabs rendering of input_text as bytes, for handing to the client
+    directly. A miss is returned as soon as the provider finishes and is
+    written to the cache in the background.
+    """
+    key = _elevenlabs_key(input_text)
+    cached_path = get_tts_cache().get(key, AUDIO_EXTENSION)
+    if cached_path is not None:
+        return _read_file(cached_path)
+    audio = _elevenlabs_bytes(input_text)
+    _cache_later(key, audio)
+    return audio
+
+def tts_cache_stats():
+    """Hit/miss counters of the shared speech cache"""
+    return get_tts_cache().stats()
+
+def text_to_speech_with_gtts(input_text, output_filepath):
+    """Save speech to output_filepath and queue it for playback without waiting for it to end"""
+    shutil.copyfile(synthesize_with_gtts(input_text), output_filepath)
+    get_playback_queue().enqueue(output_filepath)
     return output_filepath
 
 def text_to_speech_with_elevenlabs(input_text, output_filepath):
-    client = ElevenLabs(api_key=ELEVENLABS_API_KEY)
-    audio = client.generate(
-        text=input_text,
-        voice="Aria",
-        output_format="mp3_22050_32",
-        model="eleven_turbo_v2"
-    )
-    elevenlabs.save(audio, output_filepath)
-    play_audio_file(output_filepath)
+    """Save speech to output_filepath and queue it for playback without waiting for it to end"""
+    shutil.copyfile(synthesize_with_elevenlabs(input_text), output_filepath)
+    get_playback_queue().enqueue(output_filepath)
     return output_filepath
 
 # Alternative function without auto-play (for Gradio)
@@ -88,12 +464,95 @@ def text_to_speech_with_elevenlabs_no_play(input_text, output_filepath):
     """
     Generate speech without auto-playing (better for web interfaces)
     """
-    client = ElevenLabs(api_key=ELEVENLABS_API_KEY)
-    audio = client.generate(
-        text=input_text,
-        voice="Aria",
-        output_format="mp3_22050_32",
-        model="eleven_turbo_v2"
-    )
-    elevenlabs.save(audio, output_filepath)
-    return output_filepath
\ No newline at end of file
+    shutil.copyfile(synthesize_with_elevenlabs(input_text), output_filepath)
+    return output_filepath
+
+def _elevenlabs_chunks(input_text):
+    client = get_elevenlabs_client()
+    with limiter("tts").slot():
+        audio_stream = client.generate(
+            text=input_text,
+            voice=ELEVENLABS_VOICE,
+            output_format=ELEVENLABS_OUTPUT_FORMAT,
+            model=ELEVENLABS_MODEL,
+            stream=True
+        )
+        for chunk in audio_stream:
+            if chunk:
+                yield chunk
+
+def stream_speech_with_elevenlabs(input_text):
+    """
+    Yield playable audio chunks straight from ElevenLabs' iterator (for streaming playback).
+    Cached phrases are replayed from disk; new ones are stored in the background once complete.
+    """
+    key = _elevenlabs_key(input_text)
+    cached_path = get_tts_cache().get(key, AUDIO_EXTENSION)
+    if cached_path is not None:
+        yield _read_file(cached_path)
+        return
+
+    chunks = []
+    playable = PlayableChunks()
+    for chunk in _elevenlabs_chunks(input_text):
+        chunks.append(chunk)
+        yield from playable.feed(chunk)
+    yield from playable.flush()
+    _cache_later(key, _playable(b"".join(chunks)))
+
+async def _elevenlabs_chunks_async(input_text):
+    client = get_async_elevenlabs_client()
+    async with limiter("tts").slot_async():
+        audio_stream = await client.generate(
+            text=input_text,
+            voice=ELEVENLABS_VOICE,
+            output_format=ELEVENLABS_OUTPUT_FORMAT,
+            model=ELEVENLABS_MODEL,
+            stream=True
+        )
+        async for chunk in audio_stream:
+            if chunk:
+                yield chunk
+
+async def stream_speech_with_elevenlabs_async(input_text):
+    """
+    Async version of stream_speech_with_elevenlabs
+    """
+    cache = get_tts_cache()
+    key = _elevenlabs_key(input_text)
+    cached_path = await asyncio.to_thread(cache.get, key, AUDIO_EXTENSION)
+    if cached_path is not None:
+        yield await asyncio.to_thread(_read_file, cached_path)
+        return
+
+    chunks = []
+    playable = PlayableChunks()
+    async for chunk in _elevenlabs_chunks_async(input_text):
+        chunks.append(chunk)
+        for piece in playable.feed(chunk):
+            yield piece
+    for piece in playable.flush():
+        yield piece
+    _cache_later(key, _playable(b"".join(chunks)))
+
+async def synthesize_with_elevenlabs_async(input_text):
+    """Async version of synthesize_with_elevenlabs"""
+    cache = get_tts_cache()
+    key = _elevenlabs_key(input_text)
+    cached_path = await asyncio.to_thread(cache.get, key, AUDIO_EXTENSION)
+    if cached_path is not None:
+        return cached_path
+    audio = _playable(b"".join([chunk async for chunk in _elevenlabs_chunks_async(input_text)]))
+    return await asyncio.to_thread(cache.put, key, audio, AUDIO_EXTENSION)
+
+async def text_to_speech_with_elevenlabs_async(input_text, output_filepath):
+    """
+    Generate speech without blocking the event loop and save it to output_filepath
+    """
+    cached_path = await synthesize_with_elevenlabs_async(input_text)
+    await asyncio.to_thread(shutil.copyfile, cached_path, output_filepath)
+    return output_filepath
+
+def _read_file(filepath):
+    with open(filepath, "rb") as f:
+        return f.read()
@@ -1,17 +1,43 @@
-# if you dont use pipenv uncomment the following:
-from dotenv import load_dotenv
-load_dotenv()
+# Loads .env once per process (needed if you dont use pipenv)
+import config
 
 import logging
-import speech_recognition as sr
-from pydub import AudioSegment
 from io import BytesIO
 import os
-from groq import Groq
+import asyncio
+from audio_utils import TARGET_SAMPLE_RATE, CAPTURE_FORMAT, pcm_to_array, resample, encode_audio
+from vad import trim_silence
+from stt_backends import GroqTranscriptionBackend, get_transcription_backend
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def record_audio(file_path, timeout=20, phrase_time_limit=None):
+def _calibrate(recognizer, source, barge_in):
+    """
+    Measure ambient noise once the microphone is open. Without barge-in this
+    waits for queued speech to finish first, so the doctor is neither
+    recorded nor mistaken for background noise; with it, the doctor's voice
+    raises the threshold, which keeps it from interrupting itself.
+    """
+    from voice_of_the_doctor import wait_for_playback
+    if not barge_in:
+        wait_for_playback()
+    logging.info("Adjusting for ambient noise...")
+    recognizer.adjust_for_ambient_noise(source, duration=1)
+
+def _listen(recognizer, source, timeout, phrase_time_limit, barge_in):
+    """recognizer.listen, optionally stopping the doctor's voice as soon as the patient starts talking"""
+    if not barge_in:
+        return recognizer.listen(source, timeout=timeout, phrase_time_limit=phrase_time_limit)
+    import speech_recognition as sr
+    from voice_of_the_doctor import get_playback_queue
+    chunks = []
+    for chunk in recognizer.listen(source, timeout=timeout, phrase_time_limit=phrase_time_limit, stream=True):
+        if not chunks:
+            get_playback_queue().interrupt()
+        chunks.append(chunk.get_raw_data())
+    return sr.AudioData(b"".join(chunks), source.SAMPLE_RATE, source.SAMPLE_WIDTH)
+
+def record_audio(file_path, timeout=20, phrase_time_limit=None, barge_in=False):
     """
     Simplified function to record audio from the microphone and save it as an MP3 file.
 
@@ -19,17 +45,22 @@ def record_audio(file_path, timeout=20, phrase_time_limit=None):
     file_path (str): Path to save the recorded audio file.
     timeout (int): Maximum time to wait for a phrase to start (in seconds).
     phrase_time_limit (int): Maximum time for the phrase to be recorded (in seconds).
+    barge_in (bool): Listen while the doctor is still speaking and cut them off when the
+        patient starts talking (best with headphones). Otherwise recording starts once
+        queued speech has played.
     """
+    # Microphone and ffmpeg support are only needed on the command-line path
+    import speech_recognition as sr
+    from pydub import AudioSegment
     recognizer = sr.Recognizer()
     
     try:
         with sr.Microphone() as source:
-            logging.info("Adjusting for ambient noise...")
-            recognizer.adjust_for_ambient_noise(source, duration=1)
+            _calibrate(recognizer, source, barge_in)
             logging.info("Start speaking now...")
             
             # Record the audio
-            audio_data = recognizer.listen(source, timeout=timeout, phrase_time_limit=phrase_time_limit)
+            audio_data = _listen(recognizer, source, timeout, phrase_time_limit, barge_in)
             logging.info("Recording complete.")
             
             # Convert the recorded audio to an MP3 file
@@ -47,6 +78,44 @@ def record_audio(file_path, timeout=20, phrase_time_limit=None):
         logging.error(f"An error occurred during recording: {e}")
         return None
 
+def record_audio_to_buffer(timeout=20, phrase_time_limit=None, audio_format=None, barge_in=False):
+    """
+    Record from the microphone without touching the disk or ffmpeg.
+    The capture is downmixed/resampled to 16 kHz mono, trimmed of silence and encoded in memory
+    (WAV by default, FLAC or Opus via MEDIVOX_CAPTURE_FORMAT).
+
+    Returns (audio_bytes, filename) ready for transcribe_audio, or None.
+    barge_in works as in record_audio.
+    """
+    import speech_recognition as sr
+    recognizer = sr.Recognizer()
+    
+    try:
+        with sr.Microphone() as source:
+            _calibrate(recognizer, source, barge_in)
+            logging.info("Start speaking now...")
+            
+            audio_data = _listen(recognizer, source, timeout, phrase_time_limit, barge_in)
+            logging.info("Recording complete.")
+            
+        samples = pcm_to_array(audio_data.get_raw_data(), audio_data.sample_width)
+        samples = resample(samples, audio_data.sample_rate, TARGET_SAMPLE_RATE)
+        vad_result = trim_silence(samples, TARGET_SAMPLE_RATE)
+        if not vad_result.has_speech:
+            logging.error("No speech detected in the recording")
+            return None
+        samples = vad_result.samples
+        audio_bytes, filename = encode_audio(samples, TARGET_SAMPLE_RATE, audio_format or CAPTURE_FORMAT)
+        logging.info(f"Captured {len(samples) / TARGET_SAMPLE_RATE:.1f}s as {filename} ({len(audio_bytes)} bytes)")
+        return audio_bytes, filename
+
+    except sr.WaitTimeoutError:
+        logging.error("No speech detected within timeout period")
+        return None
+    except Exception as e:
+        logging.error(f"An error occurred during recording: {e}")
+        return None
+
 def transcribe_with_groq(stt_model, audio_filepath, GROQ_API_KEY):
     """
     Transcribe audio file using Groq's Whisper model
@@ -55,25 +124,61 @@ def transcribe_with_groq(stt_model, audio_filepath, GROQ_API_KEY):
         raise ValueError("Audio file not found or invalid path")
     
     try:
-        client = Groq(api_key=GROQ_API_KEY)
+        # Pooled client; GROQ_API_KEY is kept in the signature for compatibility
+        text = GroqTranscriptionBackend(model=stt_model).transcribe(audio_filepath)
+
+        if not text:
+            return "No speech detected in the audio"
+            
+        return text
         
-        with open(audio_filepath, "rb") as audio_file:
-            transcription = client.audio.transcriptions.create(
-                model=stt_model,
-                file=audio_file,
-                language="en"
-            )
-
-        if not transcription.text or transcription.text.strip() == "":
+    except Exception as e:
+        logging.error(f"Transcription error: {e}")
+        raise Exception(f"Failed to transcribe audio: {str(e)}")
+
+async def transcribe_with_groq_async(stt_model, audio_filepath, GROQ_API_KEY=None):
+    """
+    Async version of transcribe_with_groq using the pooled AsyncGroq client
+    """
+    if not audio_filepath or not os.path.exists(audio_filepath):
+        raise ValueError("Audio file not found or invalid path")
+    
+    try:
+        text = await GroqTranscriptionBackend(model=stt_model).transcribe_async(audio_filepath)
+
+        if not text:
             return "No speech detected in the audio"
             
-        return transcription.text
+        return text
         
+    except asyncio.CancelledError:
+        raise
     except Exception as e:
         logging.error(f"Transcription error: {e}")
         raise Exception(f"Failed to transcribe audio: {str(e)}")
 
-# Test function
+def transcribe_audio(audio, filename="audio.wav"):
+    """
+    Transcribe a file path or audio bytes with the configured STT backend
+    (MEDIVOX_STT_BACKEND). Returns an empty string when no speech was found.
+    """
+    return get_transcription_backend().transcribe(audio, filename)
+
+async def transcribe_audio_async(audio, filename="audio.wav"):
+    """Async version of transcribe_audio"""
+    return await get_transcription_backend().transcribe_async(audio, filename)
+
+# Test functions
+def test_recording_in_memory():
+    print("Testing in-memory recording...")
+    captured = record_audio_to_buffer(timeout=10)
+    if not captured:
+        print("Recording failed")
+        return None
+    text = transcribe_audio(*captured)
+    print(f"Transcription: {text}")
+    return text
+
 def test_recording():
     audio_filepath = "test_recording.mp3"
     print("Testing audio recording...")
@@ -88,4 +193,5 @@ def test_recording():
 if __name__ == "__main__":
     # Uncomment to test
     # test_recording()
+    # test_recording_in_memory()
     pass
\ No newline at end of file